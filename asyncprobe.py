@@ -0,0 +1,272 @@
+import asyncio
+import socket
+import os
+import time
+
+from ping import echo_template, decode_reply, enable_rx_timestamps, icmp_socket, PacketReader
+from traceroute import probe_id, make_record
+from rdns import shared_resolver
+
+# TTL for probes that don't ask for one (Linux's net.ipv4.ip_default_ttl)
+DEFAULT_TTL = 64
+
+# seconds between attempts to send into a full socket buffer
+SEND_RETRY = 0.001
+
+class AsyncIcmpSocket:
+    """
+    One raw ICMP socket registered with the event loop via loop.add_reader.
+    Every outstanding probe is a future keyed by (ICMP id, seq); the reader callback
+    resolves it when the matching reply arrives, so any number of pings/traces can
+    share one socket and one loop without a thread per probe.
+    """
+    RCVBUF = 4 * 1024 * 1024
+
+    def __init__(self, loop=None, kernel_ts=False):
+        self.loop = loop or asyncio.get_running_loop()
+        self.sock = icmp_socket()
+        self.sock.setblocking(False)
+        # bursts of replies from many concurrent probes overflow the default receive buffer
+        try:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.RCVBUF)
+        except OSError:
+            pass
+        # time replies with the kernel's receive timestamp (SO_TIMESTAMPNS)
+        self.kernel_ts = kernel_ts and enable_rx_timestamps(self.sock)
+        self.reader = PacketReader(self.sock, 4096, self.kernel_ts)
+        # (id, seq) -> (future, dest_ip)
+        self.waiters = {}
+        self.next_seq = 0
+        self.loop.add_reader(self.sock.fileno(), self._on_readable)
+
+    def close(self):
+        if self.sock is None:
+            return
+        self.loop.remove_reader(self.sock.fileno())
+        self.sock.close()
+        self.sock = None
+        for fut, _ in self.waiters.values():
+            if not fut.done():
+                fut.cancel()
+        self.waiters.clear()
+
+    def alloc_seq(self, ID):
+        """next seq not already waiting on a reply for this id"""
+        for _ in range(0x10000):
+            seq = self.next_seq
+            self.next_seq = (self.next_seq + 1) & 0xFFFF
+            if (ID, seq) not in self.waiters:
+                return seq
+        raise RuntimeError(f"all 65536 seqs in flight for id {ID}")
+
+    async def probe(self, dest_ip, ID, seq, timeout, ttl=None):
+        """
+        Send one Echo Request and wait for whatever answers it.
+        Returns (send_time, reply, err) where reply is (fields, addr, recv_time, rtt, size) or None:
+        fields as from ping.decode_reply, rtt in ms on the perf_counter clock, recv_time wall
+        clock, size the packet length. err is None, or why the probe couldn't be sent (as
+        multiping records it); reply and err both None means it timed out.
+        """
+        key = (ID, seq)
+        fut = self.loop.create_future()
+        self.waiters[key] = (fut, dest_ip)
+        deadline = time.monotonic() + timeout
+        try:
+            while True:
+                # setsockopt + sendto run back to back on the loop, so per-probe TTLs can't interleave;
+                # set every time, or a ping after a trace on the shared socket would go out with a hop's TTL
+                self.sock.setsockopt(socket.SOL_IP, socket.IP_TTL, ttl or DEFAULT_TTL)
+                send_time = time.time()
+                packet = echo_template(ID).build(seq, send_time)
+                send_ns = time.perf_counter_ns()
+                try:
+                    self.sock.sendto(packet, (dest_ip, 1))
+                    break
+                except BlockingIOError as e:
+                    # send buffer full: give the loop a moment to drain it, within the timeout
+                    if time.monotonic() >= deadline:
+                        return send_time, None, f"Send failed: {e}"
+                    await asyncio.sleep(SEND_RETRY)
+                except OSError as e:
+                    # e.g. no route to the host
+                    return send_time, None, f"Send failed: {e}"
+            try:
+                fields, addr, recv_time, recv_ns, size = await asyncio.wait_for(
+                    fut, max(0.0, deadline - time.monotonic()))
+            except asyncio.TimeoutError:
+                return send_time, None, None
+            return send_time, (fields, addr, recv_time, (recv_ns - send_ns) / 1e6, size), None
+        finally:
+            self.waiters.pop(key, None)
+
+    def _on_readable(self):
+        reader = self.reader
+        while True:
+            try:
+                n, addr, recv_time, recv_ns = reader.recv()
+            except (BlockingIOError, InterruptedError):
+                return
+            fields = decode_reply(reader.view, n)
+            if fields is None:
+                continue
+            icmp_type, _, reply_id, reply_seq, _, icmp_off, _ = fields
+            # type 8 is our own request seen on loopback
+            if icmp_type not in (0, 3, 11):
+                continue
+            waiter = self.waiters.get((reply_id, reply_seq))
+            if waiter is None:
+                continue
+            fut, dest_ip = waiter
+            if fut.done() or (icmp_type == 0 and addr[0] != dest_ip):
+                continue
+            if not reader.verify(n, icmp_off):
+                continue
+            fut.set_result((fields, addr, recv_time, recv_ns, n))
+
+# one shared socket per event loop
+_SHARED = {}
+
+def shared_socket():
+    """the AsyncIcmpSocket for the running loop, created on first use"""
+    loop = asyncio.get_running_loop()
+    icmp = _SHARED.get(loop)
+    if icmp is None or icmp.sock is None:
+        icmp = _SHARED[loop] = AsyncIcmpSocket(loop)
+    return icmp
+
+def close_shared_socket():
+    icmp = _SHARED.pop(asyncio.get_running_loop(), None)
+    if icmp is not None:
+        icmp.close()
+
+async def resolve(host):
+    """non-blocking gethostbyname"""
+    loop = asyncio.get_running_loop()
+    infos = await loop.getaddrinfo(host, None, family=socket.AF_INET)
+    return infos[0][4][0]
+
+async def async_ping(host, timeout=1.0, seq_num=None, icmp=None):
+    """
+    Coroutine version of ping.ping(): returns the same response dict.
+        seq_num: recorded as "seq" (the wire seq is allocated per socket so concurrent pings never collide)
+        icmp: AsyncIcmpSocket to use (default: the loop's shared one)
+    """
+    icmp = icmp or shared_socket()
+    dest = await resolve(host)
+    ID = os.getpid() & 0xFFFF
+    seq = icmp.alloc_seq(ID)
+    send_time, reply, err = await icmp.probe(dest, ID, seq, timeout)
+
+    response = {
+        "ts_send": send_time,
+        "dst_ip": dest,
+        "id": ID,
+        "seq": seq if seq_num is None else seq_num
+    }
+    if err is not None:
+        response["err"] = err
+        return response
+    if reply is None:
+        response["err"] = f"Request timed out. after: {timeout}s"
+        return response
+
+    fields, addr, recv_time, rtt, size = reply
+    icmp_type, icmp_code, _, _, ttl_reply, _, _ = fields
+    response["icmp_type"] = icmp_type
+    response["icmp_code"] = icmp_code
+    if icmp_type == 0:
+        response["ts_recv"] = recv_time
+        response["ttl_reply"] = ttl_reply
+        response["size"] = size
+        response["rtt"] = rtt
+    elif icmp_type == 3:
+        response["err"] = f"Destination unreachable (code={icmp_code}) from {addr[0]}"
+    else:
+        response["err"] = f"Time exceeded from {addr[0]}"
+    return response
+
+async def async_reverse_lookup(ip, timeout_ms=200):
+    """reverse_lookup() without blocking the loop: same resolver pool and cache as traceroute"""
+    resolver = shared_resolver()
+    fut = resolver.prefetch(ip)
+    if fut is None:
+        return resolver.cached(ip)
+    try:
+        # shield: a lookup that runs over still finishes and lands in the cache
+        return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(fut)), timeout_ms / 1000.0)
+    except asyncio.TimeoutError:
+        return None
+
+async def async_get_route(hostname, max_ttl=30, timeout=2.0, probes=3, flow_id=0, logger=None, no_resolve=False, rdns=False, window=0, icmp=None):
+    """
+    Coroutine traceroute: every probe in a window of TTLs is in flight at once on the
+    shared socket. Returns the same per-probe records as get_route (in TTL order, cut at
+    the first TTL that reaches the destination) instead of printing them. Once the
+    destination answers, probes beyond it aren't waited for and no further window is sent.
+        window: number of TTLs probed together (0 = all of 1..max_ttl)
+    """
+    icmp = icmp or shared_socket()
+    dest_ip = await resolve(hostname)
+    ID = probe_id(flow_id)
+    window = window if window > 0 else max_ttl
+    responses = []
+
+    # lowest TTL the destination answered at (None = not yet)
+    reached = None
+
+    for first_ttl in range(1, max_ttl + 1, window):
+        ttls = range(first_ttl, min(first_ttl + window, max_ttl + 1))
+        keys = [(ttl, p) for ttl in ttls for p in range(1, probes + 1)]
+        tasks = {asyncio.ensure_future(icmp.probe(dest_ip, ID, icmp.alloc_seq(ID), timeout, ttl=ttl)): (ttl, p)
+                 for ttl, p in keys}
+        answers = {}
+        pending = set(tasks)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    key = tasks[task]
+                    answers[key] = task.result()
+                    reply = answers[key][1]
+                    if reply is not None and reply[0][0] == 0 and reply[1][0] == dest_ip:
+                        reached = key[0] if reached is None else min(reached, key[0])
+                if reached is not None:
+                    # probes beyond the destination can't change the result: stop waiting on them
+                    for task in [t for t in pending if tasks[t][0] > reached]:
+                        task.cancel()
+                        pending.discard(task)
+        finally:
+            # on an error (or our own cancellation) don't leave the rest of the window running
+            for task in pending:
+                task.cancel()
+        keys = [key for key in keys if key in answers]
+        if rdns and not no_resolve:
+            # start every hop's lookup now so the awaits below mostly find them done
+            for _, reply, _ in answers.values():
+                if reply is not None:
+                    shared_resolver().prefetch(reply[1][0])
+
+        for ttl, probe_num in keys:
+            send_time, reply, err = answers[(ttl, probe_num)]
+            if reply is None:
+                response_record = {
+                    "ttl": ttl,
+                    "err": err or "timeout"
+                }
+            else:
+                fields, addr, recv_time, rtt, _ = reply
+                response_record = make_record(hostname, dest_ip, ttl, probe_num, flow_id,
+                                              send_time, recv_time, fields, addr, rtt=rtt)
+                if rdns and not no_resolve:
+                    name = await async_reverse_lookup(addr[0], timeout_ms=200)
+                    if name:
+                        response_record["router_name"] = name
+
+            responses.append(response_record)
+            if logger:
+                logger.jsonl_write(response_record)
+            if reply is not None and response_record["type"] == 0 and response_record["src"] == dest_ip:
+                # no further windows once the destination has answered
+                return responses
+
+    return responses
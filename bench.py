@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+import ping
+import traceroute
+import jsonhelper
+from netsim import ip_header, icmp_message
+
+# Benchmarks for the hot paths: checksums, packet build/parse, JSONL writing and the
+# summarizers. `bench.py run --out base.json` records ns/op per benchmark, and
+# `bench.py compare base.json new.json` flags anything that got slower than a threshold.
+
+# Corpus: replies as a raw socket would hand them over (IP header + ICMP)
+
+def _echo_request(ID, seq):
+    return ping.echo_template(ID).build(seq, time.time())
+
+def echo_reply(ID, seq, src="192.0.2.1"):
+    request = _echo_request(ID, seq)
+    reply = icmp_message(0, 0, request[4:8], request[8:])
+    return ip_header(src, "10.0.0.1", 57, len(reply)) + reply
+
+def time_exceeded(ID, seq, quote=None, src="198.51.100.1"):
+    """quote: ICMP bytes of the request quoted (None = all, 8 = RFC 792 minimum)"""
+    request = _echo_request(ID, seq)
+    quoted = request if quote is None else request[:quote]
+    reply = icmp_message(11, 0, b"\0\0\0\0", ip_header("10.0.0.1", "192.0.2.1", 1, len(request)) + quoted)
+    return ip_header(src, "10.0.0.1", 250, len(reply)) + reply
+
+def corrupt(packet):
+    """flip one byte of the ICMP part, so its checksum no longer verifies"""
+    packet = bytearray(packet)
+    packet[-1] ^= 0xff
+    return bytes(packet)
+
+def make_corpus(n=1000, seed=0):
+    """n packets, a mix of echo replies, full and truncated Time Exceeded, and corrupt ones"""
+    rnd = random.Random(seed)
+    kinds = [
+        lambda i: echo_reply(0x1234, i),
+        lambda i: time_exceeded(0x1234, i),
+        lambda i: time_exceeded(0x1234, i, quote=8),
+        lambda i: corrupt(echo_reply(0x1234, i)),
+    ]
+    return [rnd.choice(kinds)(i & 0xFFFF) for i in range(n)]
+
+# Synthetic logs shaped like the CLIs' JSONL
+
+def write_ping_log(path, lines, seed=0):
+    rnd = random.Random(seed)
+    with open(path, "w") as f:
+        for i in range(lines):
+            obj = {"tool": "ping", "ts_send": 1.7e9 + i, "dst_ip": "192.0.2.1", "id": 4660, "seq": i & 0xFFFF}
+            if rnd.random() < 0.02:
+                obj["err"] = "Request timed out. after: 1.0s"
+            else:
+                obj.update({"icmp_type": 0, "icmp_code": 0, "ts_recv": 1.7e9 + i + 0.02, "ttl_reply": 57,
+                            "size": 36, "rtt": rnd.lognormvariate(3.0, 0.3)})
+            f.write(json.dumps(obj) + "\n")
+
+def write_trace_log(path, lines, hops=12, seed=0):
+    rnd = random.Random(seed)
+    with open(path, "w") as f:
+        for i in range(lines):
+            ttl = i % hops + 1
+            if rnd.random() < 0.05 or ttl == 4:
+                obj = {"ttl": ttl, "err": "timeout", "tool": "trace"}
+            else:
+                obj = {"dst": "192.0.2.1", "dst_ip": "192.0.2.1", "ttl": ttl, "probe": i % 3 + 1, "flow_id": 0,
+                       "ts_send": 1.7e9 + i, "ts_recv": 1.7e9 + i + 0.01, "src": f"198.51.100.{ttl}",
+                       "router_ip": f"198.51.100.{ttl}", "router_name": None, "rtt": rnd.lognormvariate(ttl * 0.3, 0.2),
+                       "payload_ts": 1.7e9 + i, "type": 11, "code": 0, "err": None, "tool": "trace"}
+            f.write(json.dumps(obj) + "\n")
+
+# Benchmarks: each setup returns (run, ops) where run() does ops operations
+
+def bench_checksum(size):
+    def setup(ctx):
+        data = os.urandom(size)
+        checksum = ping.checksum
+        def run():
+            for _ in range(1000):
+                checksum(data)
+        return run, 1000
+    return setup
+
+def bench_calculate_icmp_checksum(ctx):
+    packet = bytes(_echo_request(0x1234, 1))
+    calc = ping.calculate_icmp_checksum
+    def run():
+        for _ in range(1000):
+            calc(packet)
+    return run, 1000
+
+def bench_verify(ctx):
+    # ICMP parts of the corpus, corrupt ones included
+    parts = [p[20:] for p in ctx["corpus"]]
+    verify = ping.verify_icmp_checksum
+    def run():
+        for p in parts:
+            verify(p)
+    return run, len(parts)
+
+def bench_build_packet(ctx):
+    build = traceroute.build_packet
+    def run():
+        for seq in range(1000):
+            build(0, seq)
+    return run, 1000
+
+def bench_parse(kind):
+    def setup(ctx):
+        if kind == "corpus":
+            packets = ctx["corpus"]
+        else:
+            make = {"echo": lambda i: echo_reply(0x1234, i),
+                    "te_full": lambda i: time_exceeded(0x1234, i),
+                    "te_truncated": lambda i: time_exceeded(0x1234, i, quote=8)}[kind]
+            packets = [make(i) for i in range(1000)]
+        parse = traceroute.parse_response
+        def run():
+            for p in packets:
+                parse(p)
+        return run, len(packets)
+    return setup
+
+def _sample_record(i):
+    return {"ts_send": 1.7e9 + i, "dst_ip": "192.0.2.1", "id": 4660, "seq": i, "icmp_type": 0, "icmp_code": 0,
+            "ts_recv": 1.7e9 + i + 0.02, "ttl_reply": 57, "size": 36, "rtt": 20.5}
+
+def bench_jwrite(ctx):
+    path = os.path.join(ctx["dir"], "jwrite.jsonl")
+    jwrite = jsonhelper.jwrite
+    def run():
+        for i in range(200):
+            jwrite(path, _sample_record(i), {"tool": "ping"})
+        os.truncate(path, 0)
+    return run, 200
+
+def bench_jsonl_writer(ctx):
+    path = os.path.join(ctx["dir"], "writer.jsonl")
+    def run():
+        writer = jsonhelper.JsonlWriter(path, default_fields={"tool": "ping"})
+        for i in range(5000):
+            writer.write(_sample_record(i))
+        writer.close()
+        os.truncate(path, 0)
+    return run, 5000
+
+def bench_summarize(kind):
+    def setup(ctx):
+        path = ctx[kind + "_log"]
+        summarize = jsonhelper.summarize_ping if kind == "ping" else jsonhelper.summarize_trace
+        def run():
+            with contextlib.redirect_stdout(io.StringIO()):
+                summarize(path)
+        return run, ctx["lines"]
+    return setup
+
+# name -> setup; summaries run once per repeat over the whole generated log
+BENCHMARKS = {
+    "checksum_64B": bench_checksum(64),
+    "checksum_1500B": bench_checksum(1500),
+    "calculate_icmp_checksum": bench_calculate_icmp_checksum,
+    "verify_icmp_checksum_corpus": bench_verify,
+    "build_packet": bench_build_packet,
+    "parse_response_echo": bench_parse("echo"),
+    "parse_response_te_full": bench_parse("te_full"),
+    "parse_response_te_truncated": bench_parse("te_truncated"),
+    "parse_response_corpus": bench_parse("corpus"),
+    "jwrite": bench_jwrite,
+    "jsonl_writer": bench_jsonl_writer,
+    "summarize_ping": bench_summarize("ping"),
+    "summarize_trace": bench_summarize("trace"),
+}
+
+def measure(run, ops, repeat, min_time=0.2):
+    """
+    ns per operation for each of repeat rounds, every round calling run() often enough to
+    last about min_time seconds (min_time 0: once, without a warm-up call)
+    """
+    loops = 1
+    if min_time > 0:
+        start = time.perf_counter()
+        run()
+        once = time.perf_counter() - start
+        loops = max(1, int(min_time / once)) if once > 0 else 1
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter_ns()
+        for _ in range(loops):
+            run()
+        samples.append((time.perf_counter_ns() - start) / (loops * ops))
+    return samples
+
+def run_benchmarks(names=None, lines=1_000_000, repeat=5, out=sys.stdout):
+    """run the selected benchmarks (all by default), returns the baseline dict"""
+    names = [n for n in BENCHMARKS if names is None or any(sel in n for sel in names)]
+    tmp = tempfile.mkdtemp(prefix="bench-")
+    ctx = {"dir": tmp, "lines": lines, "corpus": make_corpus()}
+    results = {}
+    try:
+        if any(n.startswith("summarize") for n in names):
+            out.write(f"generating {lines} line ping and trace logs...\n")
+            ctx["ping_log"] = os.path.join(tmp, "ping.jsonl")
+            ctx["trace_log"] = os.path.join(tmp, "trace.jsonl")
+            write_ping_log(ctx["ping_log"], lines)
+            write_trace_log(ctx["trace_log"], lines)
+        for name in names:
+            run, ops = BENCHMARKS[name](ctx)
+            # the summaries take seconds each: fewer, single-pass rounds
+            big = name.startswith("summarize")
+            samples = measure(run, ops, max(1, repeat // 2) if big else repeat, min_time=0 if big else 0.2)
+            best = min(samples)
+            results[name] = {"ns_per_op": best, "median_ns": statistics.median(samples),
+                             "ops_per_s": 1e9 / best if best else None, "ops": ops, "rounds": len(samples)}
+            out.write(f"{name:32s} {best:12.1f} ns/op {1e9 / best:14.0f} ops/s\n")
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    return {"meta": {"python": platform.python_version(), "implementation": platform.python_implementation(),
+                     "machine": platform.machine(), "host": platform.node(), "ts": time.time(), "lines": lines},
+            "results": results}
+
+def compare(base, new, threshold=10.0, out=sys.stdout):
+    """
+    Print old vs new ns/op per benchmark; returns the names that got more than threshold
+    percent slower.
+    """
+    regressions = []
+    out.write(f"{'benchmark':32s} {'base ns':>12s} {'new ns':>12s} {'change':>8s}\n")
+    for name, result in new["results"].items():
+        old = base["results"].get(name)
+        if old is None:
+            out.write(f"{name:32s} {'-':>12s} {result['ns_per_op']:12.1f}      new\n")
+            continue
+        change = (result["ns_per_op"] - old["ns_per_op"]) / old["ns_per_op"] * 100.0
+        flag = ""
+        if change > threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        out.write(f"{name:32s} {old['ns_per_op']:12.1f} {result['ns_per_op']:12.1f} {change:+7.1f}%{flag}\n")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks for the packet, parse, logging and summary hot paths")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    r = sub.add_parser("run", help="Run benchmarks and optionally save them as a baseline")
+    r.add_argument("--out", type=str, help="Write results to this JSON file")
+    r.add_argument("--lines", type=int, default=1_000_000, help="Lines in the generated logs for the summaries")
+    r.add_argument("--repeat", type=int, default=5, help="Rounds per benchmark (the best one counts)")
+    r.add_argument("--filter", type=str, nargs="*", help="Only benchmarks whose name contains one of these")
+    c = sub.add_parser("compare", help="Compare two result files")
+    c.add_argument("base")
+    c.add_argument("new")
+    c.add_argument("--threshold", type=float, default=10.0, help="Percent slowdown counted as a regression")
+    args = parser.parse_args()
+
+    if args.cmd == "run":
+        baseline = run_benchmarks(args.filter, args.lines, args.repeat)
+        if args.out:
+            with open(args.out, "w") as f:
+                json.dump(baseline, f, indent=1)
+        return
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    regressions = compare(base, new, args.threshold)
+    if regressions:
+        print(f"{len(regressions)} regression(s) over {args.threshold:.0f}%: {', '.join(regressions)}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
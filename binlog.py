@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+from array import array
+
+from jsonhelper import OnlineStats, _OPEN_WRITERS
+
+# Binary columnar probe log.
+# File:  MAGIC, then any number of blocks (so it can be appended to like JSONL).
+# Block: BLOCK_HEAD (tag, nrows, strtab_len), one little-endian column per field in
+#        COLUMNS order (each padded to 8 bytes), then the block's string table
+#        (u16 length + utf-8 bytes per string, padded to 8).
+# String-valued fields (ips, hostnames, err, tool) are stored as int32 indexes into the
+# block's string table, -1 = missing. Missing floats are NaN, missing ints -1.
+MAGIC = b"PLOG\x01\x00\x00\x00"
+BLOCK_TAG = b"PBLK"
+BLOCK_HEAD = struct.Struct("<4sII")
+STR_LEN = struct.Struct("<H")
+
+# (column, typecode): fixed-width numeric columns, as narrow as their values allow,
+# then string-table indexes
+FLOAT_COLUMNS = ("ts", "ts_send", "ts_recv", "rtt", "payload_ts")
+INT_COLUMNS = ("kind", "seq", "id", "probe", "ttl", "ttl_reply", "size", "type", "code")
+STR_COLUMNS = ("tool", "dst", "dst_ip", "router_ip", "router_name", "err")
+COLUMNS = ([(c, "d") for c in FLOAT_COLUMNS]
+           + [("kind", "b"), ("seq", "i"), ("id", "i"), ("probe", "h"), ("ttl", "h"),
+              ("ttl_reply", "h"), ("size", "i"), ("type", "h"), ("code", "h")]
+           + [(c, "i") for c in STR_COLUMNS])
+
+# kind column: which JSONL field names a row came from
+KIND_PING = 0
+KIND_TRACE = 1
+
+_NAN = float("nan")
+_SWAP = sys.byteorder != "little"
+
+def _pad(n):
+    return (-n) & 7
+
+def _first(obj, *keys):
+    for k in keys:
+        v = obj.get(k)
+        if v is not None:
+            return v
+    return None
+
+def is_binlog(path):
+    """True if path starts with the binlog magic"""
+    try:
+        with open(path, "rb") as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+class BinlogWriter:
+    """
+    Append probe records (the same dicts JsonlLogger writes) to a binary columnar log.
+    Rows are buffered in typed arrays and written one block of block_rows at a time, or as a
+    shorter block once flush_interval seconds (0 = off) have passed since the last one, so a
+    slow prober's rows still reach the file (and its readers) in bounded time. Every block
+    repeats its header, column padding and string table, so keep the interval long: at 1 qps a
+    block a second costs about as much as the JSONL, a block a minute under half of it.
+    """
+    def __init__(self, path, default_fields=None, block_rows=65536, flush_interval=60.0):
+        self.path = path
+        self.default_fields = default_fields or {}
+        self.block_rows = block_rows
+        self.flush_interval = flush_interval
+        self._last_flush = time.time()
+        self._lock = threading.RLock()
+        d = os.path.dirname(path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        self._f = open(path, "ab")
+        if self._f.tell() == 0:
+            self._f.write(MAGIC)
+        elif not is_binlog(path):
+            self._f.close()
+            raise ValueError(f"{path} exists and is not a binlog")
+        self._reset()
+        _OPEN_WRITERS.add(self)
+
+    def _reset(self):
+        self._cols = {name: array(code) for name, code in COLUMNS}
+        self._strings = {}
+        self._rows = 0
+
+    def _str(self, value):
+        if value is None:
+            return -1
+        value = str(value)
+        idx = self._strings.get(value)
+        if idx is None:
+            idx = self._strings[value] = len(self._strings)
+        return idx
+
+    def write(self, obj):
+        for k, v in self.default_fields.items():
+            obj.setdefault(k, v)
+        obj.setdefault("ts", time.time())
+        trace = any(k in obj for k in ("ttl", "hop", "type", "router_ip"))
+        row = {
+            "ts": obj.get("ts"),
+            "ts_send": obj.get("ts_send"),
+            "ts_recv": obj.get("ts_recv"),
+            # accept either unified "rtt" or legacy "rtt_ms"
+            "rtt": _first(obj, "rtt", "rtt_ms"),
+            "payload_ts": obj.get("payload_ts"),
+            "kind": KIND_TRACE if trace else KIND_PING,
+            "seq": obj.get("seq"),
+            "id": _first(obj, "id", "flow_id"),
+            "probe": obj.get("probe"),
+            "ttl": _first(obj, "ttl", "hop"),
+            "ttl_reply": obj.get("ttl_reply"),
+            "size": obj.get("size"),
+            "type": _first(obj, "type", "icmp_type"),
+            "code": _first(obj, "code", "icmp_code"),
+        }
+        with self._lock:
+            cols = self._cols
+            for name in FLOAT_COLUMNS:
+                v = row[name]
+                cols[name].append(_NAN if v is None else float(v))
+            for name in INT_COLUMNS:
+                v = row[name]
+                cols[name].append(-1 if v is None else int(v))
+            cols["tool"].append(self._str(obj.get("tool")))
+            cols["dst"].append(self._str(obj.get("dst")))
+            cols["dst_ip"].append(self._str(obj.get("dst_ip")))
+            cols["router_ip"].append(self._str(_first(obj, "router_ip", "src")))
+            cols["router_name"].append(self._str(obj.get("router_name")))
+            cols["err"].append(self._str(obj.get("err")))
+            self._rows += 1
+            if self._rows >= self.block_rows or (
+                    self.flush_interval > 0 and time.time() - self._last_flush >= self.flush_interval):
+                self.flush()
+
+    def flush(self):
+        with self._lock:
+            self._last_flush = time.time()
+            if self._rows == 0 or self._f is None:
+                return
+            strtab = bytearray()
+            for s in self._strings:
+                b = s.encode("utf-8")[:0xFFFF]
+                strtab += STR_LEN.pack(len(b)) + b
+            out = bytearray(BLOCK_HEAD.pack(BLOCK_TAG, self._rows, len(strtab)))
+            for name, _ in COLUMNS:
+                col = self._cols[name]
+                if _SWAP:
+                    col.byteswap()
+                raw = col.tobytes()
+                out += raw + bytes(_pad(len(raw)))
+            out += strtab + bytes(_pad(len(strtab)))
+            self._f.write(out)
+            self._f.flush()
+            self._reset()
+
+    def close(self):
+        with self._lock:
+            if self._f is None:
+                return
+            self.flush()
+            self._f.close()
+            self._f = None
+        _OPEN_WRITERS.discard(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def _block_size(nrows, strtab_len):
+    size = BLOCK_HEAD.size
+    for _, code in COLUMNS:
+        n = nrows * array(code).itemsize
+        size += n + _pad(n)
+    return size + strtab_len + _pad(strtab_len)
+
+def read_blocks(path, start=0, end=None):
+    """
+    Yield (nrows, columns, strings) for each block whose header starts in [start, end).
+    columns maps name -> memoryview straight over the mmap'd file (zero-copy on
+    little-endian hosts); the views are released once the caller asks for the next block.
+    """
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size <= len(MAGIC):
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if mm[:len(MAGIC)] != MAGIC:
+                raise ValueError(f"{path} is not a binlog")
+            end = size if end is None else min(end, size)
+            buf = memoryview(mm)
+            try:
+                pos = len(MAGIC)
+                while pos + BLOCK_HEAD.size <= size and pos < end:
+                    tag, nrows, strtab_len = BLOCK_HEAD.unpack_from(mm, pos)
+                    if tag != BLOCK_TAG or pos + _block_size(nrows, strtab_len) > size:
+                        break # torn write at the end of a live file
+                    block_start = pos
+                    pos += BLOCK_HEAD.size
+                    if block_start < start:
+                        pos = block_start + _block_size(nrows, strtab_len)
+                        continue
+
+                    views = []
+                    columns = {}
+                    for name, code in COLUMNS:
+                        n = nrows * array(code).itemsize
+                        if _SWAP:
+                            col = array(code, bytes(buf[pos:pos + n]))
+                            col.byteswap()
+                        else:
+                            col = buf[pos:pos + n].cast(code)
+                            views.append(col)
+                        columns[name] = col
+                        pos += n + _pad(n)
+
+                    strings = []
+                    spos = pos
+                    while spos < pos + strtab_len:
+                        (n,) = STR_LEN.unpack_from(mm, spos)
+                        strings.append(bytes(buf[spos + 2:spos + 2 + n]).decode("utf-8"))
+                        spos += 2 + n
+                    pos += strtab_len + _pad(strtab_len)
+
+                    yield nrows, columns, strings
+                    for v in views:
+                        v.release()
+            finally:
+                buf.release()
+
+def complete_end(path, start=0):
+    """
+    Offset just past the last complete block at or after start (start must be a block
+    boundary, or 0). A live writer may be midway through appending the next one.
+    """
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size <= len(MAGIC):
+            return start
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            pos = max(start, len(MAGIC))
+            while pos + BLOCK_HEAD.size <= size:
+                tag, nrows, strtab_len = BLOCK_HEAD.unpack_from(mm, pos)
+                block_end = pos + _block_size(nrows, strtab_len)
+                if tag != BLOCK_TAG or block_end > size:
+                    break
+                pos = block_end
+            return pos
+
+def _row_to_record(cols, strings, i):
+    def num(name):
+        v = cols[name][i]
+        return None if v == -1 or v != v else v
+
+    def text(name):
+        idx = cols[name][i]
+        return None if idx < 0 else strings[idx]
+
+    router_ip = text("router_ip")
+    if cols["kind"][i] == KIND_TRACE:
+        fields = [("dst", text("dst")), ("dst_ip", text("dst_ip")), ("ttl", num("ttl")),
+                  ("probe", num("probe")), ("flow_id", num("id")), ("ts_send", num("ts_send")),
+                  ("ts_recv", num("ts_recv")), ("src", router_ip), ("router_ip", router_ip),
+                  ("router_name", text("router_name")), ("rtt", num("rtt")),
+                  ("payload_ts", num("payload_ts")), ("type", num("type")), ("code", num("code")),
+                  ("err", text("err"))]
+        # answered probes carry the full record shape, nulls included
+        keep_null = {"router_name", "payload_ts", "err"} if router_ip else set()
+    else:
+        fields = [("ts_send", num("ts_send")), ("dst", text("dst")), ("dst_ip", text("dst_ip")),
+                  ("id", num("id")), ("seq", num("seq")), ("icmp_type", num("type")),
+                  ("icmp_code", num("code")), ("ts_recv", num("ts_recv")),
+                  ("ttl_reply", num("ttl_reply")), ("size", num("size")), ("rtt", num("rtt")),
+                  ("err", text("err"))]
+        keep_null = set()
+    fields += [("tool", text("tool")), ("ts", num("ts"))]
+    return {k: v for k, v in fields if v is not None or k in keep_null}
+
+def iter_records(path, start=0, end=None):
+    """rebuild JSONL-style dicts from a binlog (fields the format doesn't keep are lost), see read_blocks"""
+    for nrows, cols, strings in read_blocks(path, start, end):
+        for i in range(nrows):
+            yield _row_to_record(cols, strings, i)
+
+def jsonl_to_binlog(src, dst, block_rows=65536):
+    count = 0
+    with open(src) as f, BinlogWriter(dst, block_rows=block_rows, flush_interval=0) as w:
+        for line in f:
+            try:
+                obj = json.loads(line)
+            except Exception:
+                continue
+            w.write(obj)
+            count += 1
+    return count
+
+def binlog_to_jsonl(src, dst):
+    count = 0
+    with open(dst, "w") as f:
+        for obj in iter_records(src):
+            f.write(json.dumps(obj) + "\n")
+            count += 1
+    return count
+
+# scan_ping / scan_trace counterparts of jsonhelper's, reading only the columns they need
+def scan_ping(path, start=0, end=None):
+    sent = 0
+    recv = 0
+    stats = OnlineStats()
+    for nrows, cols, _ in read_blocks(path, start, end):
+        rtt = cols["rtt"]
+        err = cols["err"]
+        # only count RTTs for successful probes (no error); NaN != NaN drops missing RTTs
+        ok = [x for x, e in zip(rtt, err) if e < 0 and x == x]
+        sent += nrows
+        recv += len(ok)
+        stats.merge(OnlineStats.from_values(ok))
+    return sent, recv, stats
+
+def scan_trace(path, start=0, end=None):
+    hops = {}
+    for nrows, cols, strings in read_blocks(path, start, end):
+        # timeout is the only err that means "no reply" for traceroute stats
+        timeout = strings.index("timeout") if "timeout" in strings else -2
+        samples = {}
+        for ttl, x, e in zip(cols["ttl"], cols["rtt"], cols["err"]):
+            if ttl < 0:
+                continue
+            hop = samples.get(ttl)
+            if hop is None:
+                hop = samples[ttl] = [0, []]
+            hop[0] += 1
+            if x == x and e != timeout:
+                hop[1].append(x)
+        for ttl, (total, values) in samples.items():
+            hop = hops.get(ttl)
+            if hop is None:
+                hop = hops[ttl] = [0, OnlineStats()]
+            hop[0] += total
+            hop[1].merge(OnlineStats.from_values(values))
+    return hops
+
+def main():
+    p = argparse.ArgumentParser(description="Convert probe logs between JSONL and binlog")
+    sub = p.add_subparsers(dest="cmd", required=True)
+    to_bin = sub.add_parser("to-bin", help="JSONL -> binlog")
+    to_bin.add_argument("src")
+    to_bin.add_argument("dst")
+    to_jsonl = sub.add_parser("to-jsonl", help="binlog -> JSONL")
+    to_jsonl.add_argument("src")
+    to_jsonl.add_argument("dst")
+    args = p.parse_args()
+
+    if args.cmd == "to-bin":
+        n = jsonl_to_binlog(args.src, args.dst)
+    else:
+        n = binlog_to_jsonl(args.src, args.dst)
+    print(f"wrote {n} records to {args.dst} ({os.path.getsize(args.dst)} bytes, source {os.path.getsize(args.src)} bytes)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+import argparse
+import contextlib
+import io
+import json
+import platform
+import time
+
+import ping
+import multiping
+import traceroute
+from jsonhelper import OnlineStats
+from scheduler import ProbeScheduler
+
+# Self-overhead calibration: probe 127.0.0.1 through the real ping/trace code paths at
+# increasing rates. Loopback has next to no network in it, so what the RTTs show is the
+# tool's own cost (socket setup, the send path, Python getting round to the reply) — the
+# floor under every RTT it reports — and the rate where that cost starts to grow.
+# `--save PROFILE` keeps the result per host; `jsonhelper.py --overhead PROFILE` then
+# reports summaries net of the floor and flags RTTs that are within it.
+
+LOOPBACK = "127.0.0.1"
+
+ENGINES = ("ping", "oneshot", "multiping", "trace", "parallel")
+
+class _Collector:
+    """JsonlLogger look-alike keeping the records"""
+    def __init__(self):
+        self.records = []
+
+    def jsonl_write(self, obj):
+        self.records.append(obj)
+
+def _paced(rate, count):
+    """yield count times, rate per second (0 = back to back)"""
+    sched = ProbeScheduler(rate=rate)
+    for i in range(count):
+        due = sched.wait()
+        sched.sent(due)
+        yield i
+
+def run_engine(engine, rate, count, timeout, kernel_ts=False):
+    """
+    count probes to loopback through one engine at rate probes/s (0 = as fast as it goes).
+    Returns (RTTs in ms in send order, None for unanswered probes; seconds taken).
+        ping:      PingSession (one socket, what myping.py uses)
+        oneshot:   ping.ping(), a fresh socket per probe
+        multiping: MultiPinger, everything over one socket in one select loop
+        trace:     get_route hop by hop (sockets per probe), one TTL-1 probe per call
+        parallel:  send_window, as in mytrace.py --parallel/--adaptive
+    """
+    rtts = []
+    started = time.perf_counter()
+    # the engines' own progress lines aren't part of what is measured
+    with contextlib.redirect_stdout(io.StringIO()):
+        if engine == "ping":
+            with ping.PingSession(LOOPBACK, kernel_ts=kernel_ts) as session:
+                for i in _paced(rate, count):
+                    result = session.ping(timeout, i)
+                    rtts.append(result.get("rtt") if result.get("err") is None else None)
+        elif engine == "oneshot":
+            for i in _paced(rate, count):
+                result = ping.ping(LOOPBACK, timeout, i)
+                rtts.append(result.get("rtt") if result.get("err") is None else None)
+        elif engine == "multiping":
+            results = []
+            pinger = multiping.MultiPinger([LOOPBACK], count=count, interval=1.0 / rate if rate > 0 else 0.0,
+                                           timeout=timeout, kernel_ts=kernel_ts)
+            pinger.run(lambda target, r: results.append(r))
+            results.sort(key=lambda r: r["ts_send"])
+            rtts = [r.get("rtt") if r.get("err") is None else None for r in results]
+        elif engine == "trace":
+            for _ in _paced(rate, count):
+                out = _Collector()
+                traceroute.get_route(LOOPBACK, 1, timeout, 1, 0, 0, out, no_resolve=True, kernel_ts=kernel_ts)
+                record = out.records[0] if out.records else {}
+                rtts.append(record.get("rtt") if record.get("err") is None else None)
+        elif engine == "parallel":
+            sched = ProbeScheduler(rate=rate, clock=time.time)
+            send_sock, recv_sock = traceroute.open_trace_sockets()
+            rx_ts = kernel_ts and ping.enable_rx_timestamps(recv_sock)
+            try:
+                # probe numbers are 8 bits of the seq, so at most 255 per call
+                while len(rtts) < count:
+                    n = min(255, count - len(rtts))
+                    answers = traceroute.send_window(send_sock, recv_sock, LOOPBACK, [1], n, timeout, rate, 0,
+                                                     sched=sched, kernel_ts=rx_ts)
+                    rtts.extend(answers[(1, p)][4] if (1, p) in answers else None for p in range(1, n + 1))
+            finally:
+                send_sock.close()
+                recv_sock.close()
+        else:
+            raise ValueError(f"unknown engine {engine!r}")
+    return rtts, time.perf_counter() - started
+
+def describe(rtts, elapsed, rate):
+    """one calibration run as a row: achieved rate, loss, RTT percentiles and jitter (ms)"""
+    stats = OnlineStats()
+    # jitter as in RFC 3550: mean change between consecutive answered probes
+    jitter = OnlineStats()
+    last = None
+    for rtt in rtts:
+        if rtt is None:
+            continue
+        stats.add(rtt)
+        if last is not None:
+            jitter.add(abs(rtt - last))
+        last = rtt
+    row = {"rate": rate, "sent": len(rtts), "received": stats.n,
+           "achieved": len(rtts) / elapsed if elapsed > 0 else None,
+           "loss_pct": (len(rtts) - stats.n) / len(rtts) * 100.0 if rtts else 0.0}
+    if stats.n:
+        s = stats.summary()
+        row.update({"min_ms": s["min"], "p50_ms": s["p50"], "p90_ms": s["p90"], "p99_ms": s["p99"],
+                    "p999_ms": s["p99.9"], "max_ms": s["max"], "stddev_ms": s["stddev"],
+                    "jitter_ms": jitter.summary()["avg"] if jitter.n else 0.0})
+    return row
+
+def knee(rows, factor=1.5):
+    """
+    the first rate at which the tool's own cost grows: median RTT over factor times the
+    slowest run's, or the target rate missed by more than 10%, or over 1% lost. None if none.
+    """
+    base = rows[0].get("p50_ms")
+    for row in rows[1:]:
+        if row.get("p50_ms") is None or base is None:
+            return row["rate"]
+        missed = row["rate"] > 0 and row["achieved"] < 0.9 * row["rate"]
+        if row["p50_ms"] > factor * base or missed or row["loss_pct"] > 1.0:
+            return row["rate"]
+    return None
+
+def calibrate(engines, rates, count, timeout, kernel_ts=False, factor=1.5, out=None):
+    """
+    Run every engine at every rate (slowest first, 0 = unlimited last) and print a table per
+    engine. Returns the overhead profile (a dict, as saved by --save).
+    """
+    # unlimited last: it is the fastest
+    rates = sorted(rates, key=lambda r: (r <= 0, r))
+    profile = {"host": platform.node(), "python": platform.python_version(), "kernel_ts": kernel_ts,
+               "ts": time.time(), "count": count, "engines": {}}
+    for engine in engines:
+        print(f"\n{engine}: {count} probes to {LOOPBACK} per rate", file=out)
+        print(f"{'rate':>10} {'achieved/s':>11} {'loss%':>6} {'min':>8} {'p50':>8} {'p90':>8} {'p99':>8} "
+              f"{'p99.9':>8} {'jitter':>8}  (ms)", file=out)
+        rows = []
+        for rate in rates:
+            rtts, elapsed = run_engine(engine, rate, count, timeout, kernel_ts)
+            row = describe(rtts, elapsed, rate)
+            rows.append(row)
+            label = f"{rate:.0f}" if rate > 0 else "unlimited"
+            if row["received"]:
+                print(f"{label:>10} {row['achieved']:11.0f} {row['loss_pct']:6.1f} {row['min_ms']:8.3f} "
+                      f"{row['p50_ms']:8.3f} {row['p90_ms']:8.3f} {row['p99_ms']:8.3f} {row['p999_ms']:8.3f} "
+                      f"{row['jitter_ms']:8.3f}", file=out)
+            else:
+                print(f"{label:>10} {row['achieved']:11.0f} {row['loss_pct']:6.1f}  no replies", file=out)
+        base = rows[0]
+        grows = knee(rows, factor)
+        if grows is None:
+            print(f"floor p50 {base.get('p50_ms', float('nan')):.3f} ms; no growth up to the fastest rate tried",
+                  file=out)
+        else:
+            label = f"{grows:.0f}/s" if grows > 0 else "unlimited"
+            print(f"floor p50 {base.get('p50_ms', float('nan')):.3f} ms; overhead grows from {label}", file=out)
+        profile["engines"][engine] = {"floor_ms": base.get("min_ms"), "p50_ms": base.get("p50_ms"),
+                                      "p99_ms": base.get("p99_ms"), "jitter_ms": base.get("jitter_ms"),
+                                      "knee_rate": grows, "runs": rows}
+    return profile
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the prober's own latency floor and jitter against loopback")
+    parser.add_argument("--engines", type=str, default="ping,multiping,trace,parallel",
+                        help=f"Comma-separated engines to calibrate ({', '.join(ENGINES)})")
+    parser.add_argument("--rates", type=str, default="10,100,1000,0",
+                        help="Comma-separated probe rates to try (0 = unlimited)")
+    parser.add_argument("--count", type=int, default=500, help="Probes per engine and rate")
+    parser.add_argument("--timeout", type=float, default=1.0, help="Per-probe timeout (s)")
+    parser.add_argument("--kernel-ts", action="store_true",
+                        help="Time replies with kernel receive timestamps, as the CLIs' --kernel-ts does")
+    parser.add_argument("--knee", type=float, default=1.5,
+                        help="Median RTT growth over the slowest rate's that counts as overhead growing")
+    parser.add_argument("--save", type=str, help="Write the overhead profile (JSON) to this file")
+    args = parser.parse_args()
+
+    engines = [e for e in args.engines.split(",") if e]
+    for engine in engines:
+        if engine not in ENGINES:
+            parser.error(f"unknown engine {engine!r}")
+    rates = [float(r) for r in args.rates.split(",")]
+    profile = calibrate(engines, rates, args.count, args.timeout, args.kernel_ts, args.knee)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(profile, f, indent=1)
+        print(f"\nprofile saved to {args.save}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+import copy
+import ipaddress
+import statistics
+
+from traceroute import send_window, answer_record, open_trace_sockets, probe_id
+from ping import enable_rx_timestamps
+
+# Doubletree (Donnet et al., SIGMETRICS 2005) for tracing many destinations: most of what a
+# trace would find near the source, and between a shared core router and a destination
+# prefix, an earlier trace already found. So each trace starts at a mid-path TTL, probes
+# forwards until the destination or a hop already seen on the way to the same prefix, then
+# backwards until a hop already seen at that TTL, and takes the rest from the earlier trace.
+
+class StopSet:
+    """
+    What earlier traces found, as the two Doubletree stop sets:
+      local:  (hop ip, ttl) -> path of the first trace that saw it (its hops below are reused)
+      global: (hop ip, destination prefix) -> (ttl, path, dest ttl) of the first trace to that
+              prefix through it (its hops beyond are reused)
+    A path is {ttl: [records]} of one finished trace.
+        prefix_len: destination prefix length for the global set
+    """
+    def __init__(self, prefix_len=24):
+        self.prefix_len = prefix_len
+        self.local = {}
+        self.glob = {}
+        # distances at which destinations answered, for the start TTL
+        self.dest_ttls = []
+        self.probed = 0
+        self.filled = 0
+        self.backward_stops = 0
+        self.forward_stops = 0
+
+    def prefix(self, ip):
+        return str(ipaddress.ip_network(f"{ip}/{self.prefix_len}", strict=False))
+
+    def start_ttl(self, default=8):
+        """where to start a trace: short of nearly every destination seen so far (default before any)"""
+        if len(self.dest_ttls) < 5:
+            return default
+        return max(1, int(statistics.quantiles(self.dest_ttls, n=10)[0]))
+
+    def learn(self, dest_ip, path, dest_ttl):
+        """add every router hop of a finished trace (probed or filled in) to both sets"""
+        if dest_ttl is not None:
+            self.dest_ttls.append(dest_ttl)
+        prefix = self.prefix(dest_ip)
+        for ttl, records in path.items():
+            ip = hop_ip(records)
+            if ip is None:
+                continue
+            self.local.setdefault((ip, ttl), path)
+            self.glob.setdefault((ip, prefix), (ttl, path, dest_ttl))
+
+    def report(self):
+        return (f"Doubletree: {self.probed} hops probed, {self.filled} filled in from earlier traces "
+                f"({self.backward_stops} backward / {self.forward_stops} forward stops)")
+
+def hop_ip(records):
+    """the router that answered with Time Exceeded at this TTL, if any"""
+    for record in records or ():
+        if record.get("type") == 11 and record.get("router_ip"):
+            return record["router_ip"]
+    return None
+
+def _reached(records, dest_ip):
+    return any(r.get("type") == 0 and r.get("src") == dest_ip for r in records)
+
+def _copy(records, hostname, dest_ip, ttl, flow_id):
+    """an earlier trace's records for one TTL, relabelled as this trace's at ttl"""
+    out = []
+    for record in records:
+        record = copy.copy(record)
+        # written out afresh, with this trace's log time
+        record.pop("ts", None)
+        record["ttl"] = ttl
+        if "dst" in record:
+            record["dst"] = hostname
+            record["dst_ip"] = dest_ip
+            record["flow_id"] = flow_id
+        record["cached"] = True
+        out.append(record)
+    return out
+
+def trace_doubletree(hostname, dest_ip, stops, max_ttl, timeout, probes, qps_limit, flow_id, sink, sched,
+                     start_ttl=0, kernel_ts=False, bpf=False, rto=None, gap_limit=0, socks=None):
+    """
+    One Doubletree trace: the same records as trace_windows (in TTL order, to sink, and
+    returned), but hops known from stops are copied from earlier traces instead of probed.
+    Copied records get "cached": true and keep the earlier trace's timings.
+        stops: StopSet shared by the traces of a run (learns this trace's hops at the end)
+        start_ttl: first TTL probed (0 = stops.start_ttl())
+        sched, rto, gap_limit, socks: as for trace_windows (gap_limit counts forward from start_ttl)
+    """
+    prefetch = sink.resolver.prefetch if sink.resolver is not None else None
+    path = {}
+    dest_ttl = None
+    # answers so far, and (with rto) the probes past their RTO that may still be answered;
+    # the walk decides on what came within the RTO, the records get the late answers too
+    answers = {}
+    late = {} if rto is not None else None
+    probed = set()
+
+    def settle(ttl):
+        nonlocal dest_ttl
+        records = [answer_record(hostname, dest_ip, (ttl, p), flow_id, answers.get((ttl, p)))
+                   for p in range(1, probes + 1)]
+        path[ttl] = records
+        if _reached(records, dest_ip):
+            # the destination is no further than this: forget anything probed beyond it
+            dest_ttl = ttl if dest_ttl is None else min(dest_ttl, ttl)
+            for beyond in [t for t in path if t > dest_ttl]:
+                del path[beyond]
+        return records
+
+    def probe(ttl):
+        answers.update(send_window(send_sock, recv_sock, dest_ip, [ttl], probes, timeout, qps_limit, flow_id,
+                                   sched=sched, kernel_ts=rx_ts, prefetch=prefetch, rto=rto, late=late))
+        probed.add(ttl)
+        stops.probed += 1
+        return settle(ttl)
+
+    def fill(ttl, records):
+        if ttl not in path and records:
+            path[ttl] = _copy(records, hostname, dest_ip, ttl, flow_id)
+            stops.filled += 1
+
+    first = min(start_ttl or stops.start_ttl(), max_ttl)
+    if socks is None:
+        send_sock, recv_sock = open_trace_sockets(probe_id(flow_id) if bpf else None)
+    else:
+        send_sock, recv_sock = socks
+    rx_ts = kernel_ts and enable_rx_timestamps(recv_sock)
+    try:
+        # forwards from the start TTL
+        ttl = first
+        gap = 0
+        prefix = stops.prefix(dest_ip)
+        while ttl <= max_ttl and dest_ttl is None:
+            records = probe(ttl)
+            if dest_ttl is not None:
+                break
+            ip = hop_ip(records)
+            gap = 0 if any("rtt" in r for r in records) else gap + 1
+            if gap_limit and gap >= gap_limit:
+                print(f"Stopping after {gap} silent hops")
+                break
+            known = stops.glob.get((ip, prefix)) if ip else None
+            if known is None:
+                ttl += 1
+                continue
+            # an earlier trace to this prefix went on from the same router: take its hops up
+            # to (not including) where its own destination answered, and probe on from there
+            stops.forward_stops += 1
+            their_ttl, their_path, their_dest = known
+            last = their_dest - 1 if their_dest is not None else max(their_path)
+            for t in range(their_ttl + 1, last + 1):
+                if ttl + t - their_ttl > max_ttl:
+                    break
+                fill(ttl + t - their_ttl, their_path.get(t, ()))
+            ttl += max(1, last - their_ttl + 1)
+
+        # backwards from the start TTL until a hop already seen at its TTL
+        ttl = first
+        while ttl > 1:
+            ip = hop_ip(path.get(ttl))
+            known = stops.local.get((ip, ttl)) if ip else None
+            if known is not None:
+                stops.backward_stops += 1
+                for t in range(1, ttl):
+                    fill(t, known.get(t, ()))
+                break
+            ttl -= 1
+            probe(ttl)
+
+        if late:
+            # give the probes still inside their timeout the rest of it, then redo their hops
+            answers.update(send_window(send_sock, recv_sock, dest_ip, [], 0, timeout, qps_limit, flow_id,
+                                       sched=sched, kernel_ts=rx_ts, prefetch=prefetch, rto=rto, late=late,
+                                       linger=True))
+            for ttl in sorted(probed):
+                if ttl in path and (dest_ttl is None or ttl <= dest_ttl):
+                    settle(ttl)
+    finally:
+        if socks is None:
+            send_sock.close()
+            recv_sock.close()
+
+    # like trace_windows, the records end at the first one from the destination
+    responses = []
+    for ttl in sorted(path):
+        for record in path[ttl]:
+            responses.append(record)
+            sink.add(record)
+            if _reached([record], dest_ip):
+                break
+        if ttl == dest_ttl:
+            break
+    stops.learn(dest_ip, path, dest_ttl)
+    return responses
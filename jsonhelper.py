@@ -4,8 +4,19 @@ import json
 import time
 import os
 import math
+import re
 import argparse
-from collections import defaultdict
+import atexit
+import mmap
+import signal
+import threading
+import weakref
+from collections import defaultdict, Counter
+from concurrent.futures import ProcessPoolExecutor
+
+import metrics
+
+FLUSH_TIME = metrics.histogram("log_flush_seconds", "Time per JsonlWriter flush (write + flush of the buffered lines)")
 
 # jwrite: safe JSONL append helper
 # path: target file path (if None, function is a no-op)
@@ -32,7 +43,252 @@ def jwrite(path, obj, default_fields=None):
     with open(path, "a") as f:
         f.write(json.dumps(obj) + "\n")
 
+# writers still open at exit/signal time, so buffered records are never lost
+_OPEN_WRITERS = weakref.WeakSet()
+
+def _close_all_writers():
+    for w in list(_OPEN_WRITERS):
+        w.close()
+
+atexit.register(_close_all_writers)
+
+def _flush_and_exit(signum, frame):
+    _close_all_writers()
+    # fall back to the default action so the exit status still says "killed by signal"
+    signal.signal(signum, signal.SIG_DFL)
+    os.kill(os.getpid(), signum)
+
+def install_signal_flush(signals=(signal.SIGTERM, signal.SIGHUP)):
+    """flush and close every JsonlWriter on these signals (call from the main thread)"""
+    for sig in signals:
+        if signal.getsignal(sig) == signal.SIG_DFL:
+            signal.signal(sig, _flush_and_exit)
+
+# JsonlWriter: long-lived, buffered replacement for calling jwrite once per record
+class JsonlWriter:
+    """
+    Keeps path open and buffers serialized records, flushing once flush_bytes are
+    buffered or flush_interval seconds have passed. With background=True a daemon
+    thread does the flushing so write() never waits on disk.
+    rotate_bytes / rotate_interval (0 = off) move the current file aside to
+    path.YYYYmmdd-HHMMSS once it is that big / that old and start a fresh one.
+    """
+    def __init__(self, path, default_fields=None, flush_bytes=64 * 1024, flush_interval=1.0,
+                 background=False, rotate_bytes=0, rotate_interval=0):
+        self.path = path
+        self.default_fields = default_fields or {}
+        self.flush_bytes = flush_bytes
+        self.flush_interval = flush_interval
+        self.rotate_bytes = rotate_bytes
+        self.rotate_interval = rotate_interval
+        self._buf = []
+        self._buf_size = 0
+        self._last_flush = time.time()
+        # _lock guards the buffer, _io_lock the file, so write() never blocks on a disk write
+        # (re-entrant so a signal handler can close() while the main thread is mid-write)
+        self._lock = threading.RLock()
+        self._io_lock = threading.RLock()
+        self._wake = threading.Condition(self._lock)
+        self._closed = False
+        self._open()
+        _OPEN_WRITERS.add(self)
+
+        self._thread = None
+        if background:
+            self._thread = threading.Thread(target=self._flush_loop, name="jsonl-flush", daemon=True)
+            self._thread.start()
+
+    def _open(self):
+        # ensure directory exists when given nested path
+        d = os.path.dirname(self.path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        self._f = open(self.path, "a")
+        self._file_size = self._f.tell()
+        self._opened_at = time.time()
+
+    def write(self, obj):
+        # same defaults as jwrite: fill missing default_fields and ts, never override
+        for k, v in self.default_fields.items():
+            obj.setdefault(k, v)
+        obj.setdefault("ts", time.time())
+        line = json.dumps(obj) + "\n"
+        with self._lock:
+            if self._closed:
+                raise ValueError(f"write to closed JsonlWriter({self.path})")
+            self._buf.append(line)
+            self._buf_size += len(line)
+            full = self._buf_size >= self.flush_bytes
+            if self._thread is not None:
+                if full:
+                    self._wake.notify()
+                return
+            due = full or time.time() - self._last_flush >= self.flush_interval
+        if due:
+            self.flush()
+
+    def write_lines(self, lines):
+        """
+        Append already serialized records ("...\\n" each, defaults and ts filled in by whoever
+        made them), e.g. batches from shard.py's worker processes.
+        """
+        size = sum(len(line) for line in lines)
+        with self._lock:
+            if self._closed:
+                raise ValueError(f"write to closed JsonlWriter({self.path})")
+            self._buf.extend(lines)
+            self._buf_size += size
+            full = self._buf_size >= self.flush_bytes
+            if self._thread is not None:
+                if full:
+                    self._wake.notify()
+                return
+            due = full or time.time() - self._last_flush >= self.flush_interval
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            lines = self._buf
+            self._buf = []
+            self._buf_size = 0
+            self._last_flush = time.time()
+        if not lines:
+            return
+        data = "".join(lines)
+        with self._io_lock:
+            if self._f is None:
+                return
+            started = time.perf_counter()
+            self._f.write(data)
+            self._f.flush()
+            FLUSH_TIME.observe(time.perf_counter() - started)
+            self._file_size += len(data)
+            self._maybe_rotate()
+
+    def _maybe_rotate(self):
+        too_big = self.rotate_bytes > 0 and self._file_size >= self.rotate_bytes
+        too_old = self.rotate_interval > 0 and time.time() - self._opened_at >= self.rotate_interval
+        if not (too_big or too_old):
+            return
+        self._f.close()
+        rotated = f"{self.path}.{time.strftime('%Y%m%d-%H%M%S')}"
+        n = 1
+        while os.path.exists(rotated):
+            rotated = f"{self.path}.{time.strftime('%Y%m%d-%H%M%S')}.{n}"
+            n += 1
+        os.rename(self.path, rotated)
+        self._open()
+
+    def _flush_loop(self):
+        while True:
+            with self._lock:
+                if not self._closed and self._buf_size < self.flush_bytes:
+                    self._wake.wait(self.flush_interval)
+                closed = self._closed
+            self.flush()
+            if closed:
+                return
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._wake.notify()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self.flush()
+        with self._io_lock:
+            self._f.close()
+            self._f = None
+        _OPEN_WRITERS.discard(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# LogHistogram: mergeable log-bucketed sketch (DDSketch/HDR-style) for streaming percentiles
+class LogHistogram:
+    """
+    Bucket i holds values in (gamma^(i-1), gamma^i], gamma = (1+a)/(1-a), so any
+    percentile comes back within relative error a. Memory is bounded by the dynamic
+    range, not the sample count (~1200 buckets cover 1 ns..1000 s at a=1%), and
+    two histograms with the same a merge by adding bucket counts.
+    """
+    def __init__(self, rel_err=0.01, min_value=1e-6):
+        self.rel_err = rel_err
+        self.gamma = (1 + rel_err) / (1 - rel_err)
+        self._inv_log_gamma = 1.0 / math.log(self.gamma)
+        # values at or below min_value (incl. 0) share one bucket
+        self.min_value = min_value
+        self.zero = 0
+        self.counts = {}
+        self.n = 0
+
+    def add(self, x):
+        self.n += 1
+        if x <= self.min_value:
+            self.zero += 1
+            return
+        i = math.ceil(math.log(x) * self._inv_log_gamma)
+        self.counts[i] = self.counts.get(i, 0) + 1
+
+    def add_many(self, values):
+        """bulk add, counting bucket indexes in C via Counter"""
+        big = [x for x in values if x > self.min_value]
+        self.zero += len(values) - len(big)
+        self.n += len(values)
+        k = self._inv_log_gamma
+        log = math.log
+        ceil = math.ceil
+        for i, c in Counter(ceil(log(x) * k) for x in big).items():
+            self.counts[i] = self.counts.get(i, 0) + c
+
+    def merge(self, other):
+        if other.rel_err != self.rel_err:
+            raise ValueError("can only merge histograms with the same rel_err")
+        self.n += other.n
+        self.zero += other.zero
+        for i, c in other.counts.items():
+            self.counts[i] = self.counts.get(i, 0) + c
+        return self
+
+    def percentile(self, q):
+        """value at quantile q (0..1), None if empty"""
+        if self.n == 0:
+            return None
+        # nearest-rank: the smallest value with at least q of the samples at or below it
+        rank = max(1, math.ceil(q * self.n))
+        seen = self.zero
+        if seen >= rank:
+            return 0.0
+        for i in sorted(self.counts):
+            seen += self.counts[i]
+            if seen >= rank:
+                # midpoint (in relative terms) of (gamma^(i-1), gamma^i]
+                return 2.0 * self.gamma ** i / (self.gamma + 1)
+        return 2.0 * self.gamma ** max(self.counts) / (self.gamma + 1)
+
+    def to_dict(self):
+        return {"rel_err": self.rel_err, "min_value": self.min_value, "zero": self.zero,
+                "n": self.n, "counts": {str(i): c for i, c in self.counts.items()}}
+
+    @classmethod
+    def from_dict(cls, d):
+        h = cls(d["rel_err"], d["min_value"])
+        h.zero = d["zero"]
+        h.n = d["n"]
+        h.counts = {int(i): c for i, c in d["counts"].items()}
+        return h
+
+# percentiles reported by every summary
+PERCENTILES = (("p50", 0.50), ("p90", 0.90), ("p99", 0.99), ("p99.9", 0.999))
+
 # OnlineStats: Welford's algorithm for online mean/stddev, plus min/max
+# and a LogHistogram for percentiles
 class OnlineStats:
     def __init__(self):
         self.n = 0
@@ -40,6 +296,7 @@ class OnlineStats:
         self.M2 = 0.0
         self.min = float('inf')
         self.max = float('-inf')
+        self.hist = LogHistogram()
 
     def add(self, x):
         self.n += 1
@@ -48,6 +305,61 @@ class OnlineStats:
         self.M2 += d * (x - self.mean)
         if x < self.min: self.min = x
         if x > self.max: self.max = x
+        self.hist.add(x)
+
+    def percentile(self, q):
+        """approximate value at quantile q (0..1), clamped to the exact min/max"""
+        v = self.hist.percentile(q)
+        if v is None:
+            return None
+        return min(max(v, self.min), self.max)
+
+    @classmethod
+    def from_values(cls, values):
+        """build stats for a whole list at once (two-pass, no per-sample Python update)"""
+        stats = cls()
+        n = len(values)
+        if n:
+            stats.n = n
+            stats.mean = math.fsum(values) / n
+            stats.M2 = math.fsum((x - stats.mean) ** 2 for x in values)
+            stats.min = min(values)
+            stats.max = max(values)
+            stats.hist.add_many(values)
+        return stats
+
+    def merge(self, other):
+        """fold another OnlineStats into this one (Chan et al. parallel variance)"""
+        if other.n == 0:
+            return self
+        self.hist.merge(other.hist)
+        if self.n == 0:
+            self.n, self.mean, self.M2 = other.n, other.mean, other.M2
+            self.min, self.max = other.min, other.max
+            return self
+        n = self.n + other.n
+        d = other.mean - self.mean
+        self.mean += d * other.n / n
+        self.M2 += other.M2 + d * d * self.n * other.n / n
+        self.n = n
+        if other.min < self.min: self.min = other.min
+        if other.max > self.max: self.max = other.max
+        return self
+
+    def to_dict(self):
+        return {"n": self.n, "mean": self.mean, "M2": self.M2,
+                "min": (self.min if self.n>0 else None),
+                "max": (self.max if self.n>0 else None),
+                "hist": self.hist.to_dict()}
+
+    @classmethod
+    def from_dict(cls, d):
+        stats = cls()
+        stats.n, stats.mean, stats.M2 = d["n"], d["mean"], d["M2"]
+        if stats.n > 0:
+            stats.min, stats.max = d["min"], d["max"]
+        stats.hist = LogHistogram.from_dict(d["hist"])
+        return stats
 
     def summary(self):
         var = self.M2 / (self.n - 1) if self.n > 1 else 0.0
@@ -55,81 +367,389 @@ class OnlineStats:
                 "min": (self.min if self.n>0 else None),
                 "avg": (self.mean if self.n>0 else None),
                 "max": (self.max if self.n>0 else None),
-                "stddev": math.sqrt(var)}
+                "stddev": math.sqrt(var),
+                **{name: self.percentile(q) for name, q in PERCENTILES}}
 
-# summarize_ping: read a ping JSONL and print RTT stats and loss
-def summarize_ping(jsonl_path):
+def format_percentiles(s, sep=", ", eq="=", unit=""):
+    """'p50=1.234, p90=...' for a summary() dict"""
+    return sep.join(f"{name}{eq}{s[name]:.3f}{unit}" for name, _ in PERCENTILES)
+
+# iter_lines: yield the lines that *start* inside [start, end) of a file, read through mmap
+# so a big file can be split into byte ranges without any range losing or repeating a line
+def iter_lines(path, start=0, end=None):
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            end = size if end is None else min(end, size)
+            pos = start
+            # a range that starts mid-line leaves that line to the previous range
+            if pos > 0 and mm[pos - 1] != 0x0A:
+                nl = mm.find(b"\n", pos)
+                pos = size if nl == -1 else nl + 1
+            while pos < end:
+                nl = mm.find(b"\n", pos)
+                if nl == -1:
+                    nl = size
+                yield mm[pos:nl]
+                pos = nl + 1
+
+def binlog_for(path):
+    """the binlog module if path is a binary log (see binlog.py), else None"""
+    # binlog imports this module, so it is only pulled in once a binary log shows up
+    with open(path, "rb") as f:
+        if f.read(4) != b"PLOG":
+            return None
+    import binlog
+    return binlog if binlog.is_binlog(path) else None
+
+# scan_ping: partial ping stats (sent, recv, OnlineStats) for one byte range of a JSONL file
+# (or of a binlog, which is read column-wise instead)
+def scan_ping(jsonl_path, start=0, end=None):
+    binlog = binlog_for(jsonl_path)
+    if binlog is not None:
+        return binlog.scan_ping(jsonl_path, start, end)
     sent = 0
     recv = 0
     stats = OnlineStats()
-    with open(jsonl_path) as f:
-        for line in f:
-            try:
-                obj = json.loads(line)
-            except Exception:
-                # skip bad lines
-                continue
-            sent += 1
-            # accept either unified "rtt" or legacy "rtt_ms"
-            rtt = obj.get("rtt", obj.get("rtt_ms"))
-            # only count RTTs for successful probes (no error)
-            if rtt is not None and obj.get("err") is None:
-                stats.add(float(rtt))
-                recv += 1
-    loss = (sent - recv) / sent * 100.0 if sent>0 else None
+    for line in iter_lines(jsonl_path, start, end):
+        try:
+            obj = json.loads(line)
+        except Exception:
+            # skip bad lines
+            continue
+        sent += 1
+        # accept either unified "rtt" or legacy "rtt_ms"
+        rtt = obj.get("rtt", obj.get("rtt_ms"))
+        # only count RTTs for successful probes (no error)
+        if rtt is not None and obj.get("err") is None:
+            stats.add(float(rtt))
+            recv += 1
+    return sent, recv, stats
+
+def merge_ping(parts):
+    sent = 0
+    recv = 0
+    stats = OnlineStats()
+    for part_sent, part_recv, part_stats in parts:
+        sent += part_sent
+        recv += part_recv
+        stats.merge(part_stats)
+    return sent, recv, stats
+
+# self-overhead profile written by calibrate.py --save (None = not loaded), see load_overhead
+_OVERHEAD = None
+
+def load_overhead(path):
+    """annotate the ping/trace summaries with the prober's own loopback floor from this profile"""
+    global _OVERHEAD
+    with open(path) as f:
+        _OVERHEAD = json.load(f)
+    return _OVERHEAD
+
+def _overhead_for(*engines):
+    """the loaded profile's entry for the first of engines it has, or None"""
+    if _OVERHEAD is None:
+        return None
+    for engine in engines:
+        prof = _OVERHEAD["engines"].get(engine)
+        if prof is not None and prof.get("p50_ms") is not None:
+            return engine, prof
+    return None
+
+def print_ping_summary(jsonl_path, sent, recv, stats):
+    loss = (sent - recv) / sent * 100.0 if sent>0 else 0.0
     s = stats.summary()
     print(f"Ping summary for {jsonl_path}: sent={sent}, recv={recv}, loss={loss:.1f}%")
     if s["count"]>0:
         print(f" RTT ms: min={s['min']:.3f}, avg={s['avg']:.3f}, max={s['max']:.3f}, stddev={s['stddev']:.3f}")
+        print(f" RTT percentiles ms: {format_percentiles(s)}")
+        overhead = _overhead_for("ping", "multiping")
+        if overhead is not None:
+            engine, prof = overhead
+            floor = prof["p50_ms"]
+            # net of the floor: what the network (not the prober) took
+            note = "within the prober's own noise" if s["p50"] <= prof["p99_ms"] else "above the prober's noise"
+            print(f" Net of self-overhead ({_OVERHEAD['host']}, {engine}: floor p50={floor:.3f} p99={prof['p99_ms']:.3f}) ms: "
+                  f"avg={max(0.0, s['avg'] - floor):.3f}, p50={max(0.0, s['p50'] - floor):.3f}, "
+                  f"p99={max(0.0, s['p99'] - floor):.3f}; median {note}")
     else:
         print(" No successful RTT samples.")
 
-# summarize_trace: aggregate traceroute JSONL by TTL/hop and print per-hop statistics
-def summarize_trace(jsonl_path):
-    # hops: map ttl -> {"stats": OnlineStats(), "total": probe_count_at_this_ttl}
-    hops = defaultdict(lambda: {"stats": OnlineStats(), "total": 0})
-    with open(jsonl_path) as f:
-        for line in f:
-            try:
-                obj = json.loads(line)
-            except Exception:
-                continue
-            # accept either "ttl" or "hop" field
-            ttl = obj.get("ttl") or obj.get("hop")
-            if ttl is None:
-                continue
-            hops[ttl]["total"] += 1
-            # accept either unified "rtt" or legacy "rtt_ms"
-            rtt = obj.get("rtt", obj.get("rtt_ms"))
-            # treat any non-timeout probe with an RTT as a valid reply
-            if rtt is not None and obj.get("err") != "timeout":
-                hops[ttl]["stats"].add(float(rtt))
+# summarize_ping: read a ping JSONL and print RTT stats and loss
+def summarize_ping(jsonl_path):
+    print_ping_summary(jsonl_path, *scan_ping(jsonl_path))
+
+# scan_trace: partial per-hop stats {ttl: [total, OnlineStats]} for one byte range of a JSONL file
+def scan_trace(jsonl_path, start=0, end=None):
+    binlog = binlog_for(jsonl_path)
+    if binlog is not None:
+        return binlog.scan_trace(jsonl_path, start, end)
+    # plain dict (not defaultdict+lambda) so partials can come back from worker processes
+    hops = {}
+    for line in iter_lines(jsonl_path, start, end):
+        try:
+            obj = json.loads(line)
+        except Exception:
+            continue
+        # accept either "ttl" or "hop" field
+        ttl = obj.get("ttl") or obj.get("hop")
+        if ttl is None:
+            continue
+        hop = hops.get(ttl)
+        if hop is None:
+            hop = hops[ttl] = [0, OnlineStats()]
+        hop[0] += 1
+        # accept either unified "rtt" or legacy "rtt_ms"
+        rtt = obj.get("rtt", obj.get("rtt_ms"))
+        # treat any non-timeout probe with an RTT as a valid reply
+        if rtt is not None and obj.get("err") != "timeout":
+            hop[1].add(float(rtt))
+    return hops
+
+def merge_trace(parts):
+    hops = {}
+    for part in parts:
+        for ttl, (total, stats) in part.items():
+            hop = hops.get(ttl)
+            if hop is None:
+                hop = hops[ttl] = [0, OnlineStats()]
+            hop[0] += total
+            hop[1].merge(stats)
+    return hops
+
+def print_trace_summary(jsonl_path, hops):
     print(f"Traceroute summary for {jsonl_path}:")
+    overhead = _overhead_for("parallel", "trace")
+    if overhead is not None:
+        engine, prof = overhead
+        print(f" Self-overhead ({_OVERHEAD['host']}, {engine}): floor p50={prof['p50_ms']:.3f} p99={prof['p99_ms']:.3f} ms; "
+              f"hops marked * have a median within it")
     for ttl in sorted(hops.keys()):
-        data = hops[ttl]
-        s = data["stats"].summary()
-        total = data["total"]
+        total, stats = hops[ttl]
+        s = stats.summary()
         replies = s["count"]
         loss = (total - replies) / total * 100.0 if total>0 else 100.0
         if replies > 0:
-            print(f" TTL {ttl}: replies={replies}/{total}, loss={loss:.1f}%, mean={s['avg']:.3f} ms, stddev={s['stddev']:.3f}")
+            flag = " *" if overhead is not None and s["p50"] <= overhead[1]["p99_ms"] else ""
+            print(f" TTL {ttl}: replies={replies}/{total}, loss={loss:.1f}%, mean={s['avg']:.3f} ms, stddev={s['stddev']:.3f}, {format_percentiles(s)}{flag}")
         else:
             print(f" TTL {ttl}: 0 replies / {total} probes (loss=100.0%)")
 
+# summarize_trace: aggregate traceroute JSONL by TTL/hop and print per-hop statistics
+def summarize_trace(jsonl_path):
+    print_trace_summary(jsonl_path, scan_trace(jsonl_path))
+
+def split_file(path, chunk_bytes):
+    """byte ranges of roughly chunk_bytes covering path (iter_lines snaps them to line starts)"""
+    size = os.path.getsize(path)
+    if chunk_bytes <= 0 or size <= chunk_bytes:
+        return [(0, None)]
+    return [(start, start + chunk_bytes) for start in range(0, size, chunk_bytes)]
+
+_SCANNERS = {"ping": (scan_ping, merge_ping, print_ping_summary),
+             "trace": (scan_trace, merge_trace, print_trace_summary)}
+
+def _scan_range(kind, path, start, end):
+    return _SCANNERS[kind][0](path, start, end)
+
+# summarize_many: fan files (and byte ranges of big files) out to a process pool,
+# merge the partial OnlineStats per file and print the same summaries as summarize_ping/trace
+def summarize_many(kind, paths, workers=0, chunk_bytes=64 * 1024 * 1024):
+    scan, merge, report = _SCANNERS[kind]
+    tasks = [(path, start, end) for path in paths for start, end in split_file(path, chunk_bytes)]
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1 or len(tasks) <= 1:
+        parts = [scan(path, start, end) for path, start, end in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as pool:
+            parts = list(pool.map(_scan_range, [kind] * len(tasks), *zip(*tasks)))
+    by_path = defaultdict(list)
+    for (path, _, _), part in zip(tasks, parts):
+        by_path[path].append(part)
+    for path in paths:
+        if path in by_path:
+            report(path, *_as_args(merge(by_path.pop(path))))
+            print()
+
+def _as_args(merged):
+    # ping merges to a (sent, recv, stats) tuple, trace to a single hops dict
+    return merged if isinstance(merged, tuple) else (merged,)
+
+# Incremental summaries: the stats so far, plus where they stopped, live in a small JSON
+# sidecar next to each log, so a refresh only scans what was appended since the last one.
+# sidecar: {"kind", "dev", "inode", "offset", "tail", "partial"}
+#   offset: end of the last complete line (binlog: block) already counted
+#   tail:   hex of the bytes just before offset, to notice a file truncated and regrown past it
+SIDECAR_SUFFIX = ".sumstate"
+_TAIL_BYTES = 32
+
+def _encode_partial(kind, part):
+    if kind == "ping":
+        sent, recv, stats = part
+        return {"sent": sent, "recv": recv, "stats": stats.to_dict()}
+    # list, not dict, so ttl keeps its type through JSON
+    return [[ttl, total, stats.to_dict()] for ttl, (total, stats) in part.items()]
+
+def _decode_partial(kind, d):
+    if kind == "ping":
+        return d["sent"], d["recv"], OnlineStats.from_dict(d["stats"])
+    return {ttl: [total, OnlineStats.from_dict(stats)] for ttl, total, stats in d}
+
+def complete_end(path, start):
+    """end of the last complete record at or after start; a live writer may be mid-line"""
+    binlog = binlog_for(path)
+    if binlog is not None:
+        return binlog.complete_end(path, start)
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size <= start:
+            return start
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            nl = mm.rfind(b"\n", start)
+            return start if nl == -1 else nl + 1
+
+def tail(path, offset):
+    """hex of the bytes just before offset, to notice a file truncated and regrown past it"""
+    with open(path, "rb") as f:
+        f.seek(max(0, offset - _TAIL_BYTES))
+        return f.read(min(offset, _TAIL_BYTES)).hex()
+
+def _rotated_since(path, dev, inode):
+    """
+    Files path was rotated to (JsonlWriter renames it to path.YYYYmmdd-HHMMSS[.n]) from the
+    one with this dev/inode onwards, oldest first. [] if that file is gone.
+    """
+    d = os.path.dirname(path) or "."
+    pattern = re.compile(re.escape(os.path.basename(path)) + r"\.\d{8}-\d{6}(\.\d+)?$")
+    rotated = []
+    for name in os.listdir(d):
+        if not pattern.match(name):
+            continue
+        try:
+            st = os.stat(os.path.join(d, name))
+        except OSError:
+            continue
+        rotated.append((st.st_mtime_ns, name, (st.st_dev, st.st_ino)))
+    rotated.sort()
+    for i, (_, _, key) in enumerate(rotated):
+        if key == (dev, inode):
+            # the writer rotated more than once since the last refresh: take the later ones whole
+            return [os.path.join(d, name) for _, name, _ in rotated[i:]]
+    return []
+
+def load_state(path):
+    """sidecar state for path, None if there is none (or it is unreadable)"""
+    try:
+        with open(path + SIDECAR_SUFFIX) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def save_state(path, state):
+    # write-then-rename so a reader (or a crash) never sees half a sidecar
+    tmp = path + SIDECAR_SUFFIX + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp, path + SIDECAR_SUFFIX)
+
+def update_incremental(kind, path, state=None):
+    """
+    Fold whatever was appended to path since state into its stats.
+        state: as returned by a previous call / load_state(), None to start from byte 0
+    Returns (merged, state) where merged is what scan_ping/scan_trace would give for the
+    whole file. If path was rotated the rest of the old file is read first and the stats
+    carry on into the new one; if it was truncated they start over.
+    """
+    scan, merge, _ = _SCANNERS[kind]
+    st = os.stat(path)
+    parts = []
+    offset = 0
+    if state is not None and state.get("kind") == kind:
+        parts.append(_decode_partial(kind, state["partial"]))
+        offset = state["offset"]
+        if (st.st_dev, st.st_ino) != (state["dev"], state["inode"]):
+            # rotated: finish the old file (and any rotated after it), then start the new one
+            start = offset
+            for old in _rotated_since(path, state["dev"], state["inode"]):
+                parts.append(scan(old, start, None))
+                start = 0
+            offset = 0
+        elif st.st_size < offset or tail(path, offset) != state["tail"]:
+            # truncated (and maybe rewritten): what was counted is gone
+            parts = []
+            offset = 0
+
+    end = complete_end(path, offset)
+    if end > offset:
+        parts.append(scan(path, offset, end))
+    merged = merge(parts)
+    state = {"kind": kind, "dev": st.st_dev, "inode": st.st_ino, "offset": end,
+             "tail": tail(path, end), "partial": _encode_partial(kind, merged)}
+    return merged, state
+
+def summarize_incremental(kind, path, state=None):
+    """
+    Print the summary for path, scanning only what is new since the sidecar (or the
+    given state) was saved. Returns the new state, which is also saved to the sidecar.
+    """
+    if state is None:
+        state = load_state(path)
+    try:
+        merged, state = update_incremental(kind, path, state)
+    except FileNotFoundError:
+        # e.g. between a rotation's rename and the writer reopening path
+        print(f"{path}: not found")
+        return state
+    save_state(path, state)
+    _SCANNERS[kind][2](path, *_as_args(merged))
+    return state
+
+def follow(kind_paths, interval=60.0):
+    """re-summarize [(kind, path), ...] incrementally every interval seconds until interrupted"""
+    states = {}
+    try:
+        while True:
+            for kind, path in kind_paths:
+                states[kind, path] = summarize_incremental(kind, path, states.get((kind, path)))
+                print()
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+
 # CLI entrypoint to run summaries from the terminal
 def main():
     p = argparse.ArgumentParser()
-    p.add_argument("--ping", nargs='*', help="ping JSONL files to summarize")
-    p.add_argument("--trace", nargs='*', help="trace JSONL files to summarize")
+    p.add_argument("--ping", nargs='*', help="ping JSONL (or binlog) files to summarize")
+    p.add_argument("--trace", nargs='*', help="trace JSONL (or binlog) files to summarize")
+    p.add_argument("--workers", type=int, default=0,
+                   help="worker processes for summarizing (0 = one per CPU, 1 = no pool)")
+    p.add_argument("--chunk-mb", type=float, default=64,
+                   help="split files bigger than this into byte ranges scanned in parallel")
+    p.add_argument("--incremental", action="store_true",
+                   help=f"only scan what was appended since the last run (state kept in FILE{SIDECAR_SUFFIX})")
+    p.add_argument("--follow", type=float, metavar="SECONDS",
+                   help="keep re-summarizing incrementally every SECONDS until interrupted")
+    p.add_argument("--overhead", type=str, metavar="PROFILE",
+                   help="self-overhead profile from calibrate.py --save: report RTTs net of the prober's floor")
     args = p.parse_args()
-    if args.ping:
-        for path in args.ping:
-            summarize_ping(path)
+    if args.overhead:
+        load_overhead(args.overhead)
+    chunk_bytes = int(args.chunk_mb * 1024 * 1024)
+    kind_paths = [("ping", path) for path in args.ping or []] + [("trace", path) for path in args.trace or []]
+    if args.follow:
+        follow(kind_paths, args.follow)
+        return
+    if args.incremental:
+        for kind, path in kind_paths:
+            summarize_incremental(kind, path)
             print()
+        return
+    if args.ping:
+        summarize_many("ping", args.ping, args.workers, chunk_bytes)
     if args.trace:
-        for path in args.trace:
-            summarize_trace(path)
-            print()
+        summarize_many("trace", args.trace, args.workers, chunk_bytes)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,246 @@
+import atexit
+import os
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Metrics: process-wide counters and latency histograms for the probe pipelines, so a run
+# shows whether the prober itself is the bottleneck (time in select vs. parse vs. log
+# writes, packets dropped before matching) rather than the network.
+#
+# Instruments are created once at import time by the modules that update them and updated
+# with a plain attribute add (no lock: the GIL makes a lost update rare, and metrics don't
+# need to be exact). The registry renders them in the Prometheus text format, served over
+# HTTP by serve() or written to a file by dump_every().
+
+# seconds, for select/parse/write timings (5 us .. 2.5 s)
+TIME_BUCKETS = (0.000005, 0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+                0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+class Counter:
+    def __init__(self, labels):
+        self.labels = labels
+        self.value = 0
+
+    def inc(self, n=1):
+        self.value += n
+
+class Histogram:
+    """observations counted into fixed upper bounds (cumulated only when rendered)"""
+    def __init__(self, labels, buckets=TIME_BUCKETS):
+        self.labels = labels
+        self.bounds = tuple(buckets)
+        # counts[i]: observations <= bounds[i] and > bounds[i - 1]; the last is above all bounds
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+def _format_labels(labels, extra=None):
+    items = list(labels) + ([extra] if extra else [])
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+def _format_value(v):
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+class Registry:
+    def __init__(self):
+        # name -> (type, help, {labels tuple: instrument})
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, kind, name, help, labels, make):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            entry = self._metrics.get(name)
+            if entry is None:
+                entry = self._metrics[name] = (kind, help, {})
+            elif entry[0] != kind:
+                raise ValueError(f"metric {name} is already a {entry[0]}")
+            series = entry[2].get(key)
+            if series is None:
+                series = entry[2][key] = make(key)
+            return series
+
+    def counter(self, name, help, **labels):
+        """the counter name{labels}, created on first use"""
+        return self._get("counter", name, help, labels, Counter)
+
+    def histogram(self, name, help, buckets=TIME_BUCKETS, **labels):
+        """the histogram name{labels}, created on first use"""
+        return self._get("histogram", name, help, labels, lambda key: Histogram(key, buckets))
+
+    def render(self):
+        """every metric in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            metrics = [(name, kind, help, list(series.values()))
+                       for name, (kind, help, series) in sorted(self._metrics.items())]
+        for name, kind, help, series in metrics:
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for s in series:
+                if kind == "counter":
+                    lines.append(f"{name}{_format_labels(s.labels)} {_format_value(s.value)}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(s.bounds, s.counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_format_labels(s.labels, ('le', repr(bound)))} {cumulative}")
+                lines.append(f"{name}_bucket{_format_labels(s.labels, ('le', '+Inf'))} {s.count}")
+                lines.append(f"{name}_sum{_format_labels(s.labels)} {_format_value(s.sum)}")
+                lines.append(f"{name}_count{_format_labels(s.labels)} {s.count}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        """
+        every series as plain data, e.g. to send from a worker process: {name: (kind, help,
+        {labels: value})}, value a counter's count or a histogram's (bounds, counts, sum, count)
+        """
+        with self._lock:
+            metrics = [(name, kind, help, list(series.items()))
+                       for name, (kind, help, series) in self._metrics.items()]
+        snap = {}
+        for name, kind, help, series in metrics:
+            values = {}
+            for key, s in series:
+                values[key] = s.value if kind == "counter" else (s.bounds, list(s.counts), s.sum, s.count)
+            snap[name] = (kind, help, values)
+        return snap
+
+    def merge(self, snap):
+        """add a snapshot() (or a delta() of two) from another registry into this one"""
+        for name, (kind, help, values) in snap.items():
+            for key, value in values.items():
+                if kind == "counter":
+                    self._get(kind, name, help, dict(key), Counter).inc(value)
+                    continue
+                bounds, counts, total, count = value
+                h = self._get(kind, name, help, dict(key), lambda key: Histogram(key, bounds))
+                for i, n in enumerate(counts):
+                    h.counts[i] += n
+                h.sum += total
+                h.count += count
+
+    def write(self, path):
+        """render() to path (write-then-rename, so a reader never sees half a file)"""
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            f.write(self.render())
+        os.replace(tmp, path)
+
+def delta(new, old):
+    """what snapshot new has on top of old, an earlier snapshot of the same registry (changed series only)"""
+    out = {}
+    for name, (kind, help, values) in new.items():
+        before = old.get(name, (kind, help, {}))[2]
+        changed = {}
+        for key, value in values.items():
+            prev = before.get(key)
+            if kind == "counter":
+                if value != (prev or 0):
+                    changed[key] = value - (prev or 0)
+                continue
+            bounds, counts, total, count = value
+            if prev is None:
+                changed[key] = value
+            elif count != prev[3]:
+                changed[key] = (bounds, [n - p for n, p in zip(counts, prev[1])], total - prev[2], count - prev[3])
+        if changed:
+            out[name] = (kind, help, changed)
+    return out
+
+REGISTRY = Registry()
+
+def counter(name, help, **labels):
+    return REGISTRY.counter(name, help, **labels)
+
+def histogram(name, help, buckets=TIME_BUCKETS, **labels):
+    return REGISTRY.histogram(name, help, buckets, **labels)
+
+class ProbeMetrics:
+    """the instruments every probe engine updates, labelled tool=tool"""
+    def __init__(self, tool, registry=REGISTRY):
+        self.sent = registry.counter("probe_packets_sent_total", "Echo Requests sent", tool=tool)
+        self.replies = registry.counter("probe_replies_total",
+                                        "Probes answered (Echo Reply, Time Exceeded or Unreachable)", tool=tool)
+        self.timeouts = registry.counter("probe_timeouts_total", "Probes given up on without an answer", tool=tool)
+        self.late = registry.counter("probe_late_replies_total",
+                                     "Answers accepted after the probe's adaptive RTO had passed", tool=tool)
+        self.received = registry.counter("probe_packets_received_total", "Packets read from raw sockets", tool=tool)
+        # packets read but not matched to a probe, by why
+        dropped = "Packets read but not matched to a probe"
+        self.short = registry.counter("probe_packets_dropped_total", dropped, tool=tool, reason="short")
+        self.foreign = registry.counter("probe_packets_dropped_total", dropped, tool=tool, reason="foreign")
+        self.stale = registry.counter("probe_packets_dropped_total", dropped, tool=tool, reason="stale")
+        self.checksum = registry.counter("probe_packets_dropped_total", dropped, tool=tool, reason="checksum")
+        self.select_time = registry.histogram("probe_select_seconds",
+                                              "Time blocked waiting for packets (select() or a blocking recv) per call", tool=tool)
+        self.parse_time = registry.histogram("probe_parse_seconds",
+                                             "Time reading, decoding and matching the packets of one wakeup",
+                                             tool=tool)
+
+    def dropped(self, ours, icmp_type):
+        """the drop counter for a decoded packet that matched no probe"""
+        # our id but nothing waiting on it: timed out already, a duplicate or a wrong seq
+        return self.stale if ours and icmp_type in (0, 3, 11) else self.foreign
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = self.server.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # scrapes shouldn't interleave with probe output
+        pass
+
+def serve(port, host="127.0.0.1", registry=REGISTRY):
+    """serve the registry at http://host:port/metrics from a daemon thread; returns the server"""
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    server.registry = registry
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
+
+def dump_every(path, interval=10.0, registry=REGISTRY):
+    """write the registry to path every interval seconds from a daemon thread, and once more at exit"""
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                registry.write(path)
+            except OSError:
+                pass
+    if interval > 0:
+        threading.Thread(target=loop, name="metrics-dump", daemon=True).start()
+    atexit.register(registry.write, path)
+
+def add_arguments(parser):
+    """the --metrics-* flags shared by the CLIs"""
+    parser.add_argument("--metrics-port", type=int,
+                        help="Serve probe/parse/log metrics in Prometheus text format on 127.0.0.1:PORT/metrics")
+    parser.add_argument("--metrics-file", type=str,
+                        help="Write the metrics (Prometheus text format) to this file periodically and at exit")
+    parser.add_argument("--metrics-interval", type=float, default=10.0,
+                        help="Seconds between --metrics-file writes")
+
+def start(args):
+    """start whatever exporters the --metrics-* flags ask for"""
+    if args.metrics_port is not None:
+        serve(args.metrics_port)
+    if args.metrics_file:
+        dump_every(args.metrics_file, args.metrics_interval)
@@ -0,0 +1,237 @@
+import socket
+import os
+import sys
+import select
+import time
+from collections import OrderedDict, deque
+
+from ping import send_echo, enable_rx_timestamps, attach_id_filter, decode_reply, icmp_socket, PacketReader
+from scheduler import ProbeScheduler
+from metrics import ProbeMetrics
+
+METRICS = ProbeMetrics("multiping")
+
+def read_targets(path):
+    """
+    Read a target list, one hostname/IP per line. Blank lines and # comments are skipped.
+        path: file path, or "-" for stdin
+    """
+    f = sys.stdin if path == "-" else open(path)
+    try:
+        targets = []
+        for line in f:
+            line = line.split("#", 1)[0].strip()
+            if line:
+                targets.append(line)
+        return targets
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+class MultiPinger:
+    """
+    Ping many destinations over one long-lived raw socket.
+    Every probe gets its own ICMP seq, so replies can be matched back by (id, seq)
+    in a single select loop while thousands of probes are in flight.
+    """
+    RCVBUF = 4 * 1024 * 1024
+
+    def __init__(self, targets, count=1, interval=1.0, timeout=1.0, qps_limit=0.0, max_inflight=4096, shared=None,
+                 kernel_ts=False, bpf=False, ID=None):
+        self.targets = list(targets)
+        self.count = count
+        self.interval = interval
+        self.timeout = timeout
+        # global send rate across all targets (0 = unlimited); shared is a scheduler.TokenBucket
+        # to also cap this pinger together with other probers in the process. Scheduling runs
+        # on the monotonic clock, like TokenBucket's default; wall-clock time is only logged
+        self.qps_limit = qps_limit
+        self.sched = ProbeScheduler(rate=qps_limit, shared=shared)
+        # seq is 16 bits, so never keep more than that in flight for one ID
+        self.max_inflight = max(1, min(max_inflight, 0xFFFF))
+        # ICMP id of every probe; pass one to run several pingers side by side (see shard.py)
+        self.ID = os.getpid() & 0xFFFF if ID is None else ID
+        self.next_seq = 0
+        # (id, seq) -> response dict, kept in send order so the oldest expires first
+        self.inflight = OrderedDict()
+        # (id, seq) -> perf_counter_ns() at send, for the RTT
+        self.sent_ns = {}
+        # (id, seq) -> time.monotonic() it times out at; ts_send is wall clock, only for the log
+        self.deadlines = {}
+        # time replies with the kernel's receive timestamp (SO_TIMESTAMPNS)
+        self.kernel_ts = kernel_ts
+        # drop other processes' ICMP in the kernel (SO_ATTACH_FILTER on self.ID)
+        self.bpf = bpf
+        self.dest_ips = {}
+
+    def resolve(self):
+        """resolve every target once up front, None for names that don't resolve"""
+        for target in self.targets:
+            if target in self.dest_ips:
+                continue
+            try:
+                self.dest_ips[target] = socket.gethostbyname(target)
+            except (socket.gaierror, UnicodeError):
+                self.dest_ips[target] = None
+
+    def run(self, on_result):
+        """
+        Send count rounds of probes (one per target, interval apart) and call
+        on_result(target, response) for every probe once it is answered or timed out.
+        """
+        self.resolve()
+        mySocket = icmp_socket()
+        mySocket.setblocking(False)
+        # bursts of replies from many targets overflow the default receive buffer
+        try:
+            mySocket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.RCVBUF)
+        except OSError:
+            pass
+        if self.kernel_ts:
+            self.kernel_ts = enable_rx_timestamps(mySocket)
+        if self.bpf:
+            self.bpf = attach_id_filter(mySocket, self.ID)
+        self.reader = PacketReader(mySocket, 1024, self.kernel_ts)
+        try:
+            self._loop(mySocket, on_result)
+        finally:
+            mySocket.close()
+
+    def _loop(self, mySocket, on_result):
+        start = self.start = time.monotonic()
+        rounds = 0
+        queue = deque()
+
+        while True:
+            now = time.monotonic()
+            # queue up each round of probes once its start time arrives
+            while rounds < self.count and now >= start + rounds * self.interval:
+                queue.extend((target, rounds) for target in self.targets)
+                rounds += 1
+
+            # send as many as the rate limit and in-flight window allow
+            while queue and len(self.inflight) < self.max_inflight and now >= self.sched.ready_at():
+                target, probe_seq = queue.popleft()
+                if not self._send(mySocket, target, probe_seq, on_result):
+                    queue.appendleft((target, probe_seq))
+                    break
+                self.sched.take(now)
+                now = time.monotonic()
+
+            self._expire(time.monotonic(), on_result)
+
+            if rounds >= self.count and not queue and not self.inflight:
+                return
+
+            # sleep until a reply arrives or the next thing is due
+            wake = []
+            if rounds < self.count:
+                wake.append(start + rounds * self.interval)
+            if self.inflight:
+                wake.append(self.deadlines[next(iter(self.inflight))])
+            if queue and len(self.inflight) < self.max_inflight:
+                wake.append(self.sched.ready_at())
+            wait = max(0.0, min(wake) - time.monotonic()) if wake else 0.0
+
+            started = time.perf_counter()
+            what_ready = select.select([mySocket], [], [], wait)
+            METRICS.select_time.observe(time.perf_counter() - started)
+            if what_ready[0]:
+                self._drain(mySocket, on_result)
+
+    def _send(self, mySocket, target, probe_seq, on_result):
+        """send one probe, returns False if the socket buffer is full and it should be retried"""
+        dest_ip = self.dest_ips.get(target)
+        response = {"dst": target, "dst_ip": dest_ip, "id": self.ID, "seq": probe_seq}
+        if dest_ip is None:
+            response["ts_send"] = time.time()
+            response["err"] = f"Could not resolve {target}"
+            on_result(target, response)
+            return True
+
+        # pick the next seq that isn't still waiting for a reply
+        while (self.ID, self.next_seq) in self.inflight:
+            self.next_seq = (self.next_seq + 1) & 0xFFFF
+        wire_seq = self.next_seq
+        self.next_seq = (self.next_seq + 1) & 0xFFFF
+
+        try:
+            response["ts_send"], send_ns = send_echo(mySocket, dest_ip, self.ID, wire_seq)
+            # late against the round's start, whether held back by qps_limit or a busy loop
+            response["sched_late"] = self.sched.sent(self.start + probe_seq * self.interval, time.monotonic())
+        except BlockingIOError:
+            return False
+        except OSError as e:
+            response["ts_send"] = time.time()
+            response["err"] = f"Send failed: {e}"
+            on_result(target, response)
+            return True
+        self.inflight[(self.ID, wire_seq)] = response
+        self.sent_ns[(self.ID, wire_seq)] = send_ns
+        self.deadlines[(self.ID, wire_seq)] = time.monotonic() + self.timeout
+        METRICS.sent.inc()
+        return True
+
+    def _expire(self, now, on_result):
+        """time out the probes whose deadline (time.monotonic) is past now"""
+        while self.inflight:
+            key, response = next(iter(self.inflight.items()))
+            if self.deadlines[key] > now:
+                break
+            del self.inflight[key]
+            del self.sent_ns[key]
+            del self.deadlines[key]
+            METRICS.timeouts.inc()
+            response["err"] = f"Request timed out. after: {self.timeout}s"
+            on_result(response["dst"], response)
+
+    def _drain(self, mySocket, on_result):
+        """read every packet currently queued on the socket"""
+        reader = self.reader
+        m = METRICS
+        started = time.perf_counter()
+        while True:
+            try:
+                n, addr, receiveTime, recv_ns = reader.recv()
+            except (BlockingIOError, InterruptedError):
+                m.parse_time.observe(time.perf_counter() - started)
+                return
+            m.received.inc()
+
+            fields = decode_reply(reader.view, n)
+            if fields is None:
+                m.short.inc()
+                continue
+            icmp_type, icmp_code, probe_id, probe_seq, ttl_reply, icmp_off, _ = fields
+            if icmp_type not in (0, 3, 11):
+                m.foreign.inc()
+                continue # e.g. our own echo requests on loopback
+
+            response = self.inflight.get((probe_id, probe_seq))
+            if response is None:
+                m.dropped(probe_id == self.ID, icmp_type).inc()
+                continue # someone else's packet, or a reply that already timed out
+            src_ip = addr[0]
+            if icmp_type == 0 and src_ip != response["dst_ip"]:
+                m.foreign.inc()
+                continue
+            if not reader.verify(n, icmp_off):
+                m.checksum.inc()
+                continue # ignore invalid checksum packets
+            m.replies.inc()
+
+            del self.inflight[(probe_id, probe_seq)]
+            send_ns = self.sent_ns.pop((probe_id, probe_seq))
+            del self.deadlines[(probe_id, probe_seq)]
+            response["icmp_type"] = icmp_type
+            response["icmp_code"] = icmp_code
+            if icmp_type == 0:
+                response["ts_recv"] = receiveTime
+                response["ttl_reply"] = ttl_reply
+                response["size"] = n
+                response["rtt"] = (recv_ns - send_ns) / 1e6
+            elif icmp_type == 3:
+                response["err"] = f"Destination unreachable (code={icmp_code}) from {src_ip}"
+            else:
+                response["err"] = f"Time exceeded from {src_ip}"
+            on_result(response["dst"], response)
@@ -1,38 +1,102 @@
 #!/usr/bin/env python3
 import argparse
-import json
 import time
 import os
 
-from ping import ping
-from jsonhelper import jwrite
+import metrics
+from ping import PingSession
+from jsonhelper import JsonlWriter, OnlineStats, install_signal_flush, format_percentiles
+from binlog import BinlogWriter
+from multiping import MultiPinger, read_targets
+from scheduler import ProbeScheduler
+from shard import run_sharded
+
+LOG_WRITE_TIME = metrics.histogram("log_write_seconds", "Time handing one record to the log writers", tool="ping")
 
 # json logging
+# example JSONL record from requirements:
+# {"tool":"ping","ts_send":..., "ts_recv":..., "dst":"example.com","dst_ip":"93.184.216.34",
+#  "seq":12,"ttl_reply":55,"rtt_ms":23.4,"icmp_type":0,"icmp_code":0,"err":null}
 class JsonlLogger:
-    def __init__(self, file_name=None):
+    def __init__(self, file_name=None, flush_interval=1.0, background=False, rotate_bytes=0, rotate_interval=0,
+                 binlog=None, binlog_flush_interval=60.0):
         self.file_name = file_name
+        self.writers = []
         if file_name is not None:
             self.path = os.path.join(os.getcwd(), file_name)
+            # one open file + buffered writes instead of an open/append per probe
+            self.writers.append(JsonlWriter(self.path, default_fields={"tool": "ping"},
+                                            flush_interval=flush_interval, background=background,
+                                            rotate_bytes=rotate_bytes, rotate_interval=rotate_interval))
+        if binlog is not None:
+            # compact columnar copy of the same records
+            self.writers.append(BinlogWriter(os.path.join(os.getcwd(), binlog),
+                                             default_fields={"tool": "ping"},
+                                             flush_interval=binlog_flush_interval))
 
     def jsonl_write(self, obj):
-        if self.file_name is None:
-            return
-        # ensure standard fields: tool and dst (if present in runtime use obj value)
-        default = {"tool": "ping"}
-        # if caller provided 'dst' in obj it will be kept, else nothing forced
-        jwrite(self.path, obj, default_fields=default)
+        started = time.perf_counter()
+        for writer in self.writers:
+            writer.write(obj)
+        LOG_WRITE_TIME.observe(time.perf_counter() - started)
+
+    def close(self):
+        for writer in self.writers:
+            writer.close()
+
+def make_logger(args):
+    install_signal_flush()
+    return JsonlLogger(file_name=args.json, flush_interval=args.flush_interval,
+                       background=args.flush_thread, rotate_bytes=args.rotate_bytes,
+                       rotate_interval=args.rotate_interval, binlog=args.binlog,
+                       binlog_flush_interval=args.binlog_flush_interval)
 
 def main():
     parser = argparse.ArgumentParser(description="ICMP Ping")
-    parser.add_argument("target", help="Hostname or IP to ping")
+    parser.add_argument("target", nargs="?", help="Hostname or IP to ping")
+    parser.add_argument("--targets", type=str,
+                        help="File with one target per line ('-' for stdin), pinged together over one socket")
     parser.add_argument("--count", type=int, default=1, help="Number of probes to send")
     parser.add_argument("--interval", type=float, default=1.0, help="Interval between probes (s)")
     parser.add_argument("--timeout", type=float, default=1.0, help="Per-probe timeout (s)")
     parser.add_argument("--json", type=str, help="Write per-probe results to JSONL file")
+    parser.add_argument("--binlog", type=str,
+                        help="Also write per-probe results to a binary columnar log (see binlog.py)")
+    parser.add_argument("--binlog-flush-interval", type=float, default=60.0,
+                        help="Seal a --binlog block at least this often (s); each block has fixed overhead, so keep it long")
+    parser.add_argument("--flush-interval", type=float, default=1.0,
+                        help="Flush buffered JSONL records at least this often (s)")
+    parser.add_argument("--flush-thread", action="store_true",
+                        help="Flush JSONL from a background thread so probing never waits on disk")
+    parser.add_argument("--rotate-bytes", type=int, default=0,
+                        help="Rotate the JSONL file once it reaches this size (0 = never)")
+    parser.add_argument("--rotate-interval", type=float, default=0,
+                        help="Rotate the JSONL file after this many seconds (0 = never)")
     parser.add_argument("--qps-limit", type=float, default=1.0,
                         help="Max probe rate (queries per second)")
     parser.add_argument("--i-accept-the-risk", action="store_true", help="Allows QPS > 1")
+    parser.add_argument("--kernel-ts", action="store_true",
+                        help="Time replies with kernel receive timestamps (SO_TIMESTAMPNS) instead of when Python reads them")
+    parser.add_argument("--bpf", action="store_true",
+                        help="Attach a kernel BPF filter so only replies to our own probes (by ICMP id) reach this process")
+    parser.add_argument("--resolve-interval", type=float, default=0.0,
+                        help="Re-resolve the target every N seconds (0 = resolve once)")
+    parser.add_argument("--max-inflight", type=int, default=4096,
+                        help="Max outstanding probes with --targets")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Split --targets across this many processes, each with its own socket and ICMP id")
+    metrics.add_arguments(parser)
     args = parser.parse_args()
+    metrics.start(args)
+
+    if args.targets and args.workers > 1:
+        do_sharded_pinging(args)
+        return
+    if args.targets:
+        do_multi_pinging(args)
+        return
+    if args.target is None:
+        parser.error("a target or --targets is required")
 
     print(f"Pinging {args.target} with count={args.count}, interval={args.interval}s")
     do_pinging(args)
@@ -42,27 +106,85 @@ def do_pinging(args):
         print("WARNING: QPS limit > 1, requires --i-accept-the-risk")
         return
 
-    logger = JsonlLogger(file_name=args.json)
-    results = []
+    logger = make_logger(args)
+    # running [sent, OnlineStats] instead of keeping every result
+    tally = [0, OnlineStats()]
+
+    # absolute deadlines: a slow reply or a timeout doesn't push the following probes back
+    sched = ProbeScheduler(interval=args.interval, rate=args.qps_limit)
+
+    # resolve once and keep one socket open for the whole run
+    with PingSession(args.target, resolve_interval=args.resolve_interval,
+                     kernel_ts=args.kernel_ts, bpf=args.bpf) as session:
+        for i in range(args.count):
+            due = sched.wait()
+            late = sched.sent(due)
+            ping_result = session.ping(args.timeout, i)
+            ping_result["sched_late"] = late
+            print_ping_result(ping_result)
+            tally_result(tally, ping_result)
+            logger.jsonl_write(ping_result)
+    logger.close()
+
+    # Compute and print summary metrics
+    print_stats(args.target, *tally)
+    print(sched.report())
+
+def do_multi_pinging(args):
+    if args.qps_limit > 1 and not args.i_accept_the_risk:
+        print("WARNING: QPS limit > 1, requires --i-accept-the-risk")
+        return
+
+    targets = read_targets(args.targets)
+    if not targets:
+        print("No targets given.")
+        return
+    print(f"Pinging {len(targets)} targets with count={args.count}, interval={args.interval}s, qps={args.qps_limit}")
+
+    logger = make_logger(args)
+    tallies = {target: [0, OnlineStats()] for target in targets}
 
-    for i in range(args.count):
-        last_ping_ts = time.time()
-        ping_result = ping(args.target, args.timeout, i)
+    def on_result(target, ping_result):
         print_ping_result(ping_result)
-        results.append(ping_result)
+        tally_result(tallies[target], ping_result)
         logger.jsonl_write(ping_result)
-        time.sleep(args.interval)
 
-        # enforce QPS limit
-        time_since_last_ping = time.time() - last_ping_ts
-        if args.qps_limit > 0:
-            min_period = 1.0 / args.qps_limit
-            if time_since_last_ping < min_period:
-                time.sleep(min_period - time_since_last_ping)
+    # qps_limit is a global cap here, across every target
+    pinger = MultiPinger(targets, count=args.count, interval=args.interval, timeout=args.timeout,
+                         qps_limit=args.qps_limit, max_inflight=args.max_inflight, kernel_ts=args.kernel_ts, bpf=args.bpf)
+    pinger.run(on_result)
+    logger.close()
 
+    for target in targets:
+        print_stats(target, *tallies[target])
+    print(pinger.sched.report())
 
-    # Compute and print summary metrics
-    print_summary(args.target, results)
+def do_sharded_pinging(args):
+    if args.qps_limit > 1 and not args.i_accept_the_risk:
+        print("WARNING: QPS limit > 1, requires --i-accept-the-risk")
+        return
+
+    targets = read_targets(args.targets)
+    if not targets:
+        print("No targets given.")
+        return
+    print(f"Pinging {len(targets)} targets from {args.workers} workers with count={args.count}, "
+          f"interval={args.interval}s, qps={args.qps_limit}")
+
+    # records aren't printed per probe here: the workers hand them straight to the log
+    logger = make_logger(args)
+    opts = {"count": args.count, "interval": args.interval, "timeout": args.timeout, "qps_limit": args.qps_limit,
+            "max_inflight": args.max_inflight, "kernel_ts": args.kernel_ts, "bpf": args.bpf}
+    try:
+        tallies, reports = run_sharded("ping", targets, args.workers, opts, logger)
+    finally:
+        logger.close()
+
+    for target in targets:
+        if target in tallies:
+            print_stats(target, *tallies[target])
+    for report in reports:
+        print(report)
 
 def print_ping_result(result):
     """Print a single ping result to stdout."""
@@ -76,23 +198,24 @@ def print_ping_result(result):
     else:
         print(f"Reply from {result['dst_ip']}: bytes={result['size']} time={result['rtt']:.3f}ms TTL={result['ttl_reply']}")
 
-def print_summary(target, results):
-    """Print end-of-run summary like standard ping: min/avg/max/stddev RTT and loss %."""
-    total = len(results)
+def tally_result(tally, result):
+    """count one probe into a [sent, OnlineStats] tally; only successful probes add an RTT"""
+    tally[0] += 1
+    rtt = result.get("rtt")
+    if rtt is not None and result.get("err") is None:
+        tally[1].add(rtt)
+
+def print_stats(target, total, stats):
+    """
+    Print end-of-run summary like standard ping: min/avg/max/stddev RTT and loss %,
+    from a running tally (sent count + OnlineStats of successful RTTs)
+    """
     if total == 0:
         print("No packets sent.")
         return
 
-    # Extract successful RTTs (where rtt exists and is not None, and no error)
-    rtts = []
-    for r in results:
-        rtt = r.get("rtt")
-        err = r.get("err")
-        if rtt is not None and err is None:
-            rtts.append(rtt)
-
     # Calculate Loss %
-    received = len(rtts)
+    received = stats.n
     lost = total - received
     loss_pct = (lost / total) * 100
 
@@ -100,35 +223,9 @@ def print_summary(target, results):
     print(f"{total} packets transmitted, {received} received, {loss_pct:.1f}% packet loss")
 
     if received > 0:
-        min_rtt = min(rtts)
-        max_rtt = max(rtts)
-        avg_rtt = sum(rtts) / received
-
-        # Calculate stddev
-        if received > 1:
-            variance = sum((x - avg_rtt) ** 2 for x in rtts) / (received - 1)
-            stddev_rtt = variance ** 0.5
-        else:
-            stddev_rtt = 0.0
-
-        print(f"RTT min: {min_rtt:.3f}ms avg: {avg_rtt:.3f}ms max:{max_rtt:.3f}ms stddev:{stddev_rtt:.3f}ms")
-
-# example JSONL record from requirements:
-# {"tool":"ping","ts_send":..., "ts_recv":..., "dst":"example.com","dst_ip":"93.184.216.34",
-#  "seq":12,"ttl_reply":55,"rtt_ms":23.4,"icmp_type":0,"icmp_code":0,"err":null}
-class JsonlLogger:
-    def __init__(self, file_name=None):
-        self.file_name = file_name
-        if file_name is not None:
-            self.path = os.path.join(os.getcwd(), file_name)
-
-    def jsonl_write(self, obj):
-        if self.file_name is None:
-            return
-
-        obj.setdefault("ts", time.time())
-        with open(self.path, "a") as f:
-            f.write(json.dumps(obj) + "\n")
+        s = stats.summary()
+        print(f"RTT min: {s['min']:.3f}ms avg: {s['avg']:.3f}ms max:{s['max']:.3f}ms stddev:{s['stddev']:.3f}ms")
+        print(f"RTT {format_percentiles(s, sep=' ', eq=': ', unit='ms')}")
 
 if __name__ == "__main__":
     main()
@@ -1,41 +1,131 @@
 #!/usr/bin/env python3
 import argparse
-import json
 import time
 import os
 
+import metrics
 import traceroute as tr
-from jsonhelper import jwrite
+import rdns
+from rto import RtoTable
+from jsonhelper import JsonlWriter, install_signal_flush
+from binlog import BinlogWriter
+from multiping import read_targets
+from shard import run_sharded
+
+LOG_WRITE_TIME = metrics.histogram("log_write_seconds", "Time handing one record to the log writers", tool="trace")
 
 # json logging
 class JsonlLogger:
-    def __init__(self, file_name=None):
+    def __init__(self, file_name=None, flush_interval=1.0, background=False, rotate_bytes=0, rotate_interval=0,
+                 binlog=None, binlog_flush_interval=60.0):
         self.file_name = file_name
+        self.writers = []
         if file_name is not None:
             self.path = os.path.join(os.getcwd(), file_name)
+            # one open file + buffered writes instead of an open/append per probe
+            self.writers.append(JsonlWriter(self.path, default_fields={"tool": "trace"},
+                                            flush_interval=flush_interval, background=background,
+                                            rotate_bytes=rotate_bytes, rotate_interval=rotate_interval))
+        if binlog is not None:
+            # compact columnar copy of the same records
+            self.writers.append(BinlogWriter(os.path.join(os.getcwd(), binlog),
+                                             default_fields={"tool": "trace"},
+                                             flush_interval=binlog_flush_interval))
 
     def jsonl_write(self, obj):
-        if self.file_name is None:
-            return
-        # ensure "tool" field and write via helper
-        jwrite(self.path, obj, default_fields={"tool": "trace"})
+        started = time.perf_counter()
+        for writer in self.writers:
+            writer.write(obj)
+        LOG_WRITE_TIME.observe(time.perf_counter() - started)
+
+    def close(self):
+        for writer in self.writers:
+            writer.close()
+
+def make_logger(args):
+    install_signal_flush()
+    return JsonlLogger(file_name=args.json, flush_interval=args.flush_interval,
+                       background=args.flush_thread, rotate_bytes=args.rotate_bytes,
+                       rotate_interval=args.rotate_interval, binlog=args.binlog,
+                       binlog_flush_interval=args.binlog_flush_interval)
 
 def main():
     parser = argparse.ArgumentParser(description="ICMP Traceroute")
-    parser.add_argument("target", help="Hostname or IP to trace")
+    parser.add_argument("target", nargs="?", help="Hostname or IP to trace")
+    parser.add_argument("--targets", type=str,
+                        help="File with one target per line ('-' for stdin), traced by --workers processes")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Processes tracing --targets, each with its own sockets and ICMP id")
+    parser.add_argument("--doubletree", action="store_true",
+                        help="With --targets: start each trace mid-path and skip hops earlier traces already found")
+    parser.add_argument("--start-ttl", type=int, default=0,
+                        help="First TTL probed with --doubletree (0 = from the path lengths seen so far)")
+    parser.add_argument("--prefix-len", type=int, default=24,
+                        help="Destinations in the same prefix of this length share hops with --doubletree")
     parser.add_argument("--max-ttl", type=int, default=30, help="Maximum TTL (hops)")
     parser.add_argument("--probes", type=int, default=3, help="Probes per hop")
     parser.add_argument("--timeout", type=float, default=2.0, help="Per-probe timeout (s)")
     parser.add_argument("-n", action="store_true", help="Do not resolve hostnames (show IP only)")
     parser.add_argument("--rdns", action="store_true", help="Enable reverse DNS (200 ms budget per hop)")
+    parser.add_argument("--rdns-workers", type=int, default=8,
+                        help="Reverse DNS lookups run in parallel with --rdns")
+    parser.add_argument("--rdns-cache", type=str,
+                        help="Load reverse DNS results from this file and save them back on exit")
     parser.add_argument("--flow-id", type=int, default=0,
                         help="Flow ID to keep probes consistent (Paris-style)")
     parser.add_argument("--json", type=str, help="Write per-probe results to JSONL file")
+    parser.add_argument("--binlog", type=str,
+                        help="Also write per-probe results to a binary columnar log (see binlog.py)")
+    parser.add_argument("--binlog-flush-interval", type=float, default=60.0,
+                        help="Seal a --binlog block at least this often (s); each block has fixed overhead, so keep it long")
+    parser.add_argument("--flush-interval", type=float, default=1.0,
+                        help="Flush buffered JSONL records at least this often (s)")
+    parser.add_argument("--flush-thread", action="store_true",
+                        help="Flush JSONL from a background thread so probing never waits on disk")
+    parser.add_argument("--rotate-bytes", type=int, default=0,
+                        help="Rotate the JSONL file once it reaches this size (0 = never)")
+    parser.add_argument("--rotate-interval", type=float, default=0,
+                        help="Rotate the JSONL file after this many seconds (0 = never)")
     parser.add_argument("--qps-limit", type=float, default=1.0,
                         help="Max probe rate (queries per second)")
     parser.add_argument("--i-accept-the-risk", action="store_true", help="Allows QPS > 1")
+    parser.add_argument("--adaptive", action="store_true",
+                        help="Wait per probe only for an RTO estimated from earlier replies (per hop), --timeout being the cap; "
+                             "replies after the RTO are still matched")
+    parser.add_argument("--min-rto", type=float, default=0.1,
+                        help="Lower bound on the adaptive per-probe wait (s)")
+    parser.add_argument("--gap-limit", type=int, default=0,
+                        help="Stop after this many consecutive silent hops (0 = never)")
+    parser.add_argument("--kernel-ts", action="store_true",
+                        help="Time replies with kernel receive timestamps (SO_TIMESTAMPNS) instead of when Python reads them")
+    parser.add_argument("--bpf", action="store_true",
+                        help="Attach a kernel BPF filter so only replies to our own probes (by ICMP id) reach this process")
+    parser.add_argument("--parallel", action="store_true",
+                        help="Probe a window of TTLs at once instead of one hop at a time")
+    parser.add_argument("--window", type=int, default=0,
+                        help="TTLs in flight together with --parallel (0 = all up to --max-ttl)")
+    parser.add_argument("--watch", action="store_true",
+                        help="Keep probing every hop and redraw a live per-hop table (mtr-style) until Ctrl-C")
+    parser.add_argument("--interval", type=float, default=1.0,
+                        help="Seconds between rounds with --watch")
+    parser.add_argument("--history", type=int, default=100,
+                        help="Samples kept per hop for the recent loss/avg columns with --watch")
+    parser.add_argument("--cycles", type=int, default=0,
+                        help="Stop --watch after this many rounds (0 = run until interrupted)")
+    metrics.add_arguments(parser)
     args = parser.parse_args()
+    # these only apply to one of the two modes; silently ignoring them would mislead
+    if args.doubletree and not args.targets:
+        parser.error("--doubletree needs --targets")
+    if args.watch and args.targets:
+        parser.error("--watch traces a single target, not --targets")
+    metrics.start(args)
 
+    if args.targets:
+        do_sharded_traceroute(args)
+        return
+    if args.target is None:
+        parser.error("a target or --targets is required")
     do_traceroute(args)
 
 def do_traceroute(args):
@@ -43,25 +133,66 @@ def do_traceroute(args):
         print("WARNING: QPS limit > 1, requires --i-accept-the-risk")
         return
 
-    logger = JsonlLogger(file_name=args.json)
-    # pass no-resolve/rdns through to traceroute
-    tr.get_route(args.target, args.max_ttl, args.timeout, args.probes,
-                 args.qps_limit, args.flow_id, logger,
-                 no_resolve=args.n, rdns=args.rdns)
+    if args.rdns and not args.n:
+        rdns.configure(workers=args.rdns_workers, cache_path=args.rdns_cache)
+    rto = RtoTable(args.timeout, args.min_rto) if args.adaptive else None
+    logger = make_logger(args)
+    try:
+        if args.watch:
+            tr.watch_route(args.target, args.max_ttl, args.timeout, args.qps_limit, args.flow_id, logger,
+                           no_resolve=args.n, rdns=args.rdns, history=args.history,
+                           interval=args.interval, cycles=args.cycles, kernel_ts=args.kernel_ts, bpf=args.bpf,
+                           rto=rto)
+            return
+        if args.parallel:
+            tr.get_route_parallel(args.target, args.max_ttl, args.timeout, args.probes,
+                                  args.qps_limit, args.flow_id, logger,
+                                  no_resolve=args.n, rdns=args.rdns, window=args.window,
+                                  kernel_ts=args.kernel_ts, bpf=args.bpf, rto=rto, gap_limit=args.gap_limit)
+            return
+        # pass no-resolve/rdns through to traceroute
+        tr.get_route(args.target, args.max_ttl, args.timeout, args.probes,
+                     args.qps_limit, args.flow_id, logger,
+                     no_resolve=args.n, rdns=args.rdns, kernel_ts=args.kernel_ts, bpf=args.bpf,
+                     rto=rto, gap_limit=args.gap_limit)
+    finally:
+        logger.close()
 
-class JsonlLogger:
-    def __init__(self, file_name=None):
-        self.file_name = file_name
-        if file_name is not None:
-            self.path = os.path.join(os.getcwd(), file_name)
+def do_sharded_traceroute(args):
+    if args.qps_limit > 1 and not args.i_accept_the_risk:
+        print("WARNING: QPS limit > 1, requires --i-accept-the-risk")
+        return
 
-    def jsonl_write(self, obj):
-        if self.file_name is None:
-            return
+    targets = read_targets(args.targets)
+    if not targets:
+        print("No targets given.")
+        return
+    print(f"Tracing {len(targets)} targets from {args.workers} workers with max-ttl={args.max_ttl}, "
+          f"probes={args.probes}, timeout={args.timeout}s, qps={args.qps_limit}")
+
+    # each worker traces with its own ICMP id as flow_id: --flow-id (if given) is the first one
+    opts = {"max_ttl": args.max_ttl, "probes": args.probes, "timeout": args.timeout, "qps_limit": args.qps_limit,
+            "parallel": args.parallel, "window": args.window, "adaptive": args.adaptive, "min_rto": args.min_rto,
+            "gap_limit": args.gap_limit, "kernel_ts": args.kernel_ts, "bpf": args.bpf,
+            "rdns": args.rdns and not args.n, "rdns_workers": args.rdns_workers, "rdns_cache": args.rdns_cache,
+            "doubletree": args.doubletree, "start_ttl": args.start_ttl, "prefix_len": args.prefix_len}
+    logger = make_logger(args)
+    try:
+        summaries, reports = run_sharded("trace", targets, args.workers, opts, logger, first_id=args.flow_id or None)
+    finally:
+        logger.close()
 
-        obj.setdefault("ts", time.time())
-        with open(self.path, "a") as f:
-            f.write(json.dumps(obj) + "\n")
+    for target in targets:
+        if target not in summaries:
+            continue
+        dest_ip, hops = summaries[target]
+        if dest_ip is None:
+            print(f"\n--- {target}: {hops} ---")
+            continue
+        print(f"\n--- {target} ({dest_ip}) traceroute ---", end="")
+        tr.print_hop_stats(hops)
+    for report in reports:
+        print(report)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+import argparse
+import contextlib
+import errno
+import heapq
+import io
+import random
+import socket
+import struct
+import threading
+import time
+
+import ping
+from ping import checksum
+
+# Simulated network for running the probe engines without root or a network:
+# SimNetwork.install() makes ping.icmp_socket() hand out SimSockets, and every Echo Request
+# sent on one is answered in-process (Time Exceeded from a router for a TTL that runs out
+# on the path, Echo Reply from the destination otherwise) after that hop's latency, with
+# optional loss, reordering and checksum corruption.
+#
+# A SimSocket reads from one end of an AF_UNIX datagram socketpair, so select(),
+# loop.add_reader() and socket timeouts work on it exactly as on a raw socket. Like raw
+# ICMP sockets, every open SimSocket gets a copy of every reply.
+
+_IP_HEAD = struct.Struct("!BBHHHBBH4s4s")
+
+def ip_header(src, dst, ttl, payload_len):
+    # the engines never check the IP checksum, so it is left 0
+    return _IP_HEAD.pack(0x45, 0, 20 + payload_len, 0, 0, ttl, 1, 0,
+                         socket.inet_aton(src), socket.inet_aton(dst))
+
+def icmp_message(icmp_type, code, rest, body):
+    """ICMP message with a correct checksum; rest is the 4 bytes after it (id/seq or unused)"""
+    head = struct.pack("!BBH", icmp_type, code, 0) + rest
+    csum = checksum(head + body)
+    return head[:2] + struct.pack("!H", csum) + head[4:] + body
+
+class SimSocket:
+    """socket-like raw ICMP socket attached to a SimNetwork"""
+    def __init__(self, net):
+        self.net = net
+        self._rx, self._tx = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+        # a full receive queue drops replies, as the kernel does
+        self._tx.setblocking(False)
+        self.ttl = 64
+        net._attach(self)
+
+    def fileno(self):
+        return self._rx.fileno()
+
+    def setblocking(self, flag):
+        self._rx.setblocking(flag)
+
+    def settimeout(self, timeout):
+        self._rx.settimeout(timeout)
+
+    def setsockopt(self, level, option, value):
+        if level == socket.SOL_IP and option == socket.IP_TTL:
+            self.ttl = value
+        elif level == socket.SOL_SOCKET and option == socket.SO_RCVBUF:
+            self._rx.setsockopt(level, option, value)
+            self._tx.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, value)
+        else:
+            # kernel timestamps, BPF filters, ...: callers fall back as on an old kernel
+            raise OSError(errno.ENOPROTOOPT, "not supported on a simulated socket")
+
+    def sendto(self, data, addr):
+        self.net.send(bytes(data), addr[0], self.ttl)
+        return len(data)
+
+    def recvfrom_into(self, buf, nbytes=0):
+        n = self._rx.recv_into(buf, nbytes)
+        # the source address is the one in the (simulated) IP header
+        return n, (socket.inet_ntoa(bytes(buf[12:16])), 0)
+
+    def recvfrom(self, bufsize, flags=0):
+        data = self._rx.recv(bufsize, flags)
+        return data, (socket.inet_ntoa(data[12:16]), 0)
+
+    def recv(self, bufsize, flags=0):
+        return self._rx.recv(bufsize, flags)
+
+    def _deliver(self, packet):
+        try:
+            self._tx.send(packet)
+            return True
+        except OSError:
+            return False
+
+    def close(self):
+        if self._rx is None:
+            return
+        self.net._detach(self)
+        self._rx.close()
+        self._tx.close()
+        self._rx = self._tx = None
+
+class SimNetwork:
+    """
+    Every destination sits behind the same path of hops routers.
+        hops: routers before the destination; router k answers at TTL k from router_ip(k)
+        latency: one-way-and-back ms added per hop (float, or a list with one value per hop
+                 and a last one for the destination); a reply from TTL k takes their sum up to k
+        jitter: extra uniform 0..jitter ms per reply
+        loss: chance a reply is lost (float, or {ttl: p} per hop, key 0 for the destination)
+        silent: TTLs whose router never answers
+        reorder: chance a reply is held back an extra reorder_ms, so later ones overtake it
+        corrupt: chance a reply has a byte flipped (bad checksum)
+        quote: ICMP bytes of the request quoted in Time Exceeded (None = all, 8 = RFC 792 minimum)
+        seed: for reproducible loss/jitter/reordering
+    """
+    def __init__(self, hops=8, latency=0.1, jitter=0.0, loss=0.0, silent=(), reorder=0.0, reorder_ms=1.0,
+                 corrupt=0.0, quote=None, seed=None, src_ip="10.0.0.1"):
+        self.hops = hops
+        latencies = latency if isinstance(latency, (list, tuple)) else [latency] * (hops + 1)
+        if len(latencies) != hops + 1:
+            raise ValueError(f"latency needs {hops + 1} values (one per hop + the destination)")
+        # cumulative ms to TTL k (index k-1), the last entry is the destination
+        self.rtt = [sum(latencies[:k + 1]) for k in range(hops + 1)]
+        self.jitter = jitter
+        self.loss = loss
+        self.silent = set(silent)
+        self.reorder = reorder
+        self.reorder_ms = reorder_ms
+        self.corrupt = corrupt
+        self.quote = quote
+        self.src_ip = src_ip
+        self.random = random.Random(seed)
+        self.sockets = []
+        self.stats = {"requests": 0, "replies": 0, "lost": 0, "silent": 0, "corrupted": 0, "reordered": 0,
+                      "dropped": 0}
+        # (deliver at, n, packet), delivered by a thread when latency > 0
+        self._queue = []
+        self._n = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self._thread = None
+        self._closed = False
+
+    @staticmethod
+    def router_ip(ttl):
+        return f"10.254.{ttl}.1"
+
+    def socket(self):
+        """a new SimSocket (the factory for ping.set_transport)"""
+        return SimSocket(self)
+
+    def install(self):
+        self._closed = False
+        ping.set_transport(self.socket)
+        return self
+
+    def uninstall(self):
+        ping.set_transport(None)
+        with self._lock:
+            self._closed = True
+            self._wake.notify()
+
+    def __enter__(self):
+        return self.install()
+
+    def __exit__(self, *exc):
+        self.uninstall()
+
+    def _attach(self, sock):
+        with self._lock:
+            self.sockets.append(sock)
+
+    def _detach(self, sock):
+        with self._lock:
+            self.sockets.remove(sock)
+
+    def _loss(self, ttl):
+        if isinstance(self.loss, dict):
+            return self.loss.get(ttl, 0.0)
+        return self.loss
+
+    def send(self, packet, dst, ttl):
+        """an Echo Request went out: work out the reply and when it arrives"""
+        if len(packet) < 8 or packet[0] != ping.ICMP_ECHO_REQUEST:
+            return
+        with self._lock:
+            self.stats["requests"] += 1
+        if ttl <= self.hops:
+            if ttl in self.silent:
+                self._count("silent")
+                return
+            hop, rtt = ttl, self.rtt[ttl - 1]
+            quoted = packet if self.quote is None else packet[:self.quote]
+            body = ip_header(self.src_ip, dst, 1, len(packet)) + quoted
+            reply = icmp_message(11, 0, b"\0\0\0\0", body)
+            src = self.router_ip(ttl)
+        else:
+            hop, rtt = 0, self.rtt[-1]
+            reply = icmp_message(0, 0, packet[4:8], packet[8:])
+            src = dst
+        rand = self.random.random
+        if rand() < self._loss(hop):
+            self._count("lost")
+            return
+        delay = rtt + (rand() * self.jitter if self.jitter else 0.0)
+        if self.reorder and rand() < self.reorder:
+            delay += self.reorder_ms
+            self._count("reordered")
+        if self.corrupt and rand() < self.corrupt:
+            reply = bytearray(reply)
+            reply[8 + int(rand() * (len(reply) - 8))] ^= 0xff
+            reply = bytes(reply)
+            self._count("corrupted")
+        # replies come back with the TTL they had left after the hops between
+        packet = ip_header(src, self.src_ip, 65 - (ttl if ttl <= self.hops else self.hops + 1), len(reply)) + reply
+        if delay <= 0:
+            self._deliver(packet)
+            return
+        with self._lock:
+            heapq.heappush(self._queue, (time.perf_counter() + delay / 1000.0, self._n, packet))
+            self._n += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="netsim", daemon=True)
+                self._thread.start()
+            self._wake.notify()
+
+    def _count(self, what):
+        with self._lock:
+            self.stats[what] += 1
+
+    def _deliver(self, packet):
+        with self._lock:
+            sockets = list(self.sockets)
+            self.stats["replies"] += 1
+        for sock in sockets:
+            if not sock._deliver(packet):
+                self._count("dropped")
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._closed and (not self._queue or self._queue[0][0] > time.perf_counter()):
+                    self._wake.wait(self._queue[0][0] - time.perf_counter() if self._queue else None)
+                if self._closed:
+                    self._thread = None
+                    return
+                _, _, packet = heapq.heappop(self._queue)
+            self._deliver(packet)
+
+# Load test: run an engine against the simulation at increasing rates and report what it
+# actually achieved, to see where it saturates
+
+def _run_engine(engine, targets, count, rate, timeout):
+    """run engine quietly; returns (probes sent, replies, seconds)"""
+    import multiping
+    import traceroute
+    from ping import PingSession
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        if engine == "ping":
+            sent = received = 0
+            with PingSession(targets[0]) as session:
+                pace = 1.0 / rate if rate > 0 else 0.0
+                for i in range(count):
+                    due = started + i * pace
+                    delay = due - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                    result = session.ping(timeout, i)
+                    sent += 1
+                    received += result.get("err") is None
+        elif engine == "multiping":
+            results = []
+            pinger = multiping.MultiPinger(targets, count=max(1, count // len(targets)), interval=0.0, timeout=timeout,
+                                           qps_limit=rate)
+            pinger.run(lambda target, r: results.append(r))
+            sent = len(results)
+            received = sum(1 for r in results if r.get("err") is None)
+        else:
+            # parallel traces, one target after another, until count probes went out
+            sent = received = 0
+            sched = traceroute.ProbeScheduler(rate=rate, clock=time.time)
+            sink = traceroute.RecordSink(None, echo=False)
+            while sent < count:
+                for target in targets:
+                    records = traceroute.trace_windows(target, target, 30, timeout, 1, rate, 0, sink, sched, 30)
+                    sent += len(records)
+                    received += sum(1 for r in records if r.get("err") is None)
+    return sent, received, time.perf_counter() - started
+
+def main():
+    parser = argparse.ArgumentParser(description="Drive a probe engine against a simulated network")
+    parser.add_argument("--engine", choices=["ping", "multiping", "trace"], default="multiping")
+    parser.add_argument("--targets", type=int, default=16, help="Number of simulated destinations")
+    parser.add_argument("--count", type=int, default=2000, help="Probes per run (about, for trace)")
+    parser.add_argument("--timeout", type=float, default=0.2, help="Per-probe timeout (s)")
+    parser.add_argument("--rates", type=str, default="1000,5000,20000,0",
+                        help="Comma-separated probe rates to try (0 = unlimited)")
+    parser.add_argument("--hops", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.1, help="ms per hop")
+    parser.add_argument("--jitter", type=float, default=0.0, help="ms")
+    parser.add_argument("--loss", type=float, default=0.0)
+    parser.add_argument("--reorder", type=float, default=0.0)
+    parser.add_argument("--corrupt", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    targets = [f"192.0.2.{i % 250 + 1}" for i in range(args.targets)]
+    print(f"{'rate':>10} {'sent':>8} {'answered':>9} {'achieved/s':>11} {'loss%':>7} {'dropped':>8}")
+    for rate in (float(r) for r in args.rates.split(",")):
+        net = SimNetwork(hops=args.hops, latency=args.latency, jitter=args.jitter, loss=args.loss,
+                         reorder=args.reorder, corrupt=args.corrupt, seed=args.seed)
+        with net:
+            sent, received, elapsed = _run_engine(args.engine, targets, args.count, rate, args.timeout)
+        loss = (sent - received) / sent * 100.0 if sent else 0.0
+        label = f"{rate:.0f}" if rate > 0 else "unlimited"
+        print(f"{label:>10} {sent:8d} {received:9d} {sent / elapsed:11.0f} {loss:7.2f} {net.stats['dropped']:8d}")
+
+if __name__ == "__main__":
+    main()
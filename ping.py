@@ -1,3 +1,4 @@
+import ctypes
 import socket
 import os
 import sys
@@ -5,193 +6,456 @@ import struct
 import time
 import select
 
-ICMP_ECHO_REQUEST = 8
-
+from metrics import ProbeMetrics
 
-def checksum(string):
-    csum = 0
-    countTo = (len(string) // 2) * 2
-    count = 0
+ICMP_ECHO_REQUEST = 8
 
-    while count < countTo:
-        thisVal = ord(string[count+1]) * 256 + ord(string[count])
-        csum = csum + thisVal
-        csum = csum & 0xffffffff
-        count = count + 2
+# counters/timings for PingSession and receive_one_ping
+METRICS = ProbeMetrics("ping")
 
-    if countTo < len(string):
-        csum = csum + ord(string[len(string) - 1])
-        csum = csum & 0xffffffff
 
-    csum = (csum >> 16) + (csum & 0xffff)
-    csum = csum + (csum >> 16)
-    answer = ~csum
-    answer = answer & 0xffff
-    answer = answer >> 8 | (answer << 8 & 0xff00)
+def _fold(csum):
+    # end-around carry: fold a sum of any width down to 16 bits
+    while csum >> 16:
+        csum = (csum & 0xffff) + (csum >> 16)
+    return csum
 
-    return answer
+def checksum(data):
+    """
+    Internet checksum (RFC 1071) of bytes, bytearray or memoryview (str is taken as latin-1).
+    Reads the whole buffer as one big-endian integer: since 2^16 == 1 (mod 0xffff), the
+    ones-complement sum of its 16-bit words is that integer mod 0xffff, computed in C
+    instead of a Python loop. The result is the value to pack with "!H".
+    """
+    if isinstance(data, str):
+        data = data.encode('latin-1')
+    csum = int.from_bytes(data, 'big')
+    if len(data) & 1:
+        # odd trailing byte is the high-order byte of a zero-padded word
+        csum <<= 8
+    folded = csum % 0xffff
+    if folded == 0 and csum:
+        # ones-complement sum of non-zero data is 0xffff, not 0
+        folded = 0xffff
+    return ~folded & 0xffff
+
+def checksum_update(cksum, old, new):
+    """
+    RFC 1624 incremental update: HC' = ~(~HC + ~m + m').
+        cksum: current checksum (network order, as unpacked with "!H")
+        old/new: the bytes being replaced, equal length and starting on an even offset
+    """
+    old_sum = ~checksum(old) & 0xffff
+    new_sum = ~checksum(new) & 0xffff
+    return ~_fold((~cksum & 0xffff) + (~old_sum & 0xffff) + new_sum) & 0xffff
 
 def calculate_icmp_checksum(packet):
     """
     Calculate the checksum for an ICMP packet.
         packet: ICMP header bytes with checksum field set to 0 + payload
     """
-    # checksum() expects str, keep existing decode to avoid larger refactor
-    myChecksum = checksum(packet.decode('latin-1'))
     # return raw 16-bit checksum (do not htons here), struct with "!" will emit network order
-    return myChecksum & 0xffff
+    return checksum(packet)
 
 def verify_icmp_checksum(packet):
     """
     Verify the checksum of a received ICMP packet.
         packet: The ICMP packet bytes (header + data)
     """
-    # Extract the received checksum (bytes 2-3 of ICMP header)
-    received_checksum = struct.unpack("!H", packet[2:4])[0]
-
-    # Zero out the checksum field for recalculation
-    packet_with_zero_checksum = packet[:2] + b'\x00\x00' + packet[4:]
+    # summing over the received checksum field too gives 0 for an intact packet,
+    # so there's no need to copy the packet to zero that field out
+    return checksum(packet) == 0
 
-    # Calculate what the checksum should be
-    calculated_checksum = calculate_icmp_checksum(packet_with_zero_checksum)
+# Echo Request header and the timestamp payload
+_ECHO_HEAD = struct.Struct("!BBHHH")
+_ECHO_TS = struct.Struct("d")
 
-    return received_checksum == calculated_checksum
+class EchoTemplate:
+    """
+    Precomputed Echo Request for one ICMP id.
+    Only seq and the timestamp change per probe, so build() patches those fields and
+    updates the checksum incrementally (RFC 1624) instead of summing the whole packet.
+        padding: extra zero payload bytes after the timestamp
+    """
+    def __init__(self, ID, padding=0):
+        self.ID = ID
+        self.packet = bytearray(_ECHO_HEAD.pack(ICMP_ECHO_REQUEST, 0, 0, ID, 0)
+                                + _ECHO_TS.pack(0.0) + bytes(padding))
+        # ones-complement sum of the template; seq and timestamp are all zero in it
+        self.base_sum = ~checksum(self.packet) & 0xffff
+
+    def build(self, seq_num, timestamp):
+        packet = self.packet
+        _ECHO_TS.pack_into(packet, 8, timestamp)
+        # zero old fields mean ~m drops out: HC' = ~(~HC + m')
+        csum = self.base_sum + seq_num + int.from_bytes(packet[8:16], 'big')
+        _ECHO_HEAD.pack_into(packet, 0, ICMP_ECHO_REQUEST, 0, ~_fold(csum) & 0xffff, self.ID, seq_num)
+        return bytes(packet)
+
+_TEMPLATES = {}
+
+def echo_template(ID):
+    """shared per-ID template for send_one_ping / traceroute.build_packet"""
+    template = _TEMPLATES.get(ID)
+    if template is None:
+        template = _TEMPLATES[ID] = EchoTemplate(ID)
+    return template
+
+# outer IPv4 header: version/IHL (1st B) and TTL (9th B)
+_IP_VER_TTL = struct.Struct("!B7xB")
+
+def decode_reply(buf, n=None):
+    """
+    Decode a received packet in place, with no slicing or copying.
+        buf: IP header + ICMP as read from a SOCK_RAW ICMP socket (bytes, bytearray or memoryview)
+        n:   number of valid bytes in buf (default all of it)
+    Returns (icmp_type, icmp_code, probe_id, probe_seq, ttl_reply, icmp_off, payload_ts) or
+    None if the packet is too short. For Echo Reply the id/seq/timestamp are the outer ones,
+    for Time Exceeded / Dest Unreachable they come from the quoted inner ICMP header and
+    payload (None if the router didn't quote that much).
+    """
+    n = len(buf) if n is None else n
+    if n < 20:
+        return None
+    ver_ihl, ttl_reply = _IP_VER_TTL.unpack_from(buf, 0)
+    icmp_off = (ver_ihl & 0x0F) * 4
+    if n < icmp_off + 8:
+        return None
+    icmp_type, icmp_code, _, icmp_id, icmp_seq = _ECHO_HEAD.unpack_from(buf, icmp_off)
+    payload_ts = None
+
+    if icmp_type in (11, 3):
+        # routers incl original IP head + 1st 8 Bs of original payload
+        icmp_id = icmp_seq = None
+        inner_off = icmp_off + 8
+        if n >= inner_off + 20:
+            inner_icmp_off = inner_off + (buf[inner_off] & 0x0F) * 4
+            if n >= inner_icmp_off + 8:
+                _, _, _, icmp_id, icmp_seq = _ECHO_HEAD.unpack_from(buf, inner_icmp_off)
+                # most routers quote more than the 8 Bs RFC 792 asks for
+                if n >= inner_icmp_off + 16:
+                    payload_ts = _ECHO_TS.unpack_from(buf, inner_icmp_off + 8)[0]
+    elif icmp_type == 0 and n >= icmp_off + 16:
+        payload_ts = _ECHO_TS.unpack_from(buf, icmp_off + 8)[0]
+
+    return icmp_type, icmp_code, icmp_id, icmp_seq, ttl_reply, icmp_off, payload_ts
+
+# Transport: every raw ICMP socket is opened through icmp_socket(), so another network
+# (e.g. netsim.SimNetwork, an in-process simulation) can be swapped in with set_transport()
+_transport = None
+
+def set_transport(factory):
+    """make icmp_socket() return factory(), a socket-like object; None = real raw sockets"""
+    global _transport
+    _transport = factory
+
+def icmp_socket():
+    """a new raw IPv4 ICMP socket from the installed transport"""
+    if _transport is not None:
+        return _transport()
+    # SOCK_RAW is a powerful socket type. For more details: http://sock- raw.org/papers/sock_raw
+    return socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.getprotobyname("icmp"))
+
+# Kernel receive timestamps: with SO_TIMESTAMPNS set, recvmsg() hands back the time the
+# packet reached the socket, so select wakeup / scheduler / GC delay stays out of the RTT
+SO_TIMESTAMPNS = getattr(socket, "SO_TIMESTAMPNS", 35)
+_TIMESPEC = struct.Struct("@ll")
+_CMSG_SPACE = socket.CMSG_SPACE(_TIMESPEC.size) if hasattr(socket, "CMSG_SPACE") else 0
+
+def enable_rx_timestamps(sock):
+    """ask the kernel to timestamp received packets, returns False where that's unsupported"""
+    if not _CMSG_SPACE:
+        return False
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPNS, 1)
+    except OSError:
+        return False
+    return True
+
+# Kernel-side filtering: a raw ICMP socket gets a copy of every ICMP packet the host
+# receives. A classic BPF program (SO_ATTACH_FILTER) drops everyone else's traffic before
+# it is queued, so user space only wakes up for replies to our own probes.
+SO_ATTACH_FILTER = getattr(socket, "SO_ATTACH_FILTER", 26)
+_SOCK_FILTER = struct.Struct("=HBBI")
+# BPF opcodes (linux/filter.h)
+_BPF_LDX_MSH_B = 0xb1   # X = 4 * (pkt[k] & 0xf)
+_BPF_LD_B_IND = 0x50    # A = pkt[X + k] (byte)
+_BPF_LD_H_IND = 0x48    # A = pkt[X + k] (half word)
+_BPF_JEQ_K = 0x15       # if A == k goto +jt else +jf
+_BPF_AND_K = 0x54
+_BPF_LSH_K = 0x64
+_BPF_ADD_X = 0x0c
+_BPF_TAX = 0x07
+_BPF_RET_K = 0x06
+
+def icmp_id_filter(ID):
+    """
+    BPF program (list of (code, jt, jf, k)) accepting, on a raw IPv4 ICMP socket, only
+    Echo Replies with identifier ID and Time Exceeded / Destination Unreachable messages
+    quoting an Echo Request with identifier ID.
+    """
+    return [
+        (_BPF_LDX_MSH_B, 0, 0, 0),          # 0: X = outer IP header length
+        (_BPF_LD_B_IND, 0, 0, 0),           # 1: A = ICMP type
+        (_BPF_JEQ_K, 2, 0, 0),              # 2: echo reply -> 5
+        (_BPF_JEQ_K, 3, 0, 11),             # 3: time exceeded -> 7
+        (_BPF_JEQ_K, 2, 12, 3),             # 4: unreachable -> 7, anything else -> drop
+        (_BPF_LD_H_IND, 0, 0, 4),           # 5: A = identifier
+        (_BPF_JEQ_K, 9, 10, ID),            # 6: ours -> accept, else drop
+        (_BPF_LD_B_IND, 0, 0, 8),           # 7: A = quoted IP version/IHL
+        (_BPF_AND_K, 0, 0, 0xf),            # 8
+        (_BPF_LSH_K, 0, 0, 2),              # 9: A = quoted IP header length
+        (_BPF_ADD_X, 0, 0, 0),              # 10
+        (_BPF_TAX, 0, 0, 0),                # 11: X = offset of the quoted ICMP header - 8
+        (_BPF_LD_B_IND, 0, 0, 8),           # 12: A = quoted ICMP type
+        (_BPF_JEQ_K, 0, 3, ICMP_ECHO_REQUEST),  # 13: not an echo request -> drop
+        (_BPF_LD_H_IND, 0, 0, 12),          # 14: A = quoted identifier
+        (_BPF_JEQ_K, 0, 1, ID),             # 15: ours -> accept, else drop
+        (_BPF_RET_K, 0, 0, 0xffff),         # 16: accept (whole packet)
+        (_BPF_RET_K, 0, 0, 0),              # 17: drop
+    ]
+
+def attach_id_filter(sock, ID):
+    """
+    Attach icmp_id_filter(ID) to sock and discard whatever was queued before it took
+    effect. Returns False where SO_ATTACH_FILTER is unsupported (nothing is filtered then,
+    matching in Python still does its job).
+    """
+    prog = icmp_id_filter(ID)
+    insns = ctypes.create_string_buffer(b"".join(_SOCK_FILTER.pack(*insn) for insn in prog))
+    # struct sock_fprog { unsigned short len; struct sock_filter *filter; }
+    fprog = struct.pack("@HP", len(prog), ctypes.addressof(insns))
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, fprog)
+    except OSError:
+        return False
+    while True:
+        try:
+            sock.recv(65535, socket.MSG_DONTWAIT)
+        except OSError:
+            # BlockingIOError: queue empty
+            break
+    return True
+
+class PacketReader:
+    """
+    Receives from sock into one preallocated buffer (recvfrom_into / recvmsg_into), so
+    reading a packet allocates no packet bytes. self.view[:n] holds the last packet and is
+    only valid until the next recv(); decode it with decode_reply(reader.view, n).
+        kernel_ts: the socket has rx timestamps on (enable_rx_timestamps)
+    """
+    def __init__(self, sock, bufsize=4096, kernel_ts=False):
+        self.sock = sock
+        self.buf = bytearray(bufsize)
+        self.view = memoryview(self.buf)
+        self.kernel_ts = kernel_ts
+        self._bufs = [self.view]
+
+    def recv(self):
+        """
+        Read one packet. Returns (n, addr, recv_time, recv_ns):
+            recv_time: wall clock (time.time()) for the logs
+            recv_ns:   time.perf_counter_ns() clock, to subtract a send_echo() send_ns from
+        With kernel_ts both are the kernel's arrival time: its wall-clock stamp as is, and
+        moved onto the perf_counter clock by taking off how long ago (by the wall clock) that was.
+        """
+        if not self.kernel_ts:
+            n, addr = self.sock.recvfrom_into(self.buf)
+            return n, addr, time.time(), time.perf_counter_ns()
+        n, ancdata, _, addr = self.sock.recvmsg_into(self._bufs, _CMSG_SPACE)
+        now_ns = time.perf_counter_ns()
+        wall_ns = time.time_ns()
+        for level, kind, data in ancdata:
+            if level == socket.SOL_SOCKET and kind == SO_TIMESTAMPNS and len(data) >= _TIMESPEC.size:
+                sec, nsec = _TIMESPEC.unpack_from(data)
+                kernel_ns = sec * 1_000_000_000 + nsec
+                return n, addr, kernel_ns / 1e9, now_ns - max(0, wall_ns - kernel_ns)
+        return n, addr, wall_ns / 1e9, now_ns
+
+    def verify(self, n, icmp_off):
+        """checksum of the ICMP part of the last packet"""
+        with self.view[icmp_off:n] as icmp_packet:
+            return verify_icmp_checksum(icmp_packet)
 
 # EXAMPLE FIELDS FOR RESPONSE
 # {"tool":"ping","ts_send":..., "ts_recv":..., "dst":"example.com","dst_ip":"93.184.216.34",
 # "seq":12,"ttl_reply":55,"rtt_ms":23.4,"icmp_type":0,"icmp_code":0,"err":null}
 
-def receive_one_ping(mySocket, ID, timeout, destAddr, sendTime, seq_num):
+def receive_one_ping(mySocket, ID, timeout, destAddr, sendTime, seq_num, send_ns=None, kernel_ts=False, reader=None):
+    """
+    Wait for the reply to one Echo Request.
+        sendTime: wall-clock send time (logged as ts_send)
+        send_ns:  perf_counter_ns() at send, for the RTT and the timeout deadline
+                  (None = now; RTT from the wall-clock difference)
+        kernel_ts: read with recvmsg and take the kernel's receive timestamp
+        reader:   PacketReader on mySocket to reuse (default: a new one)
+    """
     response = {
         "ts_send": sendTime,
         "dst_ip": destAddr,
         "id": ID
     }
 
+    seq_num = seq_num & 0xFFFF # match what send_one_ping put on the wire
+    # wait against a fixed deadline so stray packets on a long-lived socket don't extend it;
+    # monotonic, so a wall-clock step during the wait doesn't stretch or cut the timeout
+    deadline_ns = (time.perf_counter_ns() if send_ns is None else send_ns) + int(timeout * 1e9)
+    if reader is None:
+        reader = PacketReader(mySocket, 1024, kernel_ts)
+
+    m = METRICS
     while 1:
-        what_ready = select.select([mySocket], [], [], timeout)
+        started = time.perf_counter()
+        what_ready = select.select([mySocket], [], [], max(0.0, (deadline_ns - time.perf_counter_ns()) / 1e9))
+        m.select_time.observe(time.perf_counter() - started)
         if what_ready[0] == []:  # Timeout
+            m.timeouts.inc()
             response["err"] = f"Request timed out. after: {timeout}s"
             return response
 
-        recPacket, addr = mySocket.recvfrom(1024)
-
+        started = time.perf_counter()
+        n, addr, receiveTime, recv_ns = reader.recv()
+        m.received.inc()
+        fields = decode_reply(reader.view, n)
+        if fields is None:
+            m.short.inc()
+            continue
+        icmp_type, icmp_code, icmp_id, icmp_seq, response_ttl, icmp_off, payload_ts = fields
+
+        # Echo Reply (0) carries our id/seq itself, Time Exceeded (11) / Dest Unreachable (3)
+        # quote them from our request; anything else (e.g. our own request on loopback) is ignored
+        if icmp_type not in (0, 3, 11) or icmp_id != ID or icmp_seq != seq_num:
+            m.dropped(icmp_id == ID, icmp_type).inc()
+            continue
         src_ip = addr[0]
-        # 1st B of IPv4 head = v.(4b) + head_len(4b)
-        ip_head_len = (recPacket[0] & 0x0F) * 4
-        # 8th B of IPv4 head = TTL(8b)
-        response_ttl = recPacket[8]
-        # ICMP starts @ offset ip_head_len (b/c it's the IP payload)
-        icmp_off = ip_head_len
-        # Extract the entire ICMP packet (header + payload)
-        icmp_packet = recPacket[icmp_off:]
+        # an Echo Reply must come from the target, and a reply (or quote) carrying a timestamp
+        # must carry ours: anything else answers an earlier probe that had the same id and seq
+        if icmp_type == 0 and src_ip != destAddr:
+            m.foreign.inc()
+            continue
+        if payload_ts is not None and payload_ts != sendTime:
+            m.stale.inc()
+            continue
 
         # Verify the checksum of the received ICMP packet
-        if not verify_icmp_checksum(icmp_packet):
+        if not reader.verify(n, icmp_off):
+            m.checksum.inc()
             print(f"Invalid checksum from {src_ip}")
             continue # ignore invalid checksum packets
-
-        # icmp header is 1st 8 Bs of icmp pkt
-        icmp_head = icmp_packet[:8]
-        # network (big-endian) order: type(1), code(1), checksum(2), id(2), seq(2)
-        icmp_type, icmp_code, icmp_cksum, icmp_id, icmp_seq = struct.unpack("!BBHHH", icmp_head)
-
-        if icmp_seq != seq_num:
-            continue # ignore packets with wrong sequence number
+        m.replies.inc()
+        m.parse_time.observe(time.perf_counter() - started)
 
         response["icmp_type"] = icmp_type
         response["icmp_code"] = icmp_code
+        response["ts_recv"] = receiveTime
 
-        # case 1: Echo Reply (type 0) - payload has timestamp
-        if icmp_type == 0 and icmp_id == ID:
-            receiveTime = time.time()
-            payload = icmp_packet[8:]
+        if icmp_type == 0:
             response["ttl_reply"] = response_ttl
-            response["size"] = len(recPacket)
-            if len(payload) >= 8:
-                try:
-                    ts_sent_payload = struct.unpack("d", payload[:8])[0]
-                    # compute RTT from payload timestamp (ms)
-                    # ignore late/other replies (use timestamp to match)
-                    if ts_sent_payload != sendTime:
-                        print(f"Warning: Timestamp mismatch: payload_ts: {ts_sent_payload} != send_ts: {sendTime}")
-                    response["rtt"] = (receiveTime - sendTime) * 1000.0
-                except struct.error:
-                    response["err"] = "Bad payload"
-                    return response
-            else:
+            response["size"] = n
+            if payload_ts is None:
                 response["err"] = "No timestamp in payload"
                 return response
-            return response
-
-        # case 2: Time Exceeded (11) or Dest Unreachable (3)
-        # routers incl original IP head + 1st 8 Bs of original payload
-        if icmp_type in (11, 3):
-            inner_off = icmp_off + 8
-            # make sure inner IP head present
-            if len(recPacket) >= inner_off + 20:
-                inner_ip_head_len = (recPacket[inner_off] & 0x0F) * 4
-                inner_icmp_off = inner_off + inner_ip_head_len
-                # ensure inner ICMP head + 8 Bs of inner payload present
-                if len(recPacket) >= inner_icmp_off + 16:
-                    try:
-                        # unpack inner icmp head into fields (network order)
-                        _, _, _, inner_id, _ = struct.unpack("!BBHHH", recPacket[inner_icmp_off:inner_icmp_off+8])
-                    except struct.error:
-                        response["err"] = "Bad inner ICMP"
-                        return response
-                    # if inner_id matches our ID, extract original timestamp & compute RTT
-                    if inner_id == ID:
-                        response["rtt"] = (receiveTime - sendTime) * 1000.0
-                        return response
-            # return descriptive error msgs
-            if icmp_type == 3:
-                response["err"] = f"Destination unreachable (code={icmp_code}) from {src_ip}"
+            # compute RTT (ms)
+            if send_ns is None:
+                response["rtt"] = (receiveTime - sendTime) * 1000.0
             else:
-                # time exceeded w/out matching inner packet
-                response["err"] = f"Time exceeded from {src_ip}"
+                response["rtt"] = (recv_ns - send_ns) / 1e6
             return response
-            
-        # for other cases of ICMP types, ignore/wait for timeout
 
-def send_one_ping(mySocket, destAddr, ID, seq_num):
+        # return descriptive error msgs
+        if icmp_type == 3:
+            response["err"] = f"Destination unreachable (code={icmp_code}) from {src_ip}"
+        else:
+            response["err"] = f"Time exceeded from {src_ip}"
+        return response
+
+def send_echo(mySocket, destAddr, ID, seq_num):
+    """
+    Send one Echo Request. Returns (timestamp, send_ns): the wall-clock time carried in the
+    payload and logged as ts_send, and time.perf_counter_ns() to measure the RTT against.
+    """
     timestamp = time.time()
     seq_num = seq_num & 0xFFFF # handle unlikely case you ping more than 65K times :P
 
     # Header is type (8), code (8), checksum (16), id (16), sequence (16)
-    # Make a dummy header with a 0 checksum
-    header = struct.pack("!BBHHH", ICMP_ECHO_REQUEST, 0, 0, ID, seq_num)
-    data = struct.pack("d", timestamp)
-
-    # Calculate the checksum using the helper function
-    myChecksum = calculate_icmp_checksum(header + data)
-
-    # Rebuild header with the correct checksum
-    header = struct.pack("!BBHHH", ICMP_ECHO_REQUEST, 0, myChecksum, ID, seq_num)
-    packet = header + data
+    # the template patches seq + timestamp and fixes up the checksum incrementally
+    packet = echo_template(ID).build(seq_num, timestamp)
 
     # AF_INET address must be tuple, not str # Both LISTS and TUPLES consist of a number of objects
+    send_ns = time.perf_counter_ns()
     mySocket.sendto(packet, (destAddr, 1))
     # which can be referenced by their position number within the object.
-    return timestamp
+    return timestamp, send_ns
 
-def do_one_ping(destAddr, timeout, seq_num):
-    icmp = socket.getprotobyname("icmp")
-    # SOCK_RAW is a powerful socket type. For more details: http://sock- raw.org/papers/sock_raw
-    mySocket = socket.socket(socket.AF_INET, socket.SOCK_RAW, icmp)
-    # use RNG for ID
-    myID = os.getpid() & 0xFFFF
-    send_time = send_one_ping(mySocket, destAddr, myID, seq_num)
-    ping_response = receive_one_ping(mySocket, myID, timeout, destAddr, send_time, seq_num)
+def send_one_ping(mySocket, destAddr, ID, seq_num):
+    return send_echo(mySocket, destAddr, ID, seq_num)[0]
 
-    mySocket.close()
-    return ping_response
+class PingSession:
+    """
+    Ping one host many times without per-probe setup cost.
+    The address is resolved once (and again every resolve_interval seconds if > 0)
+    and the raw socket stays open for the life of the session.
+        kernel_ts: time replies with the kernel's receive timestamp (SO_TIMESTAMPNS)
+        bpf: have the kernel drop ICMP that isn't a reply to this session (SO_ATTACH_FILTER)
+        ID: ICMP id to probe with (default: derived from our pid)
+    """
+    def __init__(self, host, resolve_interval=0, kernel_ts=False, bpf=False, ID=None):
+        self.host = host
+        self.resolve_interval = resolve_interval
+        self.kernel_ts = kernel_ts
+        self.bpf = bpf
+        self.ID = os.getpid() & 0xFFFF if ID is None else ID
+        self.mySocket = None
+        self.reader = None
+        self.resolve()
+
+    def resolve(self):
+        """(re)resolve host and remember when, returns the address"""
+        self.dest = socket.gethostbyname(self.host)
+        self.resolved_at = time.time()
+        return self.dest
+
+    def open(self):
+        if self.mySocket is None:
+            self.mySocket = icmp_socket()
+            if self.kernel_ts:
+                self.kernel_ts = enable_rx_timestamps(self.mySocket)
+            if self.bpf:
+                self.bpf = attach_id_filter(self.mySocket, self.ID)
+            # one receive buffer for the whole session
+            self.reader = PacketReader(self.mySocket, 1024, self.kernel_ts)
+        return self.mySocket
+
+    def close(self):
+        if self.mySocket is not None:
+            self.mySocket.close()
+            self.mySocket = None
+            self.reader = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def ping(self, timeout, seq_num):
+        if self.resolve_interval > 0 and time.time() - self.resolved_at >= self.resolve_interval:
+            self.resolve()
+        mySocket = self.open()
+        send_time, send_ns = send_echo(mySocket, self.dest, self.ID, seq_num)
+        METRICS.sent.inc()
+        return receive_one_ping(mySocket, self.ID, timeout, self.dest, send_time, seq_num,
+                                send_ns=send_ns, kernel_ts=self.kernel_ts, reader=self.reader)
+
+def do_one_ping(destAddr, timeout, seq_num):
+    with PingSession(destAddr) as session:
+        return session.ping(timeout, seq_num)
 
 
 def ping(host, timeout, seq_num):
     # timeout=1 means: If one second goes by without a reply from the server,
     # the client assumes that either the client's ping or the server's pong is lost
-    dest = socket.gethostbyname(host)
-    # print(f"Pinging {host} with Address: {dest} with Timeout: {timeout}s")
-    return do_one_ping(dest, timeout, seq_num)
-
+    # one-shot session; use PingSession directly to reuse resolution and socket
+    with PingSession(host) as session:
+        return session.ping(timeout, seq_num)
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import socket
+import sys
+
+# Thin client for probed.py: sends one job and copies the JSONL answer to stdout.
+# Deliberately imports nothing from the probe modules, so it starts in a few milliseconds.
+
+DEFAULT_SOCKET = "/tmp/probed.sock"
+
+def submit(request, path=DEFAULT_SOCKET, out=sys.stdout):
+    """
+    Send request (dict) to the daemon at path and write every line it answers to out.
+    Returns the last line (the "done" or "error" object) parsed.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        sock.sendall(json.dumps(request).encode("utf-8") + b"\n")
+        last = None
+        with sock.makefile("rb") as f:
+            for line in f:
+                out.write(line.decode("utf-8"))
+                out.flush()
+                last = line
+    finally:
+        sock.close()
+    return json.loads(last) if last else {"error": "no answer from daemon"}
+
+def main():
+    parser = argparse.ArgumentParser(description="Submit a ping/trace job to probed.py")
+    parser.add_argument("--socket", type=str, default=DEFAULT_SOCKET, help="Daemon's Unix socket")
+    sub = parser.add_subparsers(dest="op", required=True)
+
+    p = sub.add_parser("ping", help="Ping one target")
+    p.add_argument("target")
+    p.add_argument("--count", type=int, default=1, help="Number of probes to send")
+    p.add_argument("--interval", type=float, default=1.0, help="Interval between probes (s)")
+    p.add_argument("--timeout", type=float, default=1.0, help="Per-probe timeout (s)")
+    p.add_argument("--qps-limit", type=float, help="Max probe rate for this job (capped by the daemon's)")
+
+    t = sub.add_parser("trace", help="Traceroute to one target")
+    t.add_argument("target")
+    t.add_argument("--max-ttl", type=int, default=30, help="Maximum TTL (hops)")
+    t.add_argument("--probes", type=int, default=3, help="Probes per hop")
+    t.add_argument("--timeout", type=float, default=2.0, help="Per-probe timeout (s)")
+    t.add_argument("--flow-id", type=int, default=0, help="Flow ID to keep probes consistent (Paris-style)")
+    t.add_argument("--parallel", action="store_true", help="Probe a window of TTLs at once")
+    t.add_argument("--window", type=int, default=0, help="TTLs in flight together with --parallel (0 = all)")
+    t.add_argument("--adaptive", action="store_true", help="Adaptive per-hop timeouts (see mytrace.py)")
+    t.add_argument("--min-rto", type=float, default=0.1, help="Lower bound on the adaptive wait (s)")
+    t.add_argument("--gap-limit", type=int, default=0, help="Stop after this many consecutive silent hops")
+    t.add_argument("--rdns", action="store_true", help="Add router names (reverse DNS)")
+    t.add_argument("--qps-limit", type=float, help="Max probe rate for this job (capped by the daemon's)")
+
+    sub.add_parser("status", help="Show what the daemon is doing")
+    args = parser.parse_args()
+
+    request = {k: v for k, v in vars(args).items() if k != "socket" and v is not None}
+    try:
+        result = submit(request, args.socket)
+    except OSError as e:
+        print(f"cannot reach daemon at {args.socket}: {e}", file=sys.stderr)
+        sys.exit(2)
+    if "error" in result:
+        print(f"Error: {result['error']}", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,397 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import math
+import os
+import signal
+import socket
+import socketserver
+import struct
+import threading
+import time
+
+import rdns
+import metrics
+from ping import PingSession, attach_id_filter
+from traceroute import RecordSink, trace_windows, open_trace_sockets
+from scheduler import ProbeScheduler, TokenBucket
+from jsonhelper import JsonlWriter, OnlineStats
+from rto import RtoTable
+
+# Probe daemon: one long-lived (privileged) process that takes ping/trace jobs over a local
+# Unix socket, so a job costs a connect and a JSON line instead of interpreter startup,
+# imports, DNS and raw-socket setup.
+#
+# Protocol: the client sends one JSON object on one line, e.g.
+#   {"op": "ping", "target": "example.com", "count": 3, "interval": 1.0, "timeout": 1.0}
+#   {"op": "trace", "target": "example.com", "max_ttl": 30, "probes": 3, "timeout": 2.0, "parallel": true}
+#   {"op": "status"}
+# and gets back one JSON line per probe record as it is produced, then a last line that is
+# either {"done": true, ...} or {"error": "..."}.
+
+DEFAULT_SOCKET = "/tmp/probed.sock"
+
+PING_DEFAULTS = {"count": 1, "interval": 1.0, "timeout": 1.0}
+TRACE_DEFAULTS = {"max_ttl": 30, "probes": 3, "timeout": 2.0, "flow_id": 0, "parallel": False, "window": 0,
+                  "adaptive": False, "min_rto": 0.1, "gap_limit": 0, "rdns": False}
+
+class JobError(Exception):
+    pass
+
+def require(req, name, ok, what, integer=False):
+    """
+    req[name] if it is a (finite) number that ok() accepts, else a JobError saying it must be what
+        integer: only accept ints
+    """
+    value = req.get(name)
+    kinds = int if integer else (int, float)
+    if isinstance(value, bool) or not isinstance(value, kinds) or not math.isfinite(value) or not ok(value):
+        raise JobError(f"{name} must be {what}, got {value!r}")
+    return value
+
+def check_ping(req):
+    require(req, "count", lambda v: v >= 1, "an integer >= 1", integer=True)
+    require(req, "interval", lambda v: v >= 0, "a number >= 0")
+    require(req, "timeout", lambda v: v > 0, "a number > 0")
+    if req.get("qps_limit") is not None:
+        require(req, "qps_limit", lambda v: v >= 0, "a number >= 0")
+
+def check_trace(req):
+    # ttl and probe number share the 16-bit ICMP seq, the flow id is the ICMP id
+    require(req, "max_ttl", lambda v: 1 <= v <= 255, "an integer in 1..255", integer=True)
+    require(req, "probes", lambda v: 1 <= v <= 255, "an integer in 1..255", integer=True)
+    require(req, "flow_id", lambda v: 0 <= v <= 0xFFFF, "an integer in 0..65535", integer=True)
+    require(req, "timeout", lambda v: v > 0, "a number > 0")
+    require(req, "min_rto", lambda v: v > 0, "a number > 0")
+    require(req, "window", lambda v: v >= 0, "an integer >= 0", integer=True)
+    require(req, "gap_limit", lambda v: v >= 0, "an integer >= 0", integer=True)
+    if req.get("qps_limit") is not None:
+        require(req, "qps_limit", lambda v: v >= 0, "a number >= 0")
+
+class StreamLogger:
+    """JsonlLogger look-alike writing each record to the client (and to the daemon's own log)"""
+    def __init__(self, wfile, tool, log=None):
+        self.wfile = wfile
+        self.tool = tool
+        self.log = log
+        self.count = 0
+
+    def jsonl_write(self, obj):
+        obj.setdefault("tool", self.tool)
+        if self.log is not None:
+            self.log.write(obj)
+        self.wfile.write(json.dumps(obj).encode("utf-8") + b"\n")
+        self.wfile.flush()
+        self.count += 1
+
+class ProbeDaemon:
+    """
+    Job runner with everything worth keeping between jobs kept warm: one PingSession (raw
+    socket + resolved address) per ping target, raw socket pairs for traces, resolved trace
+    targets, the rDNS cache and the adaptive-timeout estimators.
+    Jobs run concurrently, so every ping session and every running trace probes with its own
+    ICMP id, with the kernel filter on that id attached: a job never sees another's replies.
+        qps_limit: probe rate cap shared by every job (0 = unlimited)
+        idle_timeout: close a ping target's (or a spare trace) socket after this long unused (s)
+        dns_ttl: re-resolve targets after this long (s)
+        log: optional JsonlWriter receiving every record of every job
+    """
+    def __init__(self, qps_limit=1.0, idle_timeout=300.0, dns_ttl=300.0, kernel_ts=False, log=None):
+        self.qps_limit = qps_limit
+        self.bucket = TokenBucket(qps_limit, clock=time.time)
+        self.idle_timeout = idle_timeout
+        self.dns_ttl = dns_ttl
+        self.kernel_ts = kernel_ts
+        self.log = log
+        # target -> [PingSession, Lock, last used, next wire seq]
+        self.sessions = {}
+        # spare [send socket, receive socket, last used] for trace jobs
+        self.trace_socks = []
+        # ICMP ids held by sessions and running traces; the next one to try
+        self.ids = set()
+        self.next_id = os.getpid() & 0xFFFF or 1
+        # target -> (ip, resolved at)
+        self.resolved = {}
+        # (timeout, min_rto) -> RtoTable
+        self.rtos = {}
+        self.jobs = 0
+        self.started = time.time()
+        self._lock = threading.Lock()
+
+    def run_job(self, request, wfile):
+        """run one request, streaming records to wfile; returns the closing "done" dict"""
+        op = request.get("op")
+        with self._lock:
+            self.jobs += 1
+        if op == "ping":
+            return self.ping(dict(PING_DEFAULTS, **request), wfile)
+        if op == "trace":
+            return self.trace(dict(TRACE_DEFAULTS, **request), wfile)
+        if op == "status":
+            return self.status()
+        raise JobError(f"unknown op: {op!r}")
+
+    def scheduler(self, interval, qps_limit):
+        # a job may ask for a lower rate than the daemon's cap, never a higher one
+        rate = self.qps_limit if qps_limit is None else qps_limit
+        if self.qps_limit > 0:
+            rate = min(rate, self.qps_limit) if rate > 0 else self.qps_limit
+        return ProbeScheduler(interval=interval, rate=rate, shared=self.bucket, clock=time.time)
+
+    def alloc_id(self, want=0):
+        """
+        an ICMP id no other session or running trace holds, until release_id()
+            want: the id asked for (0 = any); an error if it is taken
+        """
+        with self._lock:
+            if want:
+                if want in self.ids:
+                    raise JobError(f"flow_id {want} is in use by another job")
+                self.ids.add(want)
+                return want
+            # like shard.worker_ids: consecutive nonzero ids, wrapping within 1..65535
+            for _ in range(0xFFFF):
+                ID = self.next_id
+                self.next_id = ID % 0xFFFF + 1
+                if ID not in self.ids:
+                    self.ids.add(ID)
+                    return ID
+        raise JobError("no free ICMP id")
+
+    def release_id(self, ID):
+        with self._lock:
+            self.ids.discard(ID)
+
+    def session(self, target):
+        """the cached [PingSession, Lock, last used, seq] for target, opened on first use"""
+        now = time.time()
+        with self._lock:
+            for host, entry in list(self.sessions.items()):
+                if now - entry[2] > self.idle_timeout and not entry[1].locked():
+                    entry[0].close()
+                    self.ids.discard(entry[0].ID)
+                    del self.sessions[host]
+            entry = self.sessions.get(target)
+            if entry is not None:
+                entry[2] = now
+                return entry
+        # resolve and open outside the lock so a slow DNS answer holds up only this job
+        ID = self.alloc_id()
+        try:
+            session = PingSession(target, resolve_interval=self.dns_ttl, kernel_ts=self.kernel_ts, bpf=True, ID=ID)
+        except (socket.gaierror, UnicodeError) as e:
+            self.release_id(ID)
+            raise JobError(f"cannot resolve {target}: {e}")
+        session.open()
+        with self._lock:
+            entry = self.sessions.get(target)
+            if entry is None:
+                entry = self.sessions[target] = [session, threading.Lock(), now, 0]
+            else:
+                # another job got there first
+                session.close()
+                self.ids.discard(ID)
+            entry[2] = now
+            return entry
+
+    def trace_sockets(self, ID):
+        """a (send, receive) socket pair for one trace, warm if there is a spare, filtered on ID"""
+        now = time.time()
+        with self._lock:
+            for entry in [e for e in self.trace_socks if now - e[2] > self.idle_timeout]:
+                entry[0].close()
+                entry[1].close()
+                self.trace_socks.remove(entry)
+            entry = self.trace_socks.pop() if self.trace_socks else None
+        send_sock, recv_sock = open_trace_sockets() if entry is None else entry[:2]
+        # replaces the previous job's filter and discards what it left queued
+        attach_id_filter(recv_sock, ID)
+        return send_sock, recv_sock
+
+    def release_trace_sockets(self, send_sock, recv_sock):
+        with self._lock:
+            self.trace_socks.append([send_sock, recv_sock, time.time()])
+
+    def resolve(self, target):
+        now = time.time()
+        with self._lock:
+            cached = self.resolved.get(target)
+        if cached is not None and now - cached[1] < self.dns_ttl:
+            return cached[0]
+        try:
+            ip = socket.gethostbyname(target)
+        except (socket.gaierror, UnicodeError) as e:
+            raise JobError(f"cannot resolve {target}: {e}")
+        with self._lock:
+            self.resolved[target] = (ip, now)
+        return ip
+
+    def ping(self, req, wfile):
+        check_ping(req)
+        entry = self.session(req["target"])
+        session, lock = entry[0], entry[1]
+        out = StreamLogger(wfile, "ping", self.log)
+        sched = self.scheduler(req["interval"], req.get("qps_limit"))
+        stats = OnlineStats()
+        for i in range(req["count"]):
+            due = sched.wait()
+            # jobs for the same target take turns on its socket; wire seqs come from the
+            # session so one job can't take another's late reply for its own
+            with lock:
+                wire_seq = entry[3]
+                entry[3] = (wire_seq + 1) & 0xFFFF
+                late = sched.sent(due)
+                result = session.ping(req["timeout"], wire_seq)
+            result["seq"] = i
+            result["sched_late"] = late
+            if result.get("err") is None and result.get("rtt") is not None:
+                stats.add(result["rtt"])
+            out.jsonl_write(result)
+        return {"done": True, "op": "ping", "target": req["target"], "sent": req["count"],
+                "received": stats.n, "rtt": stats.summary() if stats.n else None, "schedule": sched.report()}
+
+    def rto(self, timeout, min_rto):
+        with self._lock:
+            table = self.rtos.get((timeout, min_rto))
+            if table is None:
+                table = self.rtos[(timeout, min_rto)] = RtoTable(timeout, min_rto)
+            return table
+
+    def trace(self, req, wfile):
+        check_trace(req)
+        max_ttl, probes = req["max_ttl"], req["probes"]
+        target = req["target"]
+        dest_ip = self.resolve(target)
+        out = StreamLogger(wfile, "trace", self.log)
+        sched = self.scheduler(0.0, req.get("qps_limit"))
+        sink = RecordSink(out, rdns=req["rdns"], echo=False)
+        rto = self.rto(req["timeout"], req["min_rto"]) if req["adaptive"] else None
+        # parallel: a window of TTLs (all by default) at once; otherwise one probe at a time
+        window = (req["window"] or max_ttl) if req["parallel"] else 1
+        # the flow id is the ICMP id: the one asked for, or one of the daemon's own
+        flow_id = self.alloc_id(req["flow_id"])
+        try:
+            socks = self.trace_sockets(flow_id)
+            try:
+                responses = trace_windows(target, dest_ip, max_ttl, req["timeout"], probes, sched.bucket.rate,
+                                          flow_id, sink, sched, window, one_at_a_time=not req["parallel"],
+                                          kernel_ts=self.kernel_ts, rto=rto, gap_limit=req["gap_limit"], socks=socks)
+            finally:
+                self.release_trace_sockets(*socks)
+        finally:
+            self.release_id(flow_id)
+        sink.flush()
+        answered = sum(1 for r in responses if r.get("err") != "timeout")
+        return {"done": True, "op": "trace", "target": target, "dst_ip": dest_ip, "flow_id": flow_id,
+                "sent": len(responses), "received": answered, "schedule": sched.report()}
+
+    def status(self):
+        with self._lock:
+            return {"done": True, "op": "status", "pid": os.getpid(), "uptime": time.time() - self.started,
+                    "jobs": self.jobs, "sessions": sorted(self.sessions), "qps_limit": self.qps_limit}
+
+    def close(self):
+        with self._lock:
+            for entry in self.sessions.values():
+                entry[0].close()
+            self.sessions.clear()
+            for send_sock, recv_sock, _ in self.trace_socks:
+                send_sock.close()
+                recv_sock.close()
+            self.trace_socks = []
+            self.ids.clear()
+
+class JobHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        started = time.perf_counter()
+        line = self.rfile.readline()
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise JobError("request must be a JSON object")
+            result = self.server.daemon.run_job(request, self.wfile)
+            result["elapsed_ms"] = (time.perf_counter() - started) * 1000.0
+        except (BrokenPipeError, ConnectionResetError):
+            # client went away mid-job
+            return
+        except (JobError, OSError, ValueError, KeyError, TypeError, struct.error) as e:
+            result = {"error": str(e)}
+        try:
+            self.wfile.write(json.dumps(result).encode("utf-8") + b"\n")
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+class JobServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, daemon, mode=0o600):
+        # a stale socket left by a previous run would make bind() fail
+        if os.path.exists(path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(path)
+            except OSError:
+                os.unlink(path)
+            else:
+                raise OSError(f"{path}: a daemon is already listening")
+            finally:
+                probe.close()
+        self.daemon = daemon
+        self.path = path
+        super().__init__(path, JobHandler)
+        os.chmod(path, mode)
+
+    def server_close(self):
+        super().server_close()
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+def _terminate(signum, frame):
+    # SIGTERM: stop like Ctrl-C, so the socket file is removed and logs are flushed
+    raise KeyboardInterrupt
+
+def main():
+    parser = argparse.ArgumentParser(description="ICMP probe daemon (ping/trace jobs over a Unix socket)")
+    parser.add_argument("--socket", type=str, default=DEFAULT_SOCKET, help="Unix socket to listen on")
+    parser.add_argument("--mode", type=lambda s: int(s, 8), default=0o600,
+                        help="Permissions of the socket file (octal), i.e. who may submit jobs")
+    parser.add_argument("--qps-limit", type=float, default=1.0,
+                        help="Max probe rate across all jobs (queries per second)")
+    parser.add_argument("--i-accept-the-risk", action="store_true", help="Allows QPS > 1")
+    parser.add_argument("--idle-timeout", type=float, default=300.0,
+                        help="Close a ping target's cached socket after this many idle seconds")
+    parser.add_argument("--dns-ttl", type=float, default=300.0, help="Re-resolve targets after this many seconds")
+    parser.add_argument("--json", type=str, help="Also write every job's records to this JSONL file")
+    parser.add_argument("--kernel-ts", action="store_true",
+                        help="Time replies with kernel receive timestamps (SO_TIMESTAMPNS)")
+    parser.add_argument("--rdns-cache", type=str,
+                        help="Load reverse DNS results from this file and save them back on exit")
+    metrics.add_arguments(parser)
+    args = parser.parse_args()
+    metrics.start(args)
+
+    if args.qps_limit > 1 and not args.i_accept_the_risk:
+        print("WARNING: QPS limit > 1, requires --i-accept-the-risk")
+        return
+    if args.rdns_cache:
+        rdns.configure(cache_path=args.rdns_cache)
+
+    log = JsonlWriter(args.json, background=True) if args.json else None
+    daemon = ProbeDaemon(args.qps_limit, args.idle_timeout, args.dns_ttl, args.kernel_ts, log)
+    server = JobServer(args.socket, daemon, args.mode)
+    signal.signal(signal.SIGTERM, _terminate)
+    print(f"probed listening on {args.socket} (pid {os.getpid()}, qps={args.qps_limit})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        daemon.close()
+        if log is not None:
+            log.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+import atexit
+import json
+import os
+import socket
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+import metrics
+
+LOOKUPS = metrics.counter("rdns_lookups_total", "PTR lookups sent to the resolver")
+LOOKUP_TIME = metrics.histogram("rdns_lookup_seconds", "Time per PTR lookup")
+
+# RdnsCache: PTR results with an expiry, least recently used dropped first once full.
+# Expiry is wall-clock so entries keep their meaning when saved and loaded by another process.
+class RdnsCache:
+    """
+    ip -> name (None = no PTR record). Names are kept ttl seconds, failed lookups
+    negative_ttl seconds, and at most max_entries ips.
+    """
+    def __init__(self, ttl=3600.0, negative_ttl=300.0, max_entries=10000):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        # ip -> (name, expires)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, ip):
+        """(True, name) for a live entry, (False, None) if missing or expired"""
+        with self._lock:
+            entry = self._entries.get(ip)
+            if entry is None:
+                return False, None
+            if entry[1] <= time.time():
+                del self._entries[ip]
+                return False, None
+            self._entries.move_to_end(ip)
+            return True, entry[0]
+
+    def put(self, ip, name, expires=None):
+        if expires is None:
+            expires = time.time() + (self.ttl if name else self.negative_ttl)
+        with self._lock:
+            self._entries[ip] = (name, expires)
+            self._entries.move_to_end(ip)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def load(self, path):
+        """merge live entries from a file written by save(); a missing/corrupt file is ignored"""
+        try:
+            with open(path) as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return
+        now = time.time()
+        for ip, (name, expires) in entries.items():
+            if expires > now:
+                found, _ = self.get(ip)
+                if not found:
+                    self.put(ip, name, expires)
+
+    def save(self, path):
+        """
+        Write live entries to path, merged with whatever another process saved there in the
+        meantime (write-then-rename, so readers never see half a file).
+        """
+        self.load(path)
+        now = time.time()
+        with self._lock:
+            entries = {ip: [name, expires] for ip, (name, expires) in self._entries.items() if expires > now}
+        d = os.path.dirname(path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(entries, f)
+        os.replace(tmp, path)
+
+def _gethostbyaddr(ip):
+    try:
+        return socket.gethostbyaddr(ip)[0]
+    except (OSError, UnicodeError):
+        return None
+
+# Resolver: one thread pool for every PTR lookup in the process. prefetch() starts a lookup
+# the moment an ip is first seen; by the time a record needs the name it is usually there.
+class Resolver:
+    """
+    Parallel, cached reverse DNS.
+        workers: lookups in flight at once
+        cache_path: file to load the cache from now and save it to at exit (None = memory only)
+    """
+    def __init__(self, workers=8, cache=None, cache_path=None):
+        self.cache = cache or RdnsCache()
+        self.cache_path = cache_path
+        if cache_path:
+            self.cache.load(cache_path)
+            atexit.register(self.save)
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="rdns")
+        # ip -> Future for lookups still running
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def cached(self, ip):
+        """the name if it is already known (None otherwise), never waits"""
+        return self.cache.get(ip)[1]
+
+    def prefetch(self, ip):
+        """start resolving ip unless it is cached or already running; returns its Future or None if cached"""
+        found, _ = self.cache.get(ip)
+        if found:
+            return None
+        with self._lock:
+            fut = self._pending.get(ip)
+            if fut is None:
+                fut = self._pending[ip] = self._pool.submit(self._resolve, ip)
+            return fut
+
+    def _resolve(self, ip):
+        LOOKUPS.inc()
+        started = time.perf_counter()
+        name = _gethostbyaddr(ip)
+        LOOKUP_TIME.observe(time.perf_counter() - started)
+        self.cache.put(ip, name)
+        with self._lock:
+            self._pending.pop(ip, None)
+        return name
+
+    def done(self, ip):
+        """True once ip's lookup has finished (or it was cached)"""
+        fut = self.prefetch(ip)
+        return fut is None or fut.done()
+
+    def lookup(self, ip, timeout_ms=200):
+        """
+        Name for ip, waiting at most timeout_ms (<= 0: as long as it takes). A lookup that
+        runs over still lands in the cache for next time.
+        """
+        fut = self.prefetch(ip)
+        if fut is None:
+            return self.cached(ip)
+        try:
+            return fut.result(timeout=timeout_ms / 1000.0 if timeout_ms > 0 else None)
+        except FutureTimeout:
+            return None
+
+    def save(self):
+        if self.cache_path:
+            try:
+                self.cache.save(self.cache_path)
+            except OSError:
+                pass
+
+_SHARED = None
+
+def shared_resolver():
+    """the process-wide Resolver, created (memory-only) on first use unless configure() was called"""
+    global _SHARED
+    if _SHARED is None:
+        _SHARED = Resolver()
+    return _SHARED
+
+def configure(workers=8, cache_path=None, ttl=3600.0, negative_ttl=300.0, max_entries=10000):
+    """replace the process-wide Resolver, e.g. to persist its cache to cache_path"""
+    global _SHARED
+    _SHARED = Resolver(workers, RdnsCache(ttl, negative_ttl, max_entries), cache_path)
+    return _SHARED
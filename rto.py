@@ -0,0 +1,93 @@
+import threading
+
+# RttEstimator: Jacobson/Karels smoothed RTT and variance (the TCP retransmission timer,
+# RFC 6298), used to decide how long a probe is worth waiting for
+class RttEstimator:
+    """
+    SRTT / RTTVAR over the RTT samples fed to update() (seconds). rto() is
+    SRTT + k*RTTVAR, doubled for every timeout since the last sample (backoff()).
+    """
+    ALPHA = 1.0 / 8
+    BETA = 1.0 / 4
+    K = 4
+
+    def __init__(self):
+        self.srtt = None
+        self.rttvar = None
+        self.n = 0
+        self.backoffs = 0
+
+    def update(self, rtt):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2.0
+        else:
+            self.rttvar = (1 - self.BETA) * self.rttvar + self.BETA * abs(self.srtt - rtt)
+            self.srtt = (1 - self.ALPHA) * self.srtt + self.ALPHA * rtt
+        self.n += 1
+        self.backoffs = 0
+
+    def backoff(self):
+        self.backoffs += 1
+
+    def rto(self):
+        """None until the first sample"""
+        if self.srtt is None:
+            return None
+        return self.srtt + self.K * self.rttvar
+
+    def to_dict(self):
+        return {"srtt": self.srtt, "rttvar": self.rttvar, "n": self.n, "backoffs": self.backoffs}
+
+# RtoTable: one estimator per destination and one per (destination, TTL)
+class RtoTable:
+    """
+    Adaptive probe timeouts. A hop's wait comes from its own estimator; a hop that never
+    answered yet (e.g. a silent router) borrows the destination's, which every reply on
+    the path feeds. Timeouts back off per hop. Every RTO is clamped to [min_rto, max_rto]
+    seconds, max_rto being the fixed --timeout it replaces; initial is used before any
+    reply from the destination's path.
+    """
+    def __init__(self, max_rto, min_rto=0.1, initial=1.0):
+        self.max_rto = max_rto
+        self.min_rto = min(min_rto, max_rto)
+        self.initial = initial
+        # dest -> RttEstimator, (dest, ttl) -> RttEstimator
+        self.dests = {}
+        self.hops = {}
+        self._lock = threading.Lock()
+
+    def _get(self, table, key):
+        est = table.get(key)
+        if est is None:
+            est = table[key] = RttEstimator()
+        return est
+
+    def update(self, dest, ttl, rtt_ms):
+        """feed one RTT sample (ms, as in the records) for dest (and hop ttl unless None)"""
+        rtt = rtt_ms / 1000.0
+        with self._lock:
+            self._get(self.dests, dest).update(rtt)
+            if ttl is not None:
+                self._get(self.hops, (dest, ttl)).update(rtt)
+
+    def backoff(self, dest, ttl=None):
+        """a probe to dest (hop ttl) got no answer within its RTO"""
+        with self._lock:
+            key, table = ((dest, ttl), self.hops) if ttl is not None else (dest, self.dests)
+            self._get(table, key).backoff()
+
+    def timeout(self, dest, ttl=None):
+        """seconds to wait for the next probe to dest (hop ttl)"""
+        with self._lock:
+            hop = self.hops.get((dest, ttl)) if ttl is not None else None
+            path = self.dests.get(dest)
+            rto = hop.rto() if hop is not None else None
+            if rto is None:
+                rto = path.rto() if path is not None else None
+            if rto is None:
+                rto = self.initial
+            own = hop if ttl is not None else path
+            backoffs = own.backoffs if own is not None else 0
+        rto *= 2 ** min(backoffs, 16)
+        return min(self.max_rto, max(self.min_rto, rto))
@@ -0,0 +1,130 @@
+import time
+import threading
+
+from jsonhelper import OnlineStats
+
+# TokenBucket: rate limit as a virtual schedule (GCRA) instead of sleeping after each probe.
+# Tokens come due at fixed points in time, so a probe that was slow to come back doesn't
+# push later ones back, and one bucket can be shared to cap the rate across many targets.
+class TokenBucket:
+    """
+    rate tokens per second (0 = unlimited), up to burst of them back to back.
+    Nothing here sleeps: reserve() says when a token can be used and callers wait for it
+    however suits them (time.sleep, select timeout, ...).
+    """
+    def __init__(self, rate, burst=1, clock=time.monotonic):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.clock = clock
+        self.period = 1.0 / rate if rate > 0 else 0.0
+        # theoretical arrival time of the next token
+        self._tat = float('-inf')
+        self._lock = threading.Lock()
+
+    def next_time(self):
+        """earliest time (on clock) the next token can be taken"""
+        if self.period == 0.0:
+            return float('-inf')
+        return self._tat - (self.burst - 1) * self.period
+
+    def reserve(self, at=None):
+        """take the next token no earlier than at (default now); returns when it may be used"""
+        at = self.clock() if at is None else at
+        if self.period == 0.0:
+            return at
+        with self._lock:
+            t = max(at, self.next_time())
+            self._tat = max(self._tat, t) + self.period
+            return t
+
+# ProbeScheduler: absolute deadlines for one stream of probes (probe k is due at start + k*step)
+class ProbeScheduler:
+    """
+    Send probes on a fixed schedule whatever their replies take: with an interval, probe k
+    is due at start + k*step (step = the longer of interval and 1/rate); without one the
+    rate alone paces them. After falling behind (e.g. a probe that waited out a long
+    timeout) it catches up no faster than rate, and shared, a TokenBucket several
+    schedulers hold (e.g. every target in a process), caps them all together.
+    Lateness (actual send time - due time, ms) of every probe is kept in self.lateness,
+    so the rate that was really achieved can be checked afterwards.
+    """
+    def __init__(self, interval=0.0, rate=0.0, shared=None, clock=time.monotonic, sleep=time.sleep):
+        self.interval = interval
+        self.step = max(interval, 1.0 / rate if rate > 0 else 0.0)
+        self.bucket = TokenBucket(rate, clock=clock)
+        self.shared = shared
+        self.clock = clock
+        self.sleep = sleep
+        self.start = None
+        self.count = 0
+        self.first_send = None
+        self.last_send = None
+        self.lateness = OnlineStats()
+
+    def reserve(self):
+        """
+        Claim the next slot without sleeping. Returns (due, ready): ready is when the rate
+        limits let it go; pass due to sent() once it has actually been sent.
+        """
+        now = self.clock()
+        if self.start is None:
+            self.start = now
+        due = self.start + self.count * self.step if self.interval > 0 else now
+        ready = self.bucket.reserve(due)
+        if self.shared is not None:
+            ready = self.shared.reserve(ready)
+        self.count += 1
+        # rate-only: there is no grid to be late against, only the token's own time
+        return (due if self.interval > 0 else ready), ready
+
+    def ready_at(self):
+        """when the rate limits next allow a send (for event loops that keep their own due times)"""
+        t = self.bucket.next_time()
+        if self.shared is not None:
+            t = max(t, self.shared.next_time())
+        return t
+
+    def take(self, at=None):
+        """use up the tokens for a probe sent at at (default now), the ready_at() counterpart of reserve()"""
+        at = self.clock() if at is None else at
+        self.bucket.reserve(at)
+        if self.shared is not None:
+            self.shared.reserve(at)
+        self.count += 1
+
+    def sent(self, due, at=None):
+        """note that the probe due at due went out at at (default now); returns its lateness in ms"""
+        at = self.clock() if at is None else at
+        if self.first_send is None:
+            self.first_send = at
+        self.last_send = at
+        late = max(0.0, at - due) * 1000.0
+        self.lateness.add(late)
+        return late
+
+    def wait(self):
+        """sleep until the next probe may be sent, returns its due time for sent()"""
+        due, ready = self.reserve()
+        delay = ready - self.clock()
+        if delay > 0:
+            self.sleep(delay)
+        return due
+
+    def achieved_rate(self):
+        """probes per second between the first and last send (None with fewer than 2)"""
+        if self.lateness.n < 2 or self.last_send == self.first_send:
+            return None
+        return (self.lateness.n - 1) / (self.last_send - self.first_send)
+
+    def report(self):
+        """one line on how closely the schedule was kept"""
+        if self.lateness.n == 0:
+            return "Schedule: no probes sent"
+        s = self.lateness.summary()
+        rate = self.achieved_rate()
+        rate = f"{rate:.2f}/s" if rate is not None else "n/a"
+        target = f"{1.0 / self.step:.2f}/s" if self.step > 0 else "unlimited"
+        # without an interval the rate is only a ceiling, not the schedule
+        label = "target" if self.interval > 0 else "limit"
+        return (f"Schedule: {s['count']} probes, achieved rate {rate} ({label} {target}), "
+                f"lateness ms avg={s['avg']:.3f} p50={s['p50']:.3f} p99={s['p99']:.3f} max={s['max']:.3f}")
@@ -0,0 +1,256 @@
+import json
+import multiprocessing
+import os
+import queue as queue_mod
+import socket
+import sys
+import threading
+import time
+import traceback
+
+from jsonhelper import OnlineStats
+from multiping import MultiPinger
+from scheduler import ProbeScheduler
+from rto import RtoTable
+import traceroute as tr
+import rdns
+import metrics
+from doubletree import StopSet, trace_doubletree
+
+# Sharded probing: split a target list across worker processes, so packet parsing, record
+# building and JSON serialization run on every core instead of one.
+#
+# Every worker opens its own raw socket(s) and probes with its own ICMP id, taken from a
+# block of consecutive ids, with the kernel BPF filter on that id attached, so replies
+# only reach (and match in) the worker that sent the probe. Workers send their records
+# back as batches of ready-made JSONL lines; the parent only appends them to the one
+# output file, and collects each worker's per-target tallies at the end. Each batch also
+# carries what the worker's metrics counted since the last one, added into the parent's
+# registry so its --metrics-port/--metrics-file cover the whole run.
+
+# records per batch sent to the parent, and the longest a record waits in a worker
+BATCH_LINES = 512
+BATCH_INTERVAL = 0.25
+
+def worker_ids(workers, base=None):
+    """
+    One distinct, nonzero ICMP id per worker: base, base + 1, ... (wrapping within 1..65535).
+        base: first id (default: derived from our pid, like the unsharded tools)
+    """
+    base = os.getpid() & 0xFFFF if base is None else base
+    return [(base - 1 + k) % 0xFFFF + 1 for k in range(workers)]
+
+def split_targets(targets, workers, contiguous=False):
+    """
+    deal targets round-robin into at most workers non-empty shards
+        contiguous: split into consecutive runs instead, so neighbours in the list (e.g. a
+                    sorted list's same-prefix targets) land in the same shard
+    """
+    if contiguous:
+        size = -(-len(targets) // workers)
+        return [targets[k:k + size] for k in range(0, len(targets), size)]
+    shards = [targets[k::workers] for k in range(workers)]
+    return [shard for shard in shards if shard]
+
+class BatchLogger:
+    """
+    JsonlLogger look-alike for a worker: serializes each record (same tool/ts defaults as
+    JsonlWriter) and ships them to the parent in batches, along with the worker's metrics
+    deltas. A daemon thread sends whatever is waiting every BATCH_INTERVAL, so records
+    of a slow prober don't sit in the worker until its next one.
+    """
+    def __init__(self, queue, worker, tool):
+        self.queue = queue
+        self.worker = worker
+        self.tool = tool
+        self.lines = []
+        # the registry as last shipped (a forked worker starts with the parent's counts)
+        self.seen = metrics.REGISTRY.snapshot()
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._flush_loop, name="batch-flush", daemon=True)
+        self._thread.start()
+
+    def jsonl_write(self, obj):
+        obj.setdefault("tool", self.tool)
+        obj.setdefault("ts", time.time())
+        line = json.dumps(obj) + "\n"
+        with self._lock:
+            self.lines.append(line)
+            full = len(self.lines) >= BATCH_LINES
+        if full:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            lines, self.lines = self.lines, []
+            snap = metrics.REGISTRY.snapshot()
+            counted = metrics.delta(snap, self.seen)
+            self.seen = snap
+            if lines or counted:
+                # put under the lock so batches reach the parent in order
+                self.queue.put(("lines", self.worker, lines, counted))
+
+    def _flush_loop(self):
+        while not self._closed.wait(BATCH_INTERVAL):
+            self.flush()
+
+    def close(self):
+        self._closed.set()
+        self._thread.join()
+        self.flush()
+
+def _tally(tally, result):
+    # same as myping.tally_result: only successful probes add an RTT
+    tally[0] += 1
+    rtt = result.get("rtt")
+    if rtt is not None and result.get("err") is None:
+        tally[1].add(rtt)
+
+def _ping_worker(worker, ID, targets, opts, out):
+    """MultiPinger over this worker's targets; returns ({target: [sent, OnlineStats]}, schedule report)"""
+    tallies = {target: [0, OnlineStats()] for target in targets}
+
+    def on_result(target, result):
+        _tally(tallies[target], result)
+        out.jsonl_write(result)
+
+    pinger = MultiPinger(targets, count=opts["count"], interval=opts["interval"], timeout=opts["timeout"],
+                         qps_limit=opts["qps_limit"], max_inflight=opts["max_inflight"],
+                         kernel_ts=opts["kernel_ts"], bpf=opts["bpf"], ID=ID)
+    try:
+        pinger.run(on_result)
+    except KeyboardInterrupt:
+        pass
+    return tallies, pinger.sched.report()
+
+def _trace_worker(worker, ID, targets, opts, out):
+    """
+    Trace this worker's targets one after the other, all with flow_id = ID; with
+    opts["doubletree"] they share one StopSet, so hops found by earlier traces aren't probed again.
+    Returns ({target: (dest_ip, {ttl: [total, OnlineStats]}) or (None, error)}, schedule report)
+    """
+    if opts["rdns"]:
+        rdns.configure(workers=opts["rdns_workers"], cache_path=opts["rdns_cache"])
+    rto = RtoTable(opts["timeout"], opts["min_rto"]) if opts["adaptive"] else None
+    # one rate limit for the whole shard, not restarted per target
+    sched = ProbeScheduler(rate=opts["qps_limit"], clock=time.time)
+    sink = tr.RecordSink(out, rdns=opts["rdns"], echo=False)
+    window = (opts["window"] or opts["max_ttl"]) if opts["parallel"] else 1
+    stops = StopSet(opts["prefix_len"]) if opts["doubletree"] else None
+    summaries = {}
+    # one socket pair (and filter) for the whole shard rather than one per target
+    socks = tr.open_trace_sockets(tr.probe_id(ID) if opts["bpf"] else None)
+    try:
+        for target in targets:
+            try:
+                dest_ip = socket.gethostbyname(target)
+            except (socket.gaierror, UnicodeError) as e:
+                summaries[target] = (None, f"Could not resolve {target}: {e}")
+                continue
+            if stops is not None:
+                responses = trace_doubletree(target, dest_ip, stops, opts["max_ttl"], opts["timeout"],
+                                             opts["probes"], opts["qps_limit"], ID, sink, sched,
+                                             start_ttl=opts["start_ttl"], kernel_ts=opts["kernel_ts"],
+                                             rto=rto, gap_limit=opts["gap_limit"], socks=socks)
+            else:
+                responses = tr.trace_windows(target, dest_ip, opts["max_ttl"], opts["timeout"], opts["probes"],
+                                             opts["qps_limit"], ID, sink, sched, window,
+                                             one_at_a_time=not opts["parallel"], kernel_ts=opts["kernel_ts"],
+                                             rto=rto, gap_limit=opts["gap_limit"], socks=socks)
+            sink.flush()
+            out.flush()
+            summaries[target] = (dest_ip, tr.tally_responses(responses))
+    except KeyboardInterrupt:
+        sink.flush()
+    finally:
+        for sock in socks:
+            sock.close()
+    if opts["rdns"]:
+        sink.resolver.save()
+    report = sched.report()
+    if stops is not None:
+        report += "\n" + stops.report()
+    return summaries, report
+
+WORKERS = {"ping": _ping_worker, "trace": _trace_worker}
+
+def _worker_main(kind, worker, ID, targets, opts, queue):
+    out = BatchLogger(queue, worker, kind)
+    try:
+        summaries, report = WORKERS[kind](worker, ID, targets, opts, out)
+        out.close()
+        queue.put(("done", worker, summaries, report))
+    except Exception:
+        out.close()
+        queue.put(("error", worker, traceback.format_exc()))
+        sys.exit(1)
+
+def _write_lines(logger, lines):
+    """append a worker's serialized records to every writer of a JsonlLogger"""
+    for writer in logger.writers:
+        write_lines = getattr(writer, "write_lines", None)
+        if write_lines is not None:
+            write_lines(lines)
+        else:
+            # e.g. BinlogWriter: needs the records back as dicts
+            for line in lines:
+                writer.write(json.loads(line))
+
+def run_sharded(kind, targets, workers, opts, logger=None, first_id=None):
+    """
+    Probe targets from workers processes and merge their records into logger.
+        kind: "ping" (MultiPinger per shard) or "trace" (trace_windows per target)
+        opts: the per-worker settings, see _ping_worker/_trace_worker; opts["qps_limit"]
+              is the total rate and is split evenly between the workers
+        first_id: ICMP id of the first worker (the rest follow it), see worker_ids
+    Returns (summaries, reports): each worker's per-target summaries merged into one dict,
+    and the list of the workers' schedule reports.
+    """
+    # Doubletree stop sets are per worker: keep neighbouring targets together
+    shards = split_targets(list(targets), max(1, workers), contiguous=opts.get("doubletree", False))
+    ids = worker_ids(len(shards), first_id)
+    # a raw socket gets a copy of every ICMP packet, so without the kernel filter on its id each
+    # worker would also parse every other worker's replies and adding workers would add work
+    opts = dict(opts, bpf=True, qps_limit=opts["qps_limit"] / len(shards) if opts["qps_limit"] > 0 else 0.0)
+
+    queue = multiprocessing.Queue()
+    procs = []
+    for worker, (ID, shard) in enumerate(zip(ids, shards)):
+        proc = multiprocessing.Process(target=_worker_main, args=(kind, worker, ID, shard, opts, queue),
+                                       name=f"{kind}-shard-{worker}", daemon=True)
+        proc.start()
+        procs.append(proc)
+
+    summaries = {}
+    reports = []
+    pending = set(range(len(procs)))
+    while pending:
+        try:
+            msg = queue.get(timeout=0.5)
+        except queue_mod.Empty:
+            # a worker killed outright never says "done"; one that exited cleanly already has
+            for worker in list(pending):
+                code = procs[worker].exitcode
+                if code is not None and code != 0:
+                    print(f"worker {worker} died (exit code {code})", file=sys.stderr)
+                    pending.discard(worker)
+            continue
+        except KeyboardInterrupt:
+            # the workers got the same Ctrl-C; keep collecting what they send before exiting
+            continue
+        if msg[0] == "lines":
+            if logger is not None and msg[2]:
+                _write_lines(logger, msg[2])
+            metrics.REGISTRY.merge(msg[3])
+        elif msg[0] == "done":
+            summaries.update(msg[2])
+            reports.append(msg[3])
+            pending.discard(msg[1])
+        else:
+            print(f"worker {msg[1]} failed:\n{msg[2]}", file=sys.stderr)
+            pending.discard(msg[1])
+
+    for proc in procs:
+        proc.join()
+    return summaries, reports
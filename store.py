@@ -0,0 +1,367 @@
+#!/usr/bin/env python3
+import argparse
+import ipaddress
+import json
+import math
+import os
+import socket
+import sqlite3
+import time
+from datetime import datetime
+
+from jsonhelper import (OnlineStats, iter_lines, load_overhead, print_ping_summary, print_trace_summary,
+                        binlog_for, complete_end, tail)
+
+# Query store: ping and trace logs (JSONL or binlog) loaded into one SQLite file, so a
+# question like "p99 to hop X for destination Y last Tuesday" reads an index and a few
+# rollups instead of re-scanning months of logs.
+#
+#   probes:  one row per record: kind, ts, dst, dst_ip, router_ip, ttl, probe, flow_id,
+#            rtt (only where the summarizers count one, else NULL), err, type; indexed on
+#            (dst_ip, ts), (router_ip, ttl), flow_id and ts
+#   rollups: [total, OnlineStats] per (kind, level, bucket, dst_ip, flow_id, ttl, router_ip)
+#            for day and hour buckets, kept up to date as files are ingested
+#   sources: how far each file (by device and inode, so a rotated file carries on) is ingested
+#
+# A query covers its window with whole days, then whole hours, from the rollups and reads
+# only the partial hours at either end from probes. Unknown values are stored as '' / -1 / 0
+# rather than NULL so they can be part of the rollup key.
+
+DEFAULT_DB = "probes.db"
+
+# rollup bucket sizes (s), coarsest first
+LEVELS = (86400, 3600)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sources (
+    dev INTEGER, inode INTEGER, path TEXT, kind TEXT, offset INTEGER, tail TEXT, ingested REAL,
+    PRIMARY KEY (dev, inode));
+CREATE TABLE IF NOT EXISTS probes (
+    kind TEXT, ts REAL, dst TEXT, dst_ip TEXT, router_ip TEXT, ttl INTEGER, probe INTEGER,
+    flow_id INTEGER, rtt REAL, err TEXT, type INTEGER);
+CREATE INDEX IF NOT EXISTS probes_dst_ts ON probes (dst_ip, ts);
+CREATE INDEX IF NOT EXISTS probes_router_ttl ON probes (router_ip, ttl);
+CREATE INDEX IF NOT EXISTS probes_flow ON probes (flow_id);
+CREATE INDEX IF NOT EXISTS probes_ts ON probes (ts);
+CREATE TABLE IF NOT EXISTS names (
+    dst TEXT, dst_ip TEXT,
+    PRIMARY KEY (dst, dst_ip));
+CREATE TABLE IF NOT EXISTS rollups (
+    kind TEXT, level INTEGER, bucket INTEGER, dst_ip TEXT, flow_id INTEGER, ttl INTEGER, router_ip TEXT,
+    total INTEGER, stats TEXT,
+    PRIMARY KEY (kind, level, dst_ip, bucket, flow_id, ttl, router_ip)) WITHOUT ROWID;
+"""
+
+def connect(path=DEFAULT_DB):
+    """open (creating if needed) the store at path"""
+    db = sqlite3.connect(path)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    db.executescript(SCHEMA)
+    return db
+
+def _records(path, start, end):
+    """the records of a log (JSONL or binlog) between two offsets, bad lines skipped"""
+    binlog = binlog_for(path)
+    if binlog is not None:
+        yield from binlog.iter_records(path, start, end)
+        return
+    for line in iter_lines(path, start, end):
+        try:
+            yield json.loads(line)
+        except Exception:
+            continue
+
+def _row(kind, obj):
+    """
+    a probes row for one record, or None for one the summarizers skip; the rtt column
+    follows scan_ping/scan_trace: ping counts it without an err, trace unless it timed out
+    """
+    rtt = obj.get("rtt", obj.get("rtt_ms"))
+    if kind == "ping":
+        ttl = 0
+        counted = rtt is not None and obj.get("err") is None
+    else:
+        # accept either "ttl" or "hop" field
+        ttl = obj.get("ttl") or obj.get("hop")
+        if ttl is None:
+            return None
+        counted = rtt is not None and obj.get("err") != "timeout"
+    flow_id = obj.get("flow_id", obj.get("id"))
+    return [kind, obj.get("ts", obj.get("ts_send")) or 0.0, obj.get("dst") or "", obj.get("dst_ip") or "",
+            obj.get("router_ip") or "", ttl, obj.get("probe"), -1 if flow_id is None else flow_id,
+            float(rtt) if counted else None, obj.get("err"), obj.get("type", obj.get("icmp_type"))]
+
+def _rows(kind, records):
+    """
+    probes rows for records in log order. Trace timeouts carry only their TTL: each takes the
+    destination of the next record that has one, if that is at the same or a higher TTL (the
+    same trace going on), else of the one before it.
+    """
+    last = None
+    pending = []
+    for obj in records:
+        row = _row(kind, obj)
+        if row is None:
+            continue
+        if row[3]:
+            for waiting in pending:
+                source = row if row[5] >= waiting[5] else last
+                if source is not None:
+                    waiting[2], waiting[3], waiting[7] = source[2], source[3], source[7]
+                yield waiting
+            pending = []
+            last = row
+            yield row
+        elif kind == "trace":
+            pending.append(row)
+        else:
+            yield row
+    for waiting in pending:
+        if last is not None:
+            waiting[2], waiting[3], waiting[7] = last[2], last[3], last[7]
+        yield waiting
+
+def _fold(rollups, row):
+    """add one probes row to the in-memory rollups"""
+    kind, ts, _, dst_ip, router_ip, ttl, _, flow_id, rtt = row[:9]
+    for level in LEVELS:
+        key = (kind, level, int(ts // level) * level, dst_ip, flow_id, ttl, router_ip)
+        entry = rollups.get(key)
+        if entry is None:
+            entry = rollups[key] = [0, OnlineStats()]
+        entry[0] += 1
+        if rtt is not None:
+            entry[1].add(rtt)
+
+def _save_rollups(db, rollups):
+    """merge in-memory rollups into the stored ones"""
+    for key, (total, stats) in rollups.items():
+        old = db.execute("SELECT total, stats FROM rollups WHERE kind=? AND level=? AND bucket=? AND dst_ip=? "
+                         "AND flow_id=? AND ttl=? AND router_ip=?", key).fetchone()
+        if old is not None:
+            total += old[0]
+            stats = OnlineStats.from_dict(json.loads(old[1])).merge(stats)
+        db.execute("INSERT OR REPLACE INTO rollups VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                   key + (total, json.dumps(stats.to_dict())))
+
+def ingest(db, kind, path, batch=50000):
+    """
+    Load what is new in one log into the store. A file seen before (same device and inode)
+    is read on from where the last ingest stopped; one truncated or rewritten since is read
+    from the start again. Returns the number of records added.
+    """
+    st = os.stat(path)
+    seen = db.execute("SELECT offset, tail FROM sources WHERE dev=? AND inode=?", (st.st_dev, st.st_ino)).fetchone()
+    offset = 0
+    if seen is not None and st.st_size >= seen[0] and tail(path, seen[0]) == seen[1]:
+        offset = seen[0]
+    # a live writer may be mid-line (binlog: mid-block); leave that for the next ingest
+    end = complete_end(path, offset)
+    if end <= offset:
+        return 0
+
+    count = 0
+    rows = []
+    rollups = {}
+    names = set()
+    with db:
+        for row in _rows(kind, _records(path, offset, end)):
+            rows.append(row)
+            _fold(rollups, row)
+            if row[2] and row[3]:
+                names.add((row[2], row[3]))
+            if len(rows) >= batch:
+                db.executemany("INSERT INTO probes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+                count += len(rows)
+                rows = []
+        db.executemany("INSERT INTO probes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        count += len(rows)
+        db.executemany("INSERT OR IGNORE INTO names VALUES (?, ?)", names)
+        _save_rollups(db, rollups)
+        db.execute("INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?, ?, ?, ?)",
+                   (st.st_dev, st.st_ino, os.path.abspath(path), kind, end, tail(path, end), time.time()))
+    return count
+
+def parse_time(text, now=None):
+    """
+    a window bound as epoch seconds: a number (epoch), an age ("90s", "15m", "6h", "7d": that
+    long ago) or an ISO date/time in local time ("2025-12-01", "2025-12-01T10:30")
+    """
+    now = time.time() if now is None else now
+    units = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+    try:
+        return float(text)
+    except ValueError:
+        pass
+    if text[-1:] in units:
+        try:
+            return now - float(text[:-1].lstrip("-")) * units[text[-1]]
+        except ValueError:
+            pass
+    return datetime.fromisoformat(text).timestamp()
+
+def cover(since, until, levels=LEVELS):
+    """
+    Split [since, until) into whole rollup buckets and the rest.
+    Returns ([(level, first bucket, end)], [(start, end) to read from probes]).
+    """
+    if since >= until:
+        return [], []
+    if not levels:
+        return [], [(since, until)]
+    level = levels[0]
+    lo = math.ceil(since / level) * level
+    hi = math.floor(until / level) * level
+    if lo >= hi:
+        return cover(since, until, levels[1:])
+    left, left_raw = cover(since, lo, levels[1:])
+    right, right_raw = cover(hi, until, levels[1:])
+    return left + [(level, lo, hi)] + right, left_raw + right_raw
+
+def dst_ips(db, dst):
+    """the addresses a --dst (address or name as logged) stands for"""
+    try:
+        return [str(ipaddress.ip_address(dst))]
+    except ValueError:
+        pass
+    ips = [ip for (ip,) in db.execute("SELECT dst_ip FROM names WHERE dst=?", (dst,))]
+    if not ips:
+        # e.g. single-target ping logs only carry the address
+        try:
+            ips = [socket.gethostbyname(dst)]
+        except (socket.gaierror, UnicodeError):
+            pass
+    return ips
+
+def _filters(dsts=None, router=None, flow_id=None, ttl=None):
+    """WHERE clauses and parameters shared by the rollup and probes queries"""
+    where = []
+    params = []
+    if dsts is not None:
+        where.append(f"dst_ip IN ({', '.join('?' * len(dsts))})")
+        params += dsts
+    for column, value in (("router_ip", router), ("flow_id", flow_id), ("ttl", ttl)):
+        if value is not None:
+            where.append(f"{column}=?")
+            params.append(value)
+    return where, params
+
+def query(db, kind, since=None, until=None, dsts=None, router=None, flow_id=None, ttl=None):
+    """
+    The stats scan_ping/scan_trace would give over the matching records with ts in [since, until)
+    (None = unbounded): (sent, recv, OnlineStats) for ping, {ttl: [total, OnlineStats]} for trace.
+        dsts: destination addresses; router, flow_id, ttl: only records with these
+    """
+    if since is None or until is None:
+        first, last = db.execute("SELECT MIN(ts), MAX(ts) FROM probes WHERE kind=?", (kind,)).fetchone()
+        if first is None:
+            return (0, 0, OnlineStats()) if kind == "ping" else {}
+        # widened to whole days, so an open window is all rollups
+        since = math.floor(first / LEVELS[0]) * LEVELS[0] if since is None else since
+        until = (math.floor(last / LEVELS[0]) + 1) * LEVELS[0] if until is None else until
+    where, params = _filters(dsts, router, flow_id, ttl)
+    buckets, raw = cover(since, until)
+
+    hops = {}
+    def hop(ttl):
+        entry = hops.get(ttl)
+        if entry is None:
+            entry = hops[ttl] = [0, OnlineStats()]
+        return entry
+
+    for level, lo, hi in buckets:
+        sql = " AND ".join(["kind=? AND level=? AND bucket>=? AND bucket<?"] + where)
+        for ttl_, total, stats in db.execute(f"SELECT ttl, total, stats FROM rollups WHERE {sql}",
+                                             [kind, level, lo, hi] + params):
+            entry = hop(ttl_)
+            entry[0] += total
+            entry[1].merge(OnlineStats.from_dict(json.loads(stats)))
+    for lo, hi in raw:
+        sql = " AND ".join(["kind=? AND ts>=? AND ts<?"] + where)
+        for ttl_, rtt in db.execute(f"SELECT ttl, rtt FROM probes WHERE {sql}", [kind, lo, hi] + params):
+            entry = hop(ttl_)
+            entry[0] += 1
+            if rtt is not None:
+                entry[1].add(rtt)
+
+    if kind == "ping":
+        # every ping record sits under ttl 0
+        sent, stats = hops.get(0, [0, OnlineStats()])
+        return sent, stats.n, stats
+    return hops
+
+def _label(db_path, args, since, until):
+    """what a query summary is 'for': the store, its filters and its window"""
+    parts = [f"{name}={value}" for name, value in (("dst", args.dst), ("router", args.router),
+                                                    ("flow_id", args.flow_id), ("ttl", getattr(args, "ttl", None)))
+             if value is not None]
+    def fmt(t):
+        return "..." if t is None else datetime.fromtimestamp(t).strftime("%Y-%m-%d %H:%M:%S")
+    if since is not None or until is not None:
+        parts.append(f"{fmt(since)} to {fmt(until)}")
+    return f"{db_path} [{', '.join(parts)}]" if parts else db_path
+
+def info(db):
+    """what the store holds: ingested files and per-kind record counts and time span"""
+    for path, kind, offset, ingested in db.execute("SELECT path, kind, offset, ingested FROM sources ORDER BY path"):
+        print(f"{kind:5} {path}: {offset} bytes, last ingested {datetime.fromtimestamp(ingested):%Y-%m-%d %H:%M:%S}")
+    for kind, n, first, last, dsts in db.execute("SELECT kind, COUNT(*), MIN(ts), MAX(ts), COUNT(DISTINCT dst_ip) "
+                                                 "FROM probes GROUP BY kind"):
+        print(f"{kind}: {n} records to {dsts} destinations, {datetime.fromtimestamp(first):%Y-%m-%d %H:%M:%S} "
+              f"to {datetime.fromtimestamp(last):%Y-%m-%d %H:%M:%S}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Indexed store of ping/trace logs with windowed summaries")
+    parser.add_argument("--db", type=str, default=DEFAULT_DB, help="SQLite store file")
+    sub = parser.add_subparsers(dest="op", required=True)
+
+    ing = sub.add_parser("ingest", help="Load new records from ping/trace logs (JSONL or binlog)")
+    ing.add_argument("--ping", nargs="*", help="ping logs")
+    ing.add_argument("--trace", nargs="*", help="trace logs")
+
+    for kind in ("ping", "trace"):
+        q = sub.add_parser(kind, help=f"Summarize stored {kind} records, as jsonhelper.py --{kind} does")
+        q.add_argument("--since", type=str, help="Window start: epoch, age (15m, 6h, 7d) or ISO local time")
+        q.add_argument("--until", type=str, help="Window end (exclusive), same forms")
+        q.add_argument("--dst", type=str, help="Destination address or name")
+        q.add_argument("--router", type=str, help="Only answers from this router address")
+        q.add_argument("--flow-id", type=int, help="Only probes with this flow id (ping: ICMP id)")
+        if kind == "trace":
+            q.add_argument("--ttl", type=int, help="Only this TTL")
+        q.add_argument("--overhead", type=str, metavar="PROFILE",
+                       help="self-overhead profile from calibrate.py --save, as for jsonhelper.py")
+
+    sub.add_parser("info", help="Show the ingested files and what the store holds")
+    args = parser.parse_args()
+
+    db = connect(args.db)
+    try:
+        if args.op == "ingest":
+            for kind, path in [("ping", p) for p in args.ping or []] + [("trace", p) for p in args.trace or []]:
+                started = time.perf_counter()
+                n = ingest(db, kind, path)
+                print(f"{path}: {n} {kind} records ingested in {time.perf_counter() - started:.2f}s")
+        elif args.op == "info":
+            info(db)
+        else:
+            if args.overhead:
+                load_overhead(args.overhead)
+            since = parse_time(args.since) if args.since else None
+            until = parse_time(args.until) if args.until else None
+            dsts = None
+            if args.dst is not None:
+                dsts = dst_ips(db, args.dst)
+                if not dsts:
+                    parser.error(f"no address known for {args.dst}")
+            result = query(db, args.op, since, until, dsts, args.router, args.flow_id, getattr(args, "ttl", None))
+            label = _label(args.db, args, since, until)
+            if args.op == "ping":
+                print_ping_summary(label, *result)
+            else:
+                print_trace_summary(label, result)
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    main()
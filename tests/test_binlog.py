@@ -0,0 +1,57 @@
+import json
+
+import binlog
+import jsonhelper
+
+
+def ping_record(i, ts):
+    # as MultiPinger logs an answered probe
+    return {"ts_send": ts, "dst": "example.com", "dst_ip": "93.184.216.34", "id": 4242, "seq": i,
+            "icmp_type": 0, "icmp_code": 0, "ts_recv": ts + 0.02, "ttl_reply": 55, "size": 64,
+            "rtt": 20.123, "tool": "ping", "ts": ts}
+
+
+def trace_record(ttl, ts):
+    return {"tool": "trace", "ts": ts, "dst": "example.com", "dst_ip": "93.184.216.34", "ttl": ttl,
+            "probe": 1, "flow_id": 7, "ts_send": ts, "ts_recv": ts + 0.01, "src": f"10.0.0.{ttl}",
+            "router_ip": f"10.0.0.{ttl}", "router_name": None, "rtt": 10.0 * ttl, "payload_ts": ts,
+            "type": 11, "code": 0, "err": None}
+
+
+def test_write_then_scan_round_trip(tmp_path):
+    records = [ping_record(i, 1000.0 + i) for i in range(10)]
+    records[3] = {"ts_send": 1003.0, "dst": "example.com", "dst_ip": "93.184.216.34", "id": 4242, "seq": 3,
+                  "err": "Request timed out. after: 1.0s", "tool": "ping", "ts": 1003.0}
+    records += [trace_record(ttl, 2000.0 + ttl) for ttl in range(1, 4)]
+    records.append({"tool": "trace", "ts": 2004.0, "ttl": 4, "err": "timeout"})
+    path = str(tmp_path / "mixed.bin")
+    # small blocks, so the scan crosses block boundaries
+    with binlog.BinlogWriter(path, block_rows=4) as w:
+        for rec in records:
+            w.write(dict(rec))
+    assert binlog.is_binlog(path)
+    assert list(binlog.iter_records(path)) == records
+
+    jsonl = tmp_path / "mixed.jsonl"
+    jsonl.write_text("".join(json.dumps(r) + "\n" for r in records[:10]))
+    sent, recv, stats = binlog.scan_ping(path)
+    j_sent, j_recv, j_stats = jsonhelper.scan_ping(str(jsonl))
+    # the trace rows count as probes too, as they would in a mixed JSONL file
+    assert (sent - 4, recv - 3) == (j_sent, j_recv) == (10, 9)
+    assert binlog.scan_trace(path)[2][1].summary()["avg"] == 20.0
+
+
+def test_one_qps_stream_stays_smaller_than_jsonl(tmp_path, monkeypatch):
+    # an hour at 1 qps on a fake clock, with the default timed flush
+    now = [1.7e9]
+    monkeypatch.setattr(binlog.time, "time", lambda: now[0])
+    path = tmp_path / "ping.bin"
+    jsonl_bytes = 0
+    with binlog.BinlogWriter(str(path), default_fields={"tool": "ping"}) as w:
+        for i in range(3600):
+            now[0] += 1
+            rec = ping_record(i, now[0])
+            jsonl_bytes += len(json.dumps(rec)) + 1
+            w.write(rec)
+    assert path.stat().st_size < 0.5 * jsonl_bytes
+    assert len(list(binlog.read_blocks(str(path)))) <= 61
@@ -0,0 +1,52 @@
+import json
+
+import jsonhelper
+
+
+def ping_line(seq, rtt=None):
+    obj = {"ts_send": 1000.0 + seq, "dst_ip": "192.0.2.1", "id": 1, "seq": seq, "tool": "ping"}
+    if rtt is None:
+        obj["err"] = "Request timed out. after: 1.0s"
+    else:
+        obj["rtt"] = rtt
+    return json.dumps(obj) + "\n"
+
+
+def summary(merged):
+    sent, recv, stats = merged
+    return sent, recv, stats.summary()
+
+
+def test_sumstate_resumes_where_it_stopped(tmp_path, monkeypatch):
+    path = tmp_path / "ping.jsonl"
+    path.write_text("".join(ping_line(i, 10.0 + i) for i in range(5)) + ping_line(5))
+    first = jsonhelper.summarize_incremental("ping", str(path))
+    assert first["offset"] == path.stat().st_size
+    assert jsonhelper.load_state(str(path)) == first
+
+    # a record and half of the next one (a writer mid-line) are appended
+    with open(path, "a") as f:
+        f.write(ping_line(6, 16.0) + ping_line(7, 17.0)[:10])
+    scanned = []
+    scan, merge, show = jsonhelper._SCANNERS["ping"]
+
+    def spy(p, start, end):
+        scanned.append((start, end))
+        return scan(p, start, end)
+    monkeypatch.setitem(jsonhelper._SCANNERS, "ping", (spy, merge, show))
+    merged, state = jsonhelper.update_incremental("ping", str(path), first)
+    # only the new complete line was read
+    assert scanned == [(first["offset"], state["offset"])]
+    assert state["offset"] == path.stat().st_size - 10
+    assert summary(merged) == summary(jsonhelper.scan_ping(str(path), 0, state["offset"]))
+    assert merged[:2] == (7, 6)
+
+
+def test_sumstate_starts_over_after_truncation(tmp_path):
+    path = tmp_path / "ping.jsonl"
+    path.write_text("".join(ping_line(i, 5.0) for i in range(4)))
+    _, state = jsonhelper.update_incremental("ping", str(path))
+    path.write_text("".join(ping_line(i, 50.0) for i in range(6)))
+    merged, _ = jsonhelper.update_incremental("ping", str(path), state)
+    assert merged[:2] == (6, 6)
+    assert merged[2].summary()["avg"] == 50.0
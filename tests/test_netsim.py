@@ -0,0 +1,51 @@
+import time
+
+import pytest
+
+import multiping
+import netsim
+import ping
+import traceroute
+from scheduler import ProbeScheduler
+
+
+def test_sim_socket_replaces_raw_sockets_only_while_installed():
+    with netsim.SimNetwork(hops=2):
+        sock = ping.icmp_socket()
+        assert isinstance(sock, netsim.SimSocket)
+        sock.close()
+    assert ping._transport is None
+
+
+def test_ping_session_offline():
+    with netsim.SimNetwork(hops=3, latency=2):
+        with ping.PingSession("192.0.2.1") as session:
+            results = [session.ping(1.0, seq) for seq in range(3)]
+    for result in results:
+        assert result.get("err") is None
+        assert result["rtt"] > 0
+
+
+def test_multipinger_offline_with_loss():
+    records = []
+    with netsim.SimNetwork(hops=2, latency=1, loss=0.5, seed=4):
+        pinger = multiping.MultiPinger(["192.0.2.1", "192.0.2.2"], count=10, interval=0.01, timeout=0.2)
+        pinger.run(lambda target, result: records.append(result))
+    answered = [r for r in records if "rtt" in r]
+    assert len(records) == 20
+    assert 0 < len(answered) < 20
+    assert all(r["err"].startswith("Request timed out") for r in records if "rtt" not in r)
+    assert not pinger.inflight and not pinger.deadlines
+
+
+@pytest.mark.parametrize("one_at_a_time", [True, False])
+def test_trace_offline_reaches_destination(one_at_a_time):
+    with netsim.SimNetwork(hops=4, latency=1, silent=(2,)):
+        sink = traceroute.RecordSink(None, echo=False)
+        sched = ProbeScheduler(clock=time.time)
+        records = traceroute.trace_windows("192.0.2.7", "192.0.2.7", 10, 0.3, 1, 0, 21, sink, sched,
+                                           1 if one_at_a_time else 10, one_at_a_time=one_at_a_time)
+    assert [r["ttl"] for r in records] == [1, 2, 3, 4, 5]
+    assert records[1]["err"] == "timeout"
+    assert [r["type"] for r in records if "type" in r] == [11, 11, 11, 0]
+    assert records[-1]["src"] == "192.0.2.7"
@@ -0,0 +1,106 @@
+import struct
+
+import ping
+
+IP_HEAD = bytes([0x45]) + bytes(19)
+
+
+def naive_checksum(data):
+    # RFC 1071 the slow way: sum 16-bit words, fold carries, complement
+    if len(data) & 1:
+        data += b"\0"
+    total = sum(struct.unpack(f"!{len(data) // 2}H", data))
+    while total >> 16:
+        total = (total & 0xffff) + (total >> 16)
+    return ~total & 0xffff
+
+
+def test_checksum_matches_rfc1071():
+    for data in (b"", b"\x01", b"\xff\xff", b"\x45\x00\x00\x1c\x00\x00", bytes(range(255))):
+        assert ping.checksum(data) == naive_checksum(data)
+
+
+def test_checksum_of_intact_packet_verifies():
+    head = struct.pack("!BBHHH", 8, 0, 0, 77, 3) + b"payload!"
+    packet = head[:2] + struct.pack("!H", ping.checksum(head)) + head[4:]
+    assert ping.verify_icmp_checksum(packet)
+    assert not ping.verify_icmp_checksum(packet[:-1] + b"?")
+
+
+def test_checksum_update_matches_recompute():
+    data = bytearray(b"\x08\x00\x00\x00\x12\x34\x00\x01abcdefgh")
+    csum = ping.checksum(data)
+    for old_off, new in ((6, b"\xff\xfe"), (8, b"zyxwvuts"), (4, b"\x00\x00")):
+        old = bytes(data[old_off:old_off + len(new)])
+        csum = ping.checksum_update(csum, old, new)
+        data[old_off:old_off + len(new)] = new
+        assert csum == ping.checksum(data)
+
+
+def test_echo_template_checksum_is_incremental_but_exact():
+    template = ping.EchoTemplate(0xBEEF, padding=5)
+    for seq, ts in ((0, 0.0), (1, 1764633223.8066509), (0xFFFF, -1.5), (0x1234, 1e300)):
+        packet = template.build(seq, ts)
+        assert ping.verify_icmp_checksum(packet)
+        assert struct.unpack_from("!BBHHH", packet)[3:] == (0xBEEF, seq)
+        assert struct.unpack_from("d", packet, 8)[0] == ts
+
+
+def run_bpf(prog, pkt):
+    """just enough of a classic BPF interpreter for icmp_id_filter's opcodes"""
+    A = X = pc = 0
+    while True:
+        code, jt, jf, k = prog[pc]
+        pc += 1
+        if code == 0xb1:
+            X = 4 * (pkt[k] & 0xf)
+        elif code == 0x50:
+            A = pkt[X + k]
+        elif code == 0x48:
+            A = int.from_bytes(pkt[X + k:X + k + 2], "big")
+        elif code == 0x15:
+            pc += jt if A == k else jf
+        elif code == 0x54:
+            A &= k
+        elif code == 0x64:
+            A <<= k
+        elif code == 0x0c:
+            A += X
+        elif code == 0x07:
+            X = A
+        elif code == 0x06:
+            return k
+        else:
+            raise AssertionError(f"unexpected opcode {code:#x}")
+
+
+def echo(icmp_type, ID, seq=1):
+    return struct.pack("!BBHHH", icmp_type, 0, 0, ID, seq) + bytes(8)
+
+
+def quoting(icmp_type, inner):
+    return struct.pack("!BBHI", icmp_type, 0, 0, 0) + IP_HEAD + inner
+
+
+def test_icmp_id_filter_accepts_only_our_id():
+    prog = ping.icmp_id_filter(4242)
+    accepted = lambda icmp: run_bpf(prog, IP_HEAD + icmp) != 0
+    assert accepted(echo(0, 4242))
+    assert not accepted(echo(0, 4243))
+    assert accepted(quoting(11, echo(8, 4242)))
+    assert accepted(quoting(3, echo(8, 4242)))
+    assert not accepted(quoting(11, echo(8, 1)))
+    # a quote of something other than an Echo Request, and other types, are dropped
+    assert not accepted(quoting(11, echo(0, 4242)))
+    assert not accepted(echo(8, 4242))
+    # options in the outer header move everything along
+    assert run_bpf(prog, bytes([0x46]) + bytes(23) + echo(0, 4242)) != 0
+
+
+def test_decode_reply_reads_quoted_probe():
+    inner = ping.EchoTemplate(9).build(0x0302, 12.5)
+    fields = ping.decode_reply(IP_HEAD + quoting(11, inner))
+    assert fields[0] == 11
+    assert fields[2:4] == (9, 0x0302)
+    assert fields[6] == 12.5
+    assert ping.decode_reply(IP_HEAD[:19]) is None
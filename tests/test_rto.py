@@ -0,0 +1,42 @@
+import pytest
+
+from rto import RttEstimator, RtoTable
+
+
+def test_rtt_estimator_follows_rfc6298():
+    est = RttEstimator()
+    assert est.rto() is None
+    est.update(0.1)
+    assert (est.srtt, est.rttvar) == (0.1, 0.05)
+    assert est.rto() == pytest.approx(0.1 + 4 * 0.05)
+    est.update(0.2)
+    assert est.rttvar == pytest.approx(0.75 * 0.05 + 0.25 * 0.1)
+    assert est.srtt == pytest.approx(0.875 * 0.1 + 0.125 * 0.2)
+
+
+def test_rtt_estimator_converges_on_steady_rtt():
+    est = RttEstimator()
+    for _ in range(200):
+        est.update(0.05)
+    assert est.rto() == pytest.approx(0.05, rel=1e-6)
+
+
+def test_rto_table_falls_back_backs_off_and_clamps():
+    table = RtoTable(max_rto=2.0, min_rto=0.1, initial=1.0)
+    assert table.timeout("d", 3) == 1.0
+    table.update("d", 5, 40.0)
+    # hop 3 never answered: it borrows the path's estimate, doubled per timeout
+    assert table.timeout("d", 3) == pytest.approx(0.04 + 4 * 0.02)
+    table.backoff("d", 3)
+    table.backoff("d", 3)
+    assert table.timeout("d", 3) == pytest.approx(4 * (0.04 + 4 * 0.02))
+    # a tiny estimate is clamped up to min_rto, a long backoff down to max_rto
+    for _ in range(100):
+        table.update("d", 5, 1.0)
+    assert table.timeout("d", 5) == 0.1
+    for _ in range(20):
+        table.backoff("d", 3)
+    assert table.timeout("d", 3) == 2.0
+    # a sample resets the backoff
+    table.update("d", 3, 1.0)
+    assert table.hops[("d", 3)].backoffs == 0
@@ -0,0 +1,91 @@
+import select
+import time
+
+import pytest
+
+import netsim
+import traceroute
+from scheduler import ProbeScheduler, TokenBucket
+
+
+class FakeClock:
+    def __init__(self, now=100.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def test_token_bucket_is_a_virtual_schedule():
+    clock = FakeClock()
+    bucket = TokenBucket(10, clock=clock)
+    assert [bucket.reserve() for _ in range(3)] == pytest.approx([100.0, 100.1, 100.2])
+    # idle time doesn't bank tokens beyond burst
+    clock.now = 105.0
+    assert [bucket.reserve() for _ in range(2)] == pytest.approx([105.0, 105.1])
+
+
+def test_token_bucket_burst_and_unlimited():
+    clock = FakeClock()
+    bucket = TokenBucket(1, burst=3, clock=clock)
+    assert [bucket.reserve() for _ in range(4)] == pytest.approx([100.0, 100.0, 100.0, 101.0])
+    assert TokenBucket(0, clock=clock).reserve() == 100.0
+    assert TokenBucket(0).next_time() == float("-inf")
+
+
+def test_probe_scheduler_keeps_its_grid_and_measures_lateness():
+    clock = FakeClock()
+    sched = ProbeScheduler(interval=1.0, clock=clock, sleep=clock.sleep)
+    dues = []
+    late = []
+    for k in range(4):
+        due = sched.wait()
+        dues.append(due)
+        # each probe takes 0.25 s to go out, the second 2.5 s
+        clock.now += 2.5 if k == 1 else 0.25
+        late.append(sched.sent(due))
+    # a slow probe doesn't shift the grid: the ones after it go at once until caught up
+    assert dues == pytest.approx([100.0, 101.0, 102.0, 103.0])
+    assert late == pytest.approx([250.0, 2500.0, 1750.0, 1000.0])
+
+
+def test_probe_scheduler_shared_bucket_caps_both():
+    clock = FakeClock()
+    shared = TokenBucket(2, clock=clock)
+    a = ProbeScheduler(rate=100, shared=shared, clock=clock, sleep=clock.sleep)
+    b = ProbeScheduler(rate=100, shared=shared, clock=clock, sleep=clock.sleep)
+    for _ in range(3):
+        a.sent(a.wait())
+        b.sent(b.wait())
+    assert clock.now == pytest.approx(102.5)
+    assert a.achieved_rate() == pytest.approx(1.0)
+
+
+class SlowSelect:
+    """select() that wakes up delay seconds late, like a loaded host"""
+    def __init__(self, delay):
+        self.delay = delay
+
+    def select(self, r, w, x, timeout):
+        ready = select.select(r, w, x, timeout)
+        time.sleep(self.delay)
+        return ready
+
+
+def test_send_window_lateness_includes_wakeup_delay(monkeypatch):
+    monkeypatch.setattr(traceroute, "select", SlowSelect(0.02))
+    # replies take longer than a token, so each select sleeps until the next one is due
+    with netsim.SimNetwork(hops=3, latency=100):
+        send_sock, recv_sock = traceroute.open_trace_sockets()
+        try:
+            sched = ProbeScheduler(rate=50, clock=time.time)
+            traceroute.send_window(send_sock, recv_sock, "192.0.2.9", range(1, 4), 2, 1.0, 50, 11, sched=sched)
+        finally:
+            send_sock.close()
+            recv_sock.close()
+    # every probe after the first waited for its token in select and came back 20 ms late
+    assert sched.lateness.n == 6
+    assert sched.lateness.summary()["p50"] >= 15.0
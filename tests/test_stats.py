@@ -0,0 +1,66 @@
+import math
+import random
+
+import pytest
+
+from jsonhelper import LogHistogram, OnlineStats
+
+
+def exact(values, q):
+    ordered = sorted(values)
+    return ordered[max(1, math.ceil(q * len(ordered))) - 1]
+
+
+@pytest.mark.parametrize("q", [0.01, 0.5, 0.9, 0.99, 0.999, 1.0])
+def test_log_histogram_within_relative_error(q):
+    rng = random.Random(1)
+    values = [rng.lognormvariate(3, 1) for _ in range(20000)]
+    h = LogHistogram(rel_err=0.01)
+    for x in values:
+        h.add(x)
+    assert h.percentile(q) == pytest.approx(exact(values, q), rel=0.01)
+
+
+def test_log_histogram_add_many_and_merge_agree_with_add():
+    rng = random.Random(2)
+    values = [rng.expovariate(0.1) for _ in range(5000)] + [0.0] * 10
+    one = LogHistogram()
+    for x in values:
+        one.add(x)
+    bulk = LogHistogram()
+    bulk.add_many(values)
+    halves = LogHistogram()
+    halves.add_many(values[:1234])
+    other = LogHistogram()
+    other.add_many(values[1234:])
+    halves.merge(other)
+    for h in (bulk, halves, LogHistogram.from_dict(one.to_dict())):
+        assert (h.n, h.zero, h.counts) == (one.n, one.zero, one.counts)
+    assert LogHistogram().percentile(0.5) is None
+    with pytest.raises(ValueError):
+        one.merge(LogHistogram(rel_err=0.02))
+
+
+def test_online_stats_merge_matches_one_pass():
+    rng = random.Random(3)
+    values = [rng.gauss(20, 5) for _ in range(1000)]
+    whole = OnlineStats()
+    for x in values:
+        whole.add(x)
+    merged = OnlineStats()
+    for chunk in (values[:1], values[1:400], [], values[400:]):
+        merged.merge(OnlineStats.from_values(chunk))
+    a, b = whole.summary(), merged.summary()
+    for key in ("count", "min", "max"):
+        assert a[key] == b[key]
+    for key in ("avg", "stddev", "p50", "p99"):
+        assert a[key] == pytest.approx(b[key], rel=1e-9)
+    restored = OnlineStats.from_dict(merged.to_dict()).summary()
+    assert restored == b
+
+
+def test_online_stats_percentiles_clamped_to_min_max():
+    stats = OnlineStats.from_values([10.0])
+    s = stats.summary()
+    assert s["p50"] == s["p99.9"] == 10.0
+    assert OnlineStats().summary()["p50"] is None
@@ -0,0 +1,29 @@
+from store import cover
+
+DAY, HOUR = 86400, 3600
+
+
+def covered(parts):
+    rollups, raw = parts
+    spans = [(lo, hi) for _, lo, hi in rollups] + raw
+    return sorted(spans)
+
+
+def test_cover_prefers_the_coarsest_whole_buckets():
+    since, until = 2 * DAY - 90 * 60 + 17, 5 * DAY + 2 * HOUR + 30
+    rollups, raw = cover(since, until)
+    assert rollups == [(HOUR, 2 * DAY - HOUR, 2 * DAY), (DAY, 2 * DAY, 5 * DAY), (HOUR, 5 * DAY, 5 * DAY + 2 * HOUR)]
+    assert raw == [(since, 2 * DAY - HOUR), (5 * DAY + 2 * HOUR, until)]
+
+
+def test_cover_tiles_the_window_exactly():
+    for since, until in ((0, DAY), (10, 20), (HOUR - 1, HOUR + 1), (123456, 9876543), (DAY, DAY + HOUR)):
+        spans = covered(cover(since, until))
+        assert spans[0][0] == since and spans[-1][1] == until
+        assert all(a[1] == b[0] for a, b in zip(spans, spans[1:]))
+
+
+def test_cover_inside_one_bucket_or_empty():
+    assert cover(10, 20) == ([], [(10, 20)])
+    assert cover(20, 20) == ([], [])
+    assert cover(0, HOUR, levels=()) == ([], [(0, HOUR)])
@@ -1,141 +1,226 @@
 import socket
 import os
 import sys
-import struct
 import time
-import concurrent.futures
+import select
+import math
+from array import array
+from collections import deque
 
 # from mytrace import JsonlLogger
-from ping import calculate_icmp_checksum
+from ping import echo_template, decode_reply, enable_rx_timestamps, attach_id_filter, icmp_socket, PacketReader
+from jsonhelper import OnlineStats, format_percentiles
+from scheduler import ProbeScheduler
+from rdns import shared_resolver
+import metrics
 
-# simple per-process cache for reverse lookups
-_RDNS_CACHE = {}
+METRICS = metrics.ProbeMetrics("trace")
+# per record with rdns on: was the router's name already in the cache when its record came in
+RDNS_HITS = metrics.counter("rdns_cache_hits_total", "Hop records whose router name was already cached")
+RDNS_MISSES = metrics.counter("rdns_cache_misses_total", "Hop records whose router name had to be looked up")
 
 def reverse_lookup(ip, timeout_ms=200):
-    """return PTR name for ip or None on timeout/error, using cache"""
-    if ip in _RDNS_CACHE:
-        return _RDNS_CACHE[ip]
-    if timeout_ms <= 0:
-        try:
-            name = socket.gethostbyaddr(ip)[0]
-            _RDNS_CACHE[ip] = name
-            return name
-        except Exception:
-            _RDNS_CACHE[ip] = None
-            return None
-    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as ex:
-        fut = ex.submit(socket.gethostbyaddr, ip)
-        try:
-            name = fut.result(timeout=timeout_ms / 1000.0)[0]
-            _RDNS_CACHE[ip] = name
-            return name
-        except Exception:
-            _RDNS_CACHE[ip] = None
-            return None
+    """return PTR name for ip or None on timeout/error, via the shared resolver pool and cache"""
+    return shared_resolver().lookup(ip, timeout_ms)
+
+class RecordSink:
+    """
+    Logs and prints records in probe order. With rdns, the PTR lookup for a record's
+    router_ip starts as soon as it is added (if a prefetch hasn't already started it) and
+    the record is held back until the name is in or rdns_timeout_ms has passed, so probing
+    carries on while names resolve instead of waiting for each one.
+    """
+    def __init__(self, logger=None, rdns=False, rdns_timeout_ms=200, echo=True):
+        self.logger = logger
+        self.resolver = shared_resolver() if rdns else None
+        self.rdns_timeout = rdns_timeout_ms / 1000.0
+        self.echo = echo
+        # (record, deadline)
+        self.queue = deque()
+
+    def add(self, record):
+        ip = record.get("router_ip")
+        if self.resolver is not None and ip:
+            (RDNS_MISSES if self.resolver.prefetch(ip) else RDNS_HITS).inc()
+        self.queue.append((record, time.monotonic() + self.rdns_timeout))
+        self.pump()
+
+    def pump(self, wait=False):
+        """emit every record at the head of the queue that is ready (wait: all of them, up to their deadlines)"""
+        while self.queue:
+            record, deadline = self.queue[0]
+            ip = record.get("router_ip")
+            if self.resolver is not None and ip:
+                if not self.resolver.done(ip):
+                    remaining = deadline - time.monotonic()
+                    if remaining > 0 and not wait:
+                        return
+                    # flushing: wait out the rest of its budget, if any
+                    name = self.resolver.lookup(ip, remaining * 1000.0) if remaining > 0 else None
+                else:
+                    name = self.resolver.cached(ip)
+                if name:
+                    record["router_name"] = name
+            self.queue.popleft()
+            if self.logger:
+                self.logger.jsonl_write(record)
+            if self.echo:
+                print_response(record)
+
+    def flush(self):
+        self.pump(wait=True)
 
 ICMP_ECHO_REQUEST = 8
 
-def build_packet(flow_id=0):
+def probe_id(flow_id=0):
+    # Paris-style: use flow_id as identifier if provided, otherwise use PID
+    return flow_id if flow_id != 0 else (os.getpid() & 0xFFFF)
+
+def build_packet(flow_id=0, seq=1, timestamp=None):
     # In the sendOnePing() method of the ICMP Ping exercise ,firstly the header of our
     # packet to be sent was made, secondly the checksum was appended to the header and
     # then finally the complete packet was sent to the destination.
-    # Make the header in a similar way to the ping exercise.
-    # Append checksum to the header.
-    # Paris-style: use flow_id as identifier if provided, otherwise use PID
-    ID = flow_id if flow_id != 0 else (os.getpid() & 0xFFFF)
-    header = struct.pack("!BBHHH", ICMP_ECHO_REQUEST, 0, 0, ID, 1)
-    data = struct.pack("d", time.time())
-    # Calculate the checksum on the data and the dummy header.
-    # Note: calculate_icmp_checksum already handles htons conversion
-    myChecksum = calculate_icmp_checksum(header + data)
-
-    header = struct.pack("!BBHHH", ICMP_ECHO_REQUEST, 0, myChecksum, ID, 1)
-    packet = header + data
-    return packet
+    # Same as ping: a per-ID template patches seq + timestamp and updates the
+    # checksum incrementally, so the header is only packed once.
+    # timestamp: the send time carried in the payload (default now), for matching replies
+    return echo_template(probe_id(flow_id)).build(seq & 0xFFFF, time.time() if timestamp is None else timestamp)
+
+def probe_seq(ttl, probe):
+    """pack TTL (high byte) and probe number (low byte) into the ICMP seq"""
+    return ((ttl & 0xFF) << 8) | (probe & 0xFF)
+
+def make_record(hostname, dest_ip, ttl, probe_num, flow_id, send_time, recv_time, fields, addr, rtt=None):
+    """
+    build the per-probe record for a probe that got an answer
+        fields: the reply as decoded by ping.decode_reply (None if it couldn't be)
+        rtt: ms from a monotonic clock if the caller has one (default: wall-clock difference)
+    """
+    if rtt is None:
+        rtt = (recv_time - send_time) * 1000.0
+    src = addr[0]
+    icmp_type, icmp_code, payload_timestamp, error = reply_fields(fields)
+    return {
+        "dst": hostname,
+        "dst_ip": dest_ip,
+        "ttl": ttl,
+        "probe": probe_num,
+        "flow_id": flow_id,
+        "ts_send": send_time,
+        "ts_recv": recv_time,
+        "src": src,
+        "router_ip": src,
+        "router_name": None,
+        "rtt": rtt,
+        "payload_ts": payload_timestamp,
+        "type": icmp_type,
+        "code": icmp_code,
+        "err": error
+    }
+
+def answer_record(hostname, dest_ip, key, flow_id, answer):
+    """the record for probe key = (ttl, probe) from its send_window answer (None = timed out)"""
+    if answer is None:
+        return {
+            "ttl": key[0],
+            "err": "timeout"
+        }
+    fields, addr, send_time, recv_time, rtt = answer
+    return make_record(hostname, dest_ip, key[0], key[1], flow_id, send_time, recv_time, fields, addr, rtt=rtt)
 
 
 # def get_route(hostname, max_ttl, timeout, probes, qps_limit, flow_id, logger: JsonlLogger):
-def get_route(hostname, max_ttl, timeout, probes, qps_limit, flow_id, logger=None, no_resolve=False, rdns=False):
+def get_route(hostname, max_ttl, timeout, probes, qps_limit, flow_id, logger=None, no_resolve=False, rdns=False,
+              kernel_ts=False, bpf=False, rto=None, gap_limit=0):
     dest_ip = socket.gethostbyname(hostname)
-    icmp = socket.getprotobyname("icmp")
     responses = []
 
     print(f"Traceroute to {hostname} ({dest_ip}) with max-ttl={max_ttl}, probes={probes}, timeout={timeout}s, qps={qps_limit}, flow_id={flow_id}, no_resolve={no_resolve}, rdns={rdns}")
 
     done = False
-
+    # token bucket: only waits for whatever of 1/qps the previous probe didn't already use up
+    sched = ProbeScheduler(rate=qps_limit)
+    # reverse DNS (if requested and not disabled) resolves while the next probes go out
+    sink = RecordSink(logger, rdns=rdns and not no_resolve)
+
+    if rto is not None:
+        # adaptive timeouts keep one socket pair for the whole trace, so an answer that
+        # comes after its probe's RTO can still be matched to it
+        sched = ProbeScheduler(rate=qps_limit, clock=time.time)
+        responses = trace_windows(hostname, dest_ip, max_ttl, timeout, probes, qps_limit, flow_id, sink, sched, 1,
+                                  one_at_a_time=True, kernel_ts=kernel_ts, bpf=bpf, rto=rto, gap_limit=gap_limit)
+        sink.flush()
+        summarize_responses(responses)
+        print(sched.report())
+        return
+
+    # consecutive hops that didn't answer
+    gap = 0
     for ttl in range(1, max_ttl + 1):
+        answered = False
         for tries in range(probes):
             probe_num = tries + 1
             send_sock = None
             recv_sock = None
-            # naïve QPS limit (avoid div-by-zero)
-            sleep_interval = (1.0 / qps_limit) if qps_limit > 0 else 0.0
-            time.sleep(sleep_interval)
+            due = sched.wait()
 
             try:
                 # create sockets & set TTL/timeout
-                send_sock = socket.socket(socket.AF_INET, socket.SOCK_RAW, icmp)
-                recv_sock = socket.socket(socket.AF_INET, socket.SOCK_RAW, icmp)
+                send_sock = icmp_socket()
+                recv_sock = icmp_socket()
                 # recv timeout for this attempt
                 recv_sock.settimeout(timeout)
+                rx_ts = kernel_ts and enable_rx_timestamps(recv_sock)
+                if bpf:
+                    attach_id_filter(recv_sock, probe_id(flow_id))
+                reader = PacketReader(recv_sock, 4096, rx_ts)
                 send_sock.setsockopt(socket.SOL_IP, socket.IP_TTL, ttl)
 
                 # build ICMP packet & send
                 pkt = build_packet(flow_id)
                 send_time = time.time()
+                send_ns = time.perf_counter_ns()
                 send_sock.sendto(pkt, (dest_ip, 0))
-
-                # blocking recv w/ timeout on recv_sock
-                recPacket, addr = recv_sock.recvfrom(4096)
-                recv_time = time.time()
+                METRICS.sent.inc()
+                late = sched.sent(due)
+
+                # blocking recv w/ timeout on recv_sock, passing over packets that don't answer
+                # our probes (other processes' ICMP, or our own request when tracing loopback)
+                deadline_ns = send_ns + int(timeout * 1e9)
+                while True:
+                    recv_sock.settimeout(max((deadline_ns - time.perf_counter_ns()) / 1e9, 1e-6))
+                    started = time.perf_counter()
+                    try:
+                        n, addr, recv_time, recv_ns = reader.recv()
+                    finally:
+                        METRICS.select_time.observe(time.perf_counter() - started)
+                    METRICS.received.inc()
+                    fields = decode_reply(reader.view, n)
+                    if fields is None or (fields[0] in (0, 3, 11) and fields[2] == probe_id(flow_id)):
+                        break
+                    METRICS.foreign.inc()
 
             except socket.timeout:
+                METRICS.timeouts.inc()
                 response_record = {
                     "ttl": ttl,
-                    "err": "timeout"
+                    "err": "timeout",
+                    "sched_late": late
                 }
-                print_response(response_record)
                 responses.append(response_record)
-                if logger:
-                    logger.jsonl_write(response_record)
+                sink.add(response_record)
                 continue
             else:
-                rtt = (recv_time - send_time) * 1000.0
                 src = addr[0]
-                icmp_type, icmp_code, payload_timestamp, error = parse_response(recPacket)
-
-                response_record = {
-                    "dst": hostname,
-                    "dst_ip": dest_ip,
-                    "ttl": ttl,
-                    "probe": probe_num,
-                    "flow_id": flow_id,
-                    "ts_send": send_time,
-                    "ts_recv": recv_time,
-                    "src": src,
-                    "router_ip": src,
-                    "router_name": None,
-                    "rtt": rtt,
-                    "payload_ts": payload_timestamp,
-                    "type": icmp_type,
-                    "code": icmp_code,
-                    "err": error
-                }
-                # responses.append(response_record)
-                # logger.jsonl_write(response_record)
-
-
-                # perform reverse DNS if requested and not disabled
-                if rdns and not no_resolve:
-                    name = reverse_lookup(src, timeout_ms=200)
-                    if name:
-                        response_record["router_name"] = name
+                response_record = make_record(hostname, dest_ip, ttl, probe_num, flow_id,
+                                              send_time, recv_time, fields, addr,
+                                              rtt=(recv_ns - send_ns) / 1e6)
+                response_record["sched_late"] = late
+                icmp_type = response_record["type"]
+                answered = True
+                METRICS.replies.inc()
 
                 responses.append(response_record)
-                if logger:
-                    logger.jsonl_write(response_record)
-                print_response(response_record)
+                sink.add(response_record)
 
                 # stop early if destination replied
                 if icmp_type == 0 and src == dest_ip:
@@ -157,104 +242,505 @@ def get_route(hostname, max_ttl, timeout, probes, qps_limit, flow_id, logger=Non
 
         if done:
             break
+        gap = 0 if answered else gap + 1
+        if gap_limit and gap >= gap_limit:
+            print(f"Stopping after {gap} silent hops")
+            break
+
+    sink.flush()
+    summarize_responses(responses)
+    print(sched.report())
+
+# receive buffer for the window/adaptive receive socket, as in multiping
+RCVBUF = 4 * 1024 * 1024
+
+def open_trace_sockets(filter_id=None):
+    """
+    one send socket (TTL set per probe) and one non-blocking receive socket
+        filter_id: if set, the receive socket only gets replies to probes with this ICMP id (BPF)
+    """
+    send_sock = icmp_socket()
+    recv_sock = icmp_socket()
+    recv_sock.setblocking(False)
+    # a window's replies arrive in one burst; the default buffer drops some past ~200 probes
+    try:
+        recv_sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RCVBUF)
+    except OSError:
+        pass
+    if filter_id is not None:
+        attach_id_filter(recv_sock, filter_id)
+    return send_sock, recv_sock
+
+def send_window(send_sock, recv_sock, dest_ip, ttls, probes, timeout, qps_limit, flow_id, first_probe=1, sched=None,
+                kernel_ts=False, prefetch=None, rto=None, late=None, linger=False):
+    """
+    Send every probe for the TTLs in ttls in one burst and collect the replies on recv_sock.
+    Replies are matched back by the (ttl, probe) packed into the ICMP seq.
+        first_probe: number of the first probe per TTL (probes first_probe..first_probe+probes-1)
+        sched: ProbeScheduler (clock=time.time) pacing the sends, so the rate limit carries
+               over from one window to the next; default a fresh one at qps_limit
+        kernel_ts: recv_sock has rx timestamps on (ping.enable_rx_timestamps)
+        prefetch: called with each answering router's ip as it arrives (e.g. Resolver.prefetch)
+        rto: rto.RtoTable; each probe is given up on after its adaptive RTO instead of timeout
+             and every answer feeds the estimators
+        late: {seq: ...} of probes past their RTO but not yet timeout old. Answers to them are
+              still accepted (also in later calls given the same dict); the caller reports a
+              probe as timed out once it answered nothing and its seq has left late
+        linger: don't return while anything in late can still be answered
+    Returns {(ttl, probe): (fields, addr, send_time, recv_time, rtt)} for answered probes,
+    fields as from ping.decode_reply and rtt in ms from the perf_counter send time to the
+    (kernel, if enabled) receive time.
+    Stops early once the destination answered and every lower TTL is settled.
+    """
+    ID = probe_id(flow_id)
+    unsent = deque((ttl, p) for ttl in ttls for p in range(first_probe, first_probe + probes))
+    # seq -> (ttl, probe, send_time, send_ns, deadline_ns); timeouts run on the perf_counter
+    # clock with the RTTs, send_time (wall clock) is only for the records
+    pending = {}
+    timeout_ns = int(timeout * 1e9)
+    if late is None:
+        late = {}
+    answers = {}
+    dest_ttl = None
+    if sched is None:
+        sched = ProbeScheduler(rate=qps_limit, clock=time.time)
+    reader = PacketReader(recv_sock, 4096, kernel_ts)
+    m = METRICS
+    # unlimited probes are due as the window starts, rate-limited ones as their token comes up
+    # (but no earlier than that: tokens left over from before the call aren't lateness)
+    window_start = time.time()
+
+    while True:
+        now = time.time()
+        # nothing past the destination is worth sending
+        while dest_ttl is not None and unsent and unsent[-1][0] > dest_ttl:
+            unsent.pop()
+
+        while unsent and now >= sched.ready_at():
+            ttl, probe_num = unsent.popleft()
+            seq = probe_seq(ttl, probe_num)
+            # taken before the send, so lateness covers select wakeup and loop delay too
+            due = max(sched.ready_at(), window_start)
+            send_sock.setsockopt(socket.SOL_IP, socket.IP_TTL, ttl)
+            wait = rto.timeout(dest_ip, ttl) if rto is not None else timeout
+            send_time = time.time()
+            pkt = build_packet(flow_id, seq, send_time)
+            send_ns = time.perf_counter_ns()
+            send_sock.sendto(pkt, (dest_ip, 0))
+            METRICS.sent.inc()
+            sched.take(send_time)
+            sched.sent(due, send_time)
+            pending[seq] = (ttl, probe_num, send_time, send_ns, send_ns + int(wait * 1e9))
+            now = send_time
+
+        # drop probes that ran out of time (reported as timeouts by the caller); past only
+        # their RTO they stay answerable in late until timeout
+        now_ns = time.perf_counter_ns()
+        for seq, entry in list(pending.items()):
+            ttl, _, _, send_ns, deadline_ns = entry
+            if deadline_ns <= now_ns:
+                del pending[seq]
+                if rto is not None:
+                    rto.backoff(dest_ip, ttl)
+                if rto is not None and send_ns + timeout_ns > now_ns:
+                    late[seq] = entry
+                else:
+                    METRICS.timeouts.inc()
+            elif dest_ttl is not None and ttl > dest_ttl:
+                del pending[seq]
+        for seq, entry in list(late.items()):
+            if entry[3] + timeout_ns <= now_ns:
+                del late[seq]
+                METRICS.timeouts.inc()
+
+        if not unsent and not pending and not (linger and late):
+            return answers
+
+        # seconds until the next deadline (perf_counter) or token (sched's wall clock)
+        wake = [entry[4] for entry in pending.values()]
+        if linger:
+            wake.extend(entry[3] + timeout_ns for entry in late.values())
+        wait = (min(wake) - time.perf_counter_ns()) / 1e9 if wake else math.inf
+        if unsent:
+            wait = min(wait, sched.ready_at() - time.time())
+        started = time.perf_counter()
+        what_ready = select.select([recv_sock], [], [], max(0.0, wait))
+        m.select_time.observe(time.perf_counter() - started)
+        if not what_ready[0]:
+            continue
+
+        started = time.perf_counter()
+        while True:
+            try:
+                n, addr, recv_time, recv_ns = reader.recv()
+            except (BlockingIOError, InterruptedError):
+                break
+            m.received.inc()
+            fields = decode_reply(reader.view, n)
+            if fields is None:
+                m.short.inc()
+                continue
+            icmp_type, _, reply_id, reply_seq, _, icmp_off, payload_ts = fields
+            # type 8 is our own request seen on loopback
+            if icmp_type not in (0, 3, 11) or reply_id != ID:
+                m.foreign.inc()
+                continue
+            if icmp_type == 0 and addr[0] != dest_ip:
+                m.foreign.inc()
+                continue
+            in_late = reply_seq not in pending
+            entry = pending.get(reply_seq) or late.get(reply_seq)
+            # a timestamp (echoed, or in the quote if it wasn't cut short) that isn't this probe's
+            # belongs to an earlier one with the same id and seq
+            if entry is None or (payload_ts is not None and payload_ts != entry[2]):
+                m.stale.inc()
+                continue
+            if not reader.verify(n, icmp_off):
+                m.checksum.inc()
+                continue
+            if in_late:
+                del late[reply_seq]
+                m.late.inc()
+            else:
+                del pending[reply_seq]
+            m.replies.inc()
+            ttl, probe_num, send_time, send_ns, _ = entry
+            rtt = (recv_ns - send_ns) / 1e6
+            answers[(ttl, probe_num)] = (fields, addr, send_time, recv_time, rtt)
+            if rto is not None:
+                rto.update(dest_ip, ttl, rtt)
+            if prefetch is not None:
+                prefetch(addr[0])
+            if icmp_type == 0 and (dest_ttl is None or ttl < dest_ttl):
+                dest_ttl = ttl
+        m.parse_time.observe(time.perf_counter() - started)
+
+def trace_windows(hostname, dest_ip, max_ttl, timeout, probes, qps_limit, flow_id, sink, sched, window,
+                  one_at_a_time=False, kernel_ts=False, bpf=False, rto=None, gap_limit=0, socks=None):
+    """
+    Trace over one socket pair, window TTLs at a time, handing the records to sink in
+    (ttl, probe) order; returns them. Stops at the first TTL that reaches the destination.
+        sched: ProbeScheduler with clock=time.time
+        one_at_a_time: send the probes one by one instead of a window's worth in one burst
+        rto: rto.RtoTable for adaptive timeouts. A probe's record then waits until it was
+             answered or timeout has passed, so answers that come after its RTO aren't lost
+        gap_limit: stop after this many consecutive TTLs without an answer (0 = never)
+        socks: (send, receive) socket pair to use instead of opening one (left open, and
+               its filter left to the caller)
+    """
+    responses = []
+    # probes sent whose records haven't gone to the sink yet, in order
+    keys = deque()
+    answers = {}
+    late = {} if rto is not None else None
+    reached = False
+    gap = 0
+    prefetch = sink.resolver.prefetch if sink.resolver is not None else None
+
+    def emit():
+        while keys:
+            key = keys[0]
+            answer = answers.get(key)
+            if answer is None and late and probe_seq(*key) in late:
+                # may still be answered
+                return
+            keys.popleft()
+            response_record = answer_record(hostname, dest_ip, key, flow_id, answer)
+            responses.append(response_record)
+            sink.add(response_record)
+            if answer is not None and response_record["type"] == 0 and response_record["src"] == dest_ip:
+                keys.clear()
+
+    def send(ttls, n, first_probe=1):
+        nonlocal reached
+        keys.extend((ttl, p) for ttl in ttls for p in range(first_probe, first_probe + n))
+        got = send_window(send_sock, recv_sock, dest_ip, ttls, n, timeout, qps_limit, flow_id,
+                          first_probe=first_probe, sched=sched, kernel_ts=rx_ts, prefetch=prefetch,
+                          rto=rto, late=late)
+        answers.update(got)
+        reached = reached or any(a[0][0] == 0 and a[1][0] == dest_ip for a in got.values())
+        emit()
+
+    if socks is None:
+        send_sock, recv_sock = open_trace_sockets(probe_id(flow_id) if bpf else None)
+    else:
+        send_sock, recv_sock = socks
+    rx_ts = kernel_ts and enable_rx_timestamps(recv_sock)
+    try:
+        for first_ttl in range(1, max_ttl + 1, window):
+            ttls = range(first_ttl, min(first_ttl + window, max_ttl + 1))
+            if one_at_a_time:
+                for ttl in ttls:
+                    for probe_num in range(1, probes + 1):
+                        send([ttl], 1, probe_num)
+                        if reached:
+                            break
+                    if reached:
+                        break
+            else:
+                send(ttls, probes)
+            if reached:
+                break
+            # silent hops in a row, counted on what answered within the RTO
+            for ttl in ttls:
+                answered = any((ttl, p) in answers for p in range(1, probes + 1))
+                gap = 0 if answered else gap + 1
+            if gap_limit and gap >= gap_limit:
+                print(f"Stopping after {gap} silent hops")
+                break
+        if late:
+            # give the probes still inside their timeout the rest of it
+            answers.update(send_window(send_sock, recv_sock, dest_ip, [], 0, timeout, qps_limit, flow_id,
+                                       sched=sched, kernel_ts=rx_ts, prefetch=prefetch,
+                                       rto=rto, late=late, linger=True))
+        emit()
+    finally:
+        if socks is None:
+            send_sock.close()
+            recv_sock.close()
+    return responses
+
+def get_route_parallel(hostname, max_ttl, timeout, probes, qps_limit, flow_id, logger=None, no_resolve=False, rdns=False, window=0,
+                       kernel_ts=False, bpf=False, rto=None, gap_limit=0):
+    """
+    mtr/scamper-style traceroute: probes for a whole window of TTLs are in flight at once
+    and answered on a single receive socket. Produces the same records and summary as get_route.
+        window: number of TTLs probed together (0 = all of 1..max_ttl)
+        rto, gap_limit: adaptive timeouts and silent-hop limit, see trace_windows
+    """
+    if not 1 <= max_ttl <= 255 or not 1 <= probes <= 255:
+        raise ValueError("parallel traceroute needs max_ttl and probes in 1..255")
+    dest_ip = socket.gethostbyname(hostname)
+    window = window if window > 0 else max_ttl
+
+    print(f"Traceroute to {hostname} ({dest_ip}) with max-ttl={max_ttl}, probes={probes}, timeout={timeout}s, qps={qps_limit}, flow_id={flow_id}, no_resolve={no_resolve}, rdns={rdns}, window={window}")
+
+    # one rate limit for the whole trace, not restarted per window
+    sched = ProbeScheduler(rate=qps_limit, clock=time.time)
+    # PTR lookups start as each router first answers, in parallel with the rest of the window
+    sink = RecordSink(logger, rdns=rdns and not no_resolve)
+    responses = trace_windows(hostname, dest_ip, max_ttl, timeout, probes, qps_limit, flow_id, sink, sched, window,
+                              kernel_ts=kernel_ts, bpf=bpf, rto=rto, gap_limit=gap_limit)
 
+    sink.flush()
     summarize_responses(responses)
+    print(sched.report())
+
+class HopRing:
+    """
+    Fixed-memory history for one hop: the last size RTTs in a preallocated array
+    (NaN = no reply) plus OnlineStats over everything since the start.
+    """
+    def __init__(self, size):
+        self.rtts = array('d', [math.nan]) * size
+        self.pos = 0
+        self.filled = 0
+        self.sent = 0
+        self.stats = OnlineStats()
+        self.router_ip = None
+        self.router_name = None
+
+    def add(self, rtt, router_ip=None, router_name=None):
+        """record one probe: rtt in ms, or None if it went unanswered"""
+        self.sent += 1
+        self.rtts[self.pos] = math.nan if rtt is None else rtt
+        self.pos = (self.pos + 1) % len(self.rtts)
+        self.filled = min(self.filled + 1, len(self.rtts))
+        if rtt is not None:
+            self.stats.add(rtt)
+        if router_ip is not None:
+            self.router_ip = router_ip
+            self.router_name = router_name
+
+    def last(self):
+        return self.rtts[self.pos - 1] if self.filled else math.nan
+
+    def recent(self):
+        """(loss %, mean rtt) over the samples still in the ring"""
+        if self.filled == len(self.rtts):
+            window = self.rtts
+        else:
+            window = self.rtts[:self.filled]
+        got = [x for x in window if x == x]
+        loss = (len(window) - len(got)) / len(window) * 100.0 if len(window) else 0.0
+        return loss, (math.fsum(got) / len(got) if got else math.nan)
+
+def _ms(x):
+    return "     -" if x is None or x != x else f"{x:6.1f}"
+
+def print_hop_table(hostname, dest_ip, rings, cycle, out=sys.stdout):
+    """one mtr-style screen: lifetime loss/latency per hop plus the last-N window"""
+    if out.isatty():
+        # redraw in place: cursor home + clear screen
+        out.write("\x1b[H\x1b[2J")
+    size = len(next(iter(rings.values())).rtts) if rings else 0
+    out.write(f"{hostname} ({dest_ip})  cycle {cycle}  {time.strftime('%Y-%m-%d %H:%M:%S')}\n")
+    out.write(f"{'TTL':>3}  {'Host':<40} {'Loss%':>6} {'Snt':>5} {'Last':>6} {'Avg':>6} {'Best':>6} {'Wrst':>6} {'StDev':>6} {'p99':>6}  {'Loss%':>6} {'Avg':>6} (last {size})\n")
+    for ttl in sorted(rings):
+        ring = rings[ttl]
+        if ring.router_ip is None:
+            host = "???"
+        elif ring.router_name:
+            host = f"{ring.router_name} ({ring.router_ip})"
+        else:
+            host = ring.router_ip
+        loss = (ring.sent - ring.stats.n) / ring.sent * 100.0 if ring.sent else 0.0
+        st = ring.stats.summary()
+        recent_loss, recent_avg = ring.recent()
+        out.write(f"{ttl:3d}  {host[:40]:<40} {loss:6.1f} {ring.sent:5d} {_ms(ring.last())} {_ms(st['avg'])} {_ms(st['min'])} {_ms(st['max'])} {_ms(st['stddev'] if st['count'] else None)} {_ms(st['p99'])}  {recent_loss:6.1f} {_ms(recent_avg)}\n")
+    out.flush()
+
+def watch_route(hostname, max_ttl, timeout, qps_limit, flow_id, logger=None, no_resolve=False, rdns=False,
+                history=100, interval=1.0, cycles=0, out=sys.stdout, kernel_ts=False, bpf=False, rto=None):
+    """
+    Continuous (mtr-style) traceroute: every interval seconds one probe goes to each hop
+    up to the destination, results go into per-hop HopRings and the table is redrawn.
+    Nothing grows with run time, so it can be left running indefinitely.
+        history: samples kept per hop for the recent loss/avg columns
+        cycles: stop after this many rounds (0 = until interrupted)
+        rto: rto.RtoTable; a round waits for each hop only as long as its adaptive RTO. Hops
+             still inside timeout are kept answerable across rounds and go into their ring
+             once they answer or time out
+    Returns the rings, {ttl: HopRing}.
+    """
+    if not 1 <= max_ttl <= 255:
+        raise ValueError("continuous traceroute needs max_ttl in 1..255")
+    dest_ip = socket.gethostbyname(hostname)
+    rings = {}
+    # last TTL the destination answered at; probing stops there until the path changes
+    dest_ttl = None
+    cycle = 0
+    # rounds run on a fixed schedule, so a slow one doesn't push every later one back;
+    # probes within them share one rate limit across rounds
+    rounds = ProbeScheduler(interval=interval)
+    sched = ProbeScheduler(rate=qps_limit, clock=time.time)
+    # names show up in the table (and the log) once resolved; rounds never wait on them
+    sink = RecordSink(logger, rdns=rdns and not no_resolve, echo=False)
+    resolver = sink.resolver
+    prefetch = resolver.prefetch if resolver is not None else None
+    # with adaptive RTOs: probes past their RTO but inside timeout (see send_window), and the
+    # (ttl, probe) of earlier rounds' hops still waiting on them
+    late = {} if rto is not None else None
+    waiting = set()
+
+    def record(key, answer):
+        """add probe key's outcome to its hop's ring and the log; True if it reached dest_ip"""
+        ring = rings.get(key[0])
+        if ring is None:
+            ring = rings[key[0]] = HopRing(history)
+        response_record = answer_record(hostname, dest_ip, key, flow_id, answer)
+        if answer is None:
+            ring.add(None)
+        else:
+            addr = answer[1]
+            name = resolver.cached(addr[0]) if resolver is not None else None
+            ring.add(response_record["rtt"], addr[0], name)
+        sink.add(response_record)
+        return answer is not None and response_record["type"] == 0 and response_record["src"] == dest_ip
+
+    def settle(answers):
+        """record the waiting probes that answered or ran out of time; the lowest TTL that reached"""
+        reached = None
+        for key in sorted(waiting):
+            answer = answers.get(key)
+            if answer is None and probe_seq(*key) in late:
+                continue
+            waiting.discard(key)
+            if record(key, answer) and (reached is None or key[0] < reached):
+                reached = key[0]
+        return reached
 
-def summarize_responses(responses):
-    print("\nSummary statistics:")
-    stats = {}
+    send_sock, recv_sock = open_trace_sockets(probe_id(flow_id) if bpf else None)
+    rx_ts = kernel_ts and enable_rx_timestamps(recv_sock)
+    try:
+        while cycles <= 0 or cycle < cycles:
+            rounds.sent(rounds.wait())
+            cycle += 1
+            # the probe number cycles through 1..255 so a late reply can't be taken for this round's
+            probe_num = (cycle - 1) % 255 + 1
+            ttls = range(1, (dest_ttl or max_ttl) + 1)
+            answers = send_window(send_sock, recv_sock, dest_ip, ttls, 1, timeout, qps_limit, flow_id,
+                                  first_probe=probe_num, sched=sched, kernel_ts=rx_ts, prefetch=prefetch,
+                                  rto=rto, late=late)
+
+            # earlier rounds' hops that answered late (or gave up) go in first
+            reached = settle(answers) if waiting else None
+            for ttl in ttls:
+                key = (ttl, probe_num)
+                answer = answers.get(key)
+                if answer is None and late and probe_seq(*key) in late:
+                    # may still answer during a later round
+                    waiting.add(key)
+                    continue
+                if record(key, answer):
+                    reached = ttl if reached is None else min(reached, ttl)
+                    break
+
+            # path got shorter: forget hops past the destination so the table (and memory) follow it
+            if reached is not None:
+                for ttl in [t for t in rings if t > reached]:
+                    del rings[ttl]
+                waiting.difference_update([key for key in waiting if key[0] > reached])
+            dest_ttl = reached
+
+            print_hop_table(hostname, dest_ip, rings, cycle, out)
+        if late:
+            # give the last round's stragglers the rest of their timeout
+            settle(send_window(send_sock, recv_sock, dest_ip, [], 0, timeout, qps_limit, flow_id,
+                               sched=sched, kernel_ts=rx_ts, prefetch=prefetch, rto=rto, late=late,
+                               linger=True))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        send_sock.close()
+        recv_sock.close()
+
+    sink.flush()
+    print_hop_stats({ttl: [ring.sent, ring.stats] for ttl, ring in rings.items()})
+    print(sched.report())
+    return rings
+
+def tally_responses(responses, hops=None):
+    """fold records into per-TTL [total, OnlineStats] tallies (no raw RTT lists)"""
+    hops = {} if hops is None else hops
     for resp in responses:
         ttl = resp['ttl']
-        if ttl not in stats:
-            stats[ttl] = {'rtts': [], 'total': 0}
-        stats[ttl]['total'] += 1
+        hop = hops.get(ttl)
+        if hop is None:
+            hop = hops[ttl] = [0, OnlineStats()]
+        hop[0] += 1
         if 'rtt' in resp:
-            stats[ttl]['rtts'].append(resp['rtt'])
-
-    for ttl in sorted(stats.keys()):
-        data = stats[ttl]
-        rtts = data['rtts']
-        total = data['total']
-        loss_pct = (total - len(rtts)) / total * 100.0
+            hop[1].add(resp['rtt'])
+    return hops
 
-        if rtts:
-            min_rtt = min(rtts)
-            max_rtt = max(rtts)
-            avg_rtt = sum(rtts) / len(rtts)
-
-            stddev = 0.0
-            if len(rtts) > 1:
-                variance = sum((x - avg_rtt) ** 2 for x in rtts) / (len(rtts) - 1)
-                stddev = variance ** 0.5
+def print_hop_stats(hops):
+    print("\nSummary statistics:")
+    for ttl in sorted(hops.keys()):
+        total, stats = hops[ttl]
+        loss_pct = (total - stats.n) / total * 100.0
 
-            print(f"TTL {ttl}: min = {min_rtt:.3f} avg = {avg_rtt:.3f} max = {max_rtt:.3f} stddev = {stddev:.3f} ms, Loss = {loss_pct:.1f}%")
+        if stats.n:
+            s = stats.summary()
+            print(f"TTL {ttl}: min = {s['min']:.3f} avg = {s['avg']:.3f} max = {s['max']:.3f} stddev = {s['stddev']:.3f} ms, Loss = {loss_pct:.1f}%, {format_percentiles(s, sep=' ', eq=' = ')} ms")
         else:
             print(f"TTL {ttl}: Loss = {loss_pct:.1f}%")
 
+def summarize_responses(responses):
+    print_hop_stats(tally_responses(responses))
 
-def parse_response(recPacket):
-    icmp_type = None
-    icmp_code = None
-    payload_timestamp = None
-    error = None
-
-    try:
-        if len(recPacket) < 20:
-            return icmp_type, icmp_code, payload_timestamp, "short packet"
-
-        internet_header_length = (recPacket[0] & 0x0F) * 4
-        if len(recPacket) < internet_header_length + 8:
-            return icmp_type, icmp_code, payload_timestamp, "short ICMP"
-
-        icmp_offset = internet_header_length
-        try:
-            r_type, r_code, r_cksum, r_id, r_seq = struct.unpack("!BBHHH", recPacket[icmp_offset:icmp_offset + 8])
-        except struct.error:
-            return icmp_type, icmp_code, payload_timestamp, "unpack error"
-
-        icmp_type = r_type
-        icmp_code = r_code
-
-        if icmp_type == 0:
-            # echo reply (dest reached)
-            payload = recPacket[icmp_offset + 8:]
-            if len(payload) >= 8:
-                try:
-                    payload_timestamp = struct.unpack("d", payload[:8])[0]
-                except Exception:
-                    pass
-
-        if r_type in (11, 3):
-            # Time exceeded or dest unreachable: parse inner packet
-            inner_off = icmp_offset + 8
-            if len(recPacket) >= inner_off + 20:
-                inner_ihl = (recPacket[inner_off] & 0x0F) * 4
-                inner_icmp_off = inner_off + inner_ihl
-                                # inner packet: try to parse inner ICMP header if at least 8 bytes present
-                if len(recPacket) >= inner_icmp_off + 8:
-                    try:
-                        _, _, _, inner_id, inner_seq = struct.unpack("!BBHHH", recPacket[inner_icmp_off:inner_icmp_off + 8])
-                        # inner payload may be truncated; try to extract timestamp if available
-                        inner_payload = recPacket[inner_icmp_off + 8:inner_icmp_off + 16]
-                        if len(inner_payload) >= 8:
-                            try:
-                                payload_timestamp = struct.unpack("d", inner_payload[:8])[0]
-                            except Exception:
-                                error = "timestamp unpack error"
-                        else:
-                            # truncated payload is OK: not a fatal error for traceroute stats
-                            error = None
-                    except struct.error:
-                        error = "unpack error"
-                else:
-                    error = "packet too small"
-            else:
-                error = "packet too small"
-    except Exception:
-        error = "parsing Exception"
 
+def reply_fields(fields):
+    """(icmp_type, icmp_code, payload_timestamp, error) for the records, from ping.decode_reply() fields"""
+    if fields is None:
+        return None, None, None, "short packet"
+    icmp_type, icmp_code, inner_id, _, _, _, payload_timestamp = fields
+    # Time exceeded / dest unreachable that doesn't quote enough of our request to match it
+    error = "packet too small" if icmp_type in (11, 3) and inner_id is None else None
     return icmp_type, icmp_code, payload_timestamp, error
 
+def parse_response(recPacket):
+    return reply_fields(decode_reply(recPacket))
+
 
 def print_response(response):
     msg = ""